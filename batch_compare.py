@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines vectorized path comparison kernels.
+
+All paths of a collector are packed into padded integer matrices so the K
+compare counters and edit distances are computed with array operations
+instead of one Python call per prefix.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+from itertools import chain
+
+import numpy as np
+
+# Value used to pad paths shorter than the matrix width
+PAD = -1
+
+
+def pack_paths(paths, reverse=False):
+    """Packs a list of AS paths into a padded matrix.
+    Parameters:
+    paths  A list of lists of 32-bit integer ASNs
+    reverse  If True, each path is stored last hop first
+
+    Returns:
+    matrix  A 2D int64 array with one path per row, padded with PAD.
+    lengths  A 1D int64 array of path lengths.
+    """
+    lengths = np.fromiter(map(len, paths), dtype=np.int64, count=len(paths))
+    total = int(lengths.sum())
+    width = int(lengths.max()) if len(paths) else 0
+    matrix = np.full((len(paths), width), PAD, dtype=np.int64)
+    if total:
+        flat = np.fromiter(chain.from_iterable(paths), dtype=np.int64, count=total)
+        rows = np.repeat(np.arange(len(paths)), lengths)
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cols = np.arange(total) - starts
+        if reverse:
+            cols = lengths[rows] - 1 - cols
+        matrix[rows, cols] = flat
+    return matrix, lengths
+
+
+def _hop_counts(hops, size):
+    """Counts occurences of each hop index below size."""
+    return np.bincount(hops, minlength=size)[:size]
+
+
+def k_compare(mrt_m, mrt_len, ext_m, ext_len, inf_l, size):
+    """Vectorized K compare with failure classification.
+    Parameters:
+    mrt_m, mrt_len  Packed MRT paths, as returned by pack_paths
+    ext_m, ext_len  Packed extrapolated paths
+    inf_l  A 1D array of inference lengths of the extrapolated paths
+    size  Number of hops tracked by the counters
+
+    Returns:
+    k  Successes up to the Kth hop
+    l  Failures at the Kth hop
+    seed_f  Seeding failures at the Kth hop
+    prop_f  Propagation failures at the Kth hop
+    first  Index of the first mismatching hop for each row
+    has_diff  Boolean mask of rows with a mismatching hop
+    """
+    first, has_diff, prop = k_hops(mrt_m, mrt_len, ext_m, ext_len, inf_l)
+    k, l, seed_f, prop_f = k_counts(first, has_diff, prop, ext_len, size)
+    return k, l, seed_f, prop_f, first, has_diff
+
+
+def k_hops(mrt_m, mrt_len, ext_m, ext_len, inf_l):
+    """Finds the first mismatching hop of each row, see k_compare.
+
+    Returns:
+    first  Index of the first mismatching hop for each row
+    has_diff  Boolean mask of rows with a mismatching hop
+    prop  Boolean mask of mismatches within the inferred part of the path
+    """
+    first, has_diff = first_diff(mrt_m, mrt_len, ext_m, ext_len)
+    prop = has_diff & (ext_len - first <= inf_l)
+    return first, has_diff, prop
+
+
+def first_diff(mrt_m, mrt_len, ext_m, ext_len):
+    """Finds the first mismatching hop of each row, without the inference check of k_hops."""
+    common = np.minimum(mrt_len, ext_len)
+    width = min(mrt_m.shape[1], ext_m.shape[1])
+    # No rows, or an empty path on one side of every row
+    if width == 0:
+        return common, np.zeros(len(common), dtype=bool)
+    diff = mrt_m[:, :width] != ext_m[:, :width]
+    diff &= np.arange(width) < common[:, None]
+    has_diff = diff.any(axis=1)
+    # Number of matching hops before the first mistake
+    first = np.where(has_diff, diff.argmax(axis=1), common)
+    return first, has_diff
+
+
+def k_counts(first, has_diff, prop, ext_len, size):
+    """Sums per row K compare results into the Verifier counters.
+
+    Hops at or past size are not counted, as in Verifier.k_compare. The
+    absent relationship check still counts every mismatch.
+
+    Returns:
+    k, l, seed_f, prop_f  Counters of length size, see k_compare.
+    """
+    # k[i] counts rows with more than i matching hops
+    at_least = np.bincount(first, minlength=size + 1)[::-1].cumsum()[::-1]
+    k = at_least[1:size + 1]
+    l = _hop_counts(first[has_diff], size)
+    # Empty propagated paths fail at the first hop
+    l[0] += int(np.count_nonzero(ext_len == 0))
+
+    prop_f = _hop_counts(first[prop], size)
+    seed_f = _hop_counts(first[has_diff & ~prop], size)
+    return k, l, seed_f, prop_f
+
+
+def distances(mrt_m, mrt_len, ext_m, ext_len):
+    """Vectorized edit distance, identical to edit_distance.distance.
+    Parameters:
+    mrt_m, mrt_len  Packed MRT paths, as returned by pack_paths
+    ext_m, ext_len  Packed extrapolated paths
+
+    Returns:
+    result  A 1D int64 array of edit distances.
+    """
+    n = len(mrt_len)
+    res = ext_len.copy()
+    if n == 0:
+        return res
+    mrt_w = int(mrt_len.max())
+    ext_w = int(ext_len.max())
+    prev = np.tile(np.arange(ext_w + 1, dtype=np.int64), (n, 1))
+    cur = np.empty_like(prev)
+    for i in range(1, mrt_w + 1):
+        cur[:, 0] = i
+        mrt_col = mrt_m[:, i - 1]
+        for j in range(1, ext_w + 1):
+            sub = prev[:, j - 1] + (mrt_col != ext_m[:, j - 1])
+            # If MRT is longer, need to add
+            if i > j:
+                np.minimum(prev[:, j] + 1, sub, out=cur[:, j])
+            # If Prop is longer, need to subtract
+            elif j > i:
+                np.minimum(cur[:, j - 1] + 1, sub, out=cur[:, j])
+            # If equal length, only perform substitution
+            else:
+                cur[:, j] = sub
+        done = np.flatnonzero(mrt_len == i)
+        res[done] = cur[done, ext_len[done]]
+        prev, cur = cur, prev
+    return res
+
+
+def running_mean(avg, values, counts):
+    """Applies the Verifier running average update to a sequence of values.
+    Parameters:
+    avg  Current average
+    values  Iterable of new values
+    counts  Iterable of the sample count used for each update
+
+    Returns:
+    avg  The updated average, bit-identical to the per-prefix updates.
+    """
+    for x, count in zip(values, counts):
+        avg = avg + (x - avg) / count
+    return avg
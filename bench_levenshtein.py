@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module benchmarks the AS path edit distance.
+
+The iterative edit_distance engine is compared with the recursive, memoized
+function previously used by Verifier.levenshtein_opt on paths of 1-12 hops.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import sys
+import random
+import timeit
+import tracemalloc
+
+import edit_distance
+
+
+def memoize(func):
+    mem = {}
+    def memoizer(*args, **kwargs):
+        key = str(args) + str(kwargs)
+        if key not in mem:
+            mem[key] = func(*args, **kwargs)
+        return mem[key]
+    memoizer.mem = mem
+    return memoizer
+
+@memoize
+def levenshtein_recursive(mrt_path, prop_path):
+    """The original recursive Verifier.levenshtein_opt, kept as a reference."""
+    prop_l = len(prop_path)
+    mrt_l = len(mrt_path)
+    if not mrt_path:
+        return prop_l
+    if not prop_path:
+        return mrt_l
+    if mrt_path[-1] == prop_path[-1]:
+        cost = 0
+    else:
+        cost = 1
+    if mrt_l > prop_l:
+        res = min([levenshtein_recursive(mrt_path[:-1], prop_path) + 1,
+                   levenshtein_recursive(mrt_path[:-1], prop_path[:-1]) + cost])
+    elif prop_l > mrt_l:
+        res = min([levenshtein_recursive(mrt_path, prop_path[:-1]) + 1,
+                   levenshtein_recursive(mrt_path[:-1], prop_path[:-1]) + cost])
+    else:
+        res = min([levenshtein_recursive(mrt_path[:-1], prop_path[:-1]) + cost])
+    return res
+
+
+def gen_pairs(n, seed=0):
+    """Generates pairs of related AS paths of 1-12 hops.
+    Parameters:
+    n  Number of pairs
+    seed  Random seed
+
+    Returns:
+    pairs  A list of (MRT path, extrapolated path) tuples.
+    """
+    rand = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        mrt_path = [rand.randint(1, 400000) for _ in range(rand.randint(1, 12))]
+        ext_path = list(mrt_path)
+        # Perturb a few hops, as an extrapolator mistake would
+        for _ in range(rand.randint(0, 3)):
+            op = rand.randint(0, 2)
+            if op == 0 and ext_path:
+                ext_path[rand.randrange(len(ext_path))] = rand.randint(1, 400000)
+            elif op == 1 and len(ext_path) > 1:
+                del ext_path[rand.randrange(len(ext_path))]
+            elif len(ext_path) < 12:
+                ext_path.insert(rand.randrange(len(ext_path) + 1), rand.randint(1, 400000))
+        pairs.append((mrt_path, ext_path))
+    return pairs
+
+
+def bench(name, func, pairs):
+    """Times func over every pair and reports time and memory growth."""
+    tracemalloc.start()
+    start = timeit.default_timer()
+    results = [func(m, e) for m, e in pairs]
+    elapsed = timeit.default_timer() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-12s %10.2f us/pair %10.1f KiB peak" % (name, elapsed / len(pairs) * 1e6, peak / 1024))
+    return results
+
+
+def main():
+    """Runs the benchmark.
+
+    Parameters:
+    argv[1]  Optional number of path pairs
+    """
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    pairs = gen_pairs(n)
+    print("%d path pairs, 1-12 hops" % n)
+
+    ref = bench("recursive", levenshtein_recursive, pairs)
+    print("%-12s %10d entries" % ("memo size", len(levenshtein_recursive.mem)))
+    new = bench("iterative", edit_distance.distance, pairs)
+    edit_distance.cache_clear()
+    bench("cached", edit_distance.cached_distance, pairs)
+    print("%-12s %10d entries" % ("lru size", edit_distance.cache_info().currsize))
+    bench("bounded(2)", lambda m, e: edit_distance.distance(m, e, 2), pairs)
+
+    mismatches = sum(1 for a, b in zip(ref, new) if a != b)
+    print("%d mismatches" % mismatches)
+    if mismatches:
+        sys.exit(-1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module benchmarks Verifier.run end to end on synthetic data.
+
+A standin.Dataset is generated at the requested scale and served through the
+stand-in database. Each engine is timed per stage; fetch, dict build, k
+compare, Levenshtein and output, then run again under tracemalloc for its
+peak memory. One JSON record per engine is appended to the results file so
+runs can be compared across changes.
+
+The stand-in database answers in process from Python lists, so the fetch
+and connect timings measure the stand-in and not PostgreSQL. They are not
+representative of a real server and are best compared between engines only.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import io
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import contextlib
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+import db
+import standin
+import relationships
+import batch_compare
+from verifier import Verifier
+
+RESULTS_FN = "bench_results.jsonl"
+
+# Verifier keyword arguments of each engine
+ENGINES = {
+    "scalar": {},
+    "batch": {"batch": True},
+    "stream": {"stream": True},
+    "binary": {"binary": True, "batch": True},
+    "traceback": {"trace_back": True, "batch": True},
+    "concurrent": {"concurrent_load": True, "batch": True},
+    # standin.py answers the server queries in Python, so this times the
+    # stand-in and says nothing of PostgreSQL
+    "server_standin": {"server": True},
+}
+
+# Printed under the table and kept in each record, see the module docstring
+DATABASE_NOTE = "fetch and connect times are of the in-process stand-in database, not PostgreSQL"
+
+# Engines run when --engines is not given
+DEFAULT_ENGINES = tuple(name for name in ENGINES if name != "server_standin")
+
+STAGES = ("fetch", "dict_build", "k_compare", "levenshtein", "output")
+
+
+class Timers:
+    """This class accumulates wall time per stage."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.depth = defaultdict(int)
+
+    def wrap(self, name, func):
+        """Returns func timed under name, nested calls are counted once."""
+        def timed(*args, **kwargs):
+            self.depth[name] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.depth[name] -= 1
+                if not self.depth[name]:
+                    self.seconds[name] += time.perf_counter() - start
+        return timed
+
+
+@contextlib.contextmanager
+def patched(timers):
+    """Times the functions behind each stage for the duration of a with block."""
+    targets = [(standin.StandInCursor, "execute", "fetch"),
+               (standin.StandInCursor, "copy_expert", "fetch"),
+               (Verifier, "load_mrt", "load"),
+               (Verifier, "load_ext", "load"),
+               (Verifier, "load_traced", "load"),
+               (Verifier, "k_compare", "k_compare"),
+               (batch_compare, "k_hops", "k_compare"),
+               (batch_compare, "first_diff", "k_compare"),
+               (batch_compare, "k_counts", "k_compare"),
+               (batch_compare, "distances", "levenshtein"),
+               (Verifier, "output", "output")]
+    saved = [(owner, attr, owner.__dict__[attr]) for owner, attr, _ in targets]
+    for owner, attr, stage in targets:
+        setattr(owner, attr, timers.wrap(stage, getattr(owner, attr)))
+    # levenshtein_opt is a staticmethod
+    saved.append((Verifier, "levenshtein_opt", Verifier.__dict__["levenshtein_opt"]))
+    Verifier.levenshtein_opt = staticmethod(timers.wrap("levenshtein", Verifier.levenshtein_opt))
+    try:
+        yield timers
+    finally:
+        for owner, attr, value in saved:
+            setattr(owner, attr, value)
+
+
+def run_once(asn, trial, kwargs, shard_dir):
+    """Runs and outputs one Verifier, returning it and its wall time."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        v = Verifier(asn, 0, trial, **kwargs)
+        v.run()
+        v.output(shard_dir)
+    return v, time.perf_counter() - start
+
+
+def bench(dataset, engine, shard_dir):
+    """Benchmarks one engine on the first collector of dataset.
+
+    Returns:
+    record  Dictionary of the stage times, peak memory and throughput.
+    """
+    asn = dataset.collectors[0]
+    kwargs = ENGINES[engine]
+    timers = Timers()
+    with patched(timers):
+        v, total = run_once(asn, dataset.trial, kwargs, shard_dir)
+    stages = {name: timers.seconds[name] for name in STAGES}
+    # Loading time not spent fetching rows is spent building the dictionaries
+    stages["dict_build"] = max(timers.seconds["load"] - stages["fetch"], 0.0)
+
+    tracemalloc.start()
+    run_once(asn, dataset.trial, kwargs, shard_dir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"engine": engine,
+            "prefixes": v.prefixes,
+            "total_s": total,
+            "stages_s": stages,
+            "prefixes_per_s": v.prefixes / total if total else 0.0,
+            "peak_bytes": peak,
+            "levenshtein_avg": v.levenshtein_avg}
+
+
+def git_revision():
+    """Returns the current commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Runs the benchmark.
+
+    Every option is listed by --help.
+    """
+    defaults = standin.DEFAULT_SCALE
+    parser = argparse.ArgumentParser(description="Benchmark Verifier.run on synthetic data.")
+    parser.add_argument("--prefixes", type=int, default=defaults.prefixes)
+    parser.add_argument("--ases", type=int, default=defaults.ases)
+    parser.add_argument("--max-hops", type=int, default=defaults.max_hops)
+    parser.add_argument("--dups", type=int, default=defaults.dups, help="Maximum extra rows per prefix")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--engines", default=",".join(DEFAULT_ENGINES),
+                        help="Comma separated, of " + ", ".join(ENGINES))
+    parser.add_argument("--out", default=RESULTS_FN, help="JSON lines file the results are appended to")
+    args = parser.parse_args()
+
+    scale = defaults._replace(prefixes=args.prefixes, ases=args.ases, max_hops=args.max_hops,
+                              dups=args.dups, seed=args.seed, collectors=1)
+    start = time.perf_counter()
+    dataset = standin.Dataset(scale)
+    print("%d prefixes, %d table rows, generated in %.1fs"
+          % (scale.prefixes, dataset.rows(), time.perf_counter() - start))
+
+    db.set_connector(standin.connector(dataset))
+    with db.connection() as conn, contextlib.redirect_stdout(io.StringIO()):
+        relationships.set_shared_index(relationships.RelationshipIndex.from_db(conn))
+
+    shard_dir = tempfile.mkdtemp(prefix="verify_bench_")
+    meta = {"time": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "scale": scale._asdict()}
+    try:
+        with open(args.out, "a") as out:
+            print(("%-14s %9s %12s" + " %11s" * len(STAGES) + " %10s")
+                  % (("engine", "total s", "prefixes/s") + STAGES + ("peak MiB",)))
+            for engine in args.engines.split(","):
+                record = bench(dataset, engine, shard_dir)
+                stages = record["stages_s"]
+                print(("%-14s %9.2f %12.0f" + " %11.3f" * len(STAGES) + " %10.1f")
+                      % ((engine, record["total_s"], record["prefixes_per_s"])
+                         + tuple(stages[name] for name in STAGES) + (record["peak_bytes"] / 2**20,)))
+                out.write(json.dumps(dict(meta, note=DATABASE_NOTE, **record)) + "\n")
+            print("Note: " + DATABASE_NOTE + ", and are not representative.")
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        db.set_connector(None)
+
+if __name__ == "__main__":
+    main()
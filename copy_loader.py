@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module bulk loads tables with COPY ... TO STDOUT (FORMAT binary).
+
+The binary stream is parsed straight into NumPy arrays instead of building a
+Python object for every column and array element of every row.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import io
+import struct
+import ipaddress
+
+import numpy as np
+
+SIGNATURE = b"PGCOPY\n\377\r\n\0"
+
+# Postgres address families in the binary inet/cidr format
+PGSQL_AF_INET = 2
+PGSQL_AF_INET6 = 3
+
+# Element type oids of integer arrays
+INT4OID = 23
+INT8OID = 20
+
+_i16 = struct.Struct(">h")
+_i32 = struct.Struct(">i")
+
+
+def copy_binary(conn, sql, out = None):
+    """Runs a query through COPY in binary format.
+    Parameters:
+    conn  A psycopg2 connection
+    sql  The query to copy
+    out  Optional file object to write the stream to instead of memory
+
+    Returns:
+    buf  A bytes object holding the whole binary COPY stream, or out.
+    """
+    to_memory = out is None
+    if to_memory:
+        out = io.BytesIO()
+    cur = conn.cursor()
+    cur.copy_expert("COPY (" + sql + ") TO STDOUT (FORMAT binary)", out)
+    cur.close()
+    return out.getvalue() if to_memory else out
+
+
+def data_start(buf):
+    """Checks the COPY header and returns the offset of the first tuple."""
+    if buf[:len(SIGNATURE)] != SIGNATURE:
+        raise ValueError("Not a binary COPY stream")
+    ext_len = _i32.unpack_from(buf, len(SIGNATURE) + 4)[0]
+    return len(SIGNATURE) + 8 + ext_len
+
+
+def scan(buf, ncols):
+    """Finds the offset and length of every field.
+    Parameters:
+    buf  Binary COPY stream
+    ncols  Number of columns per tuple
+
+    Returns:
+    offsets  An (n, ncols) int64 array of field data offsets.
+    lengths  An (n, ncols) int64 array of field lengths, -1 for NULL.
+    """
+    for offsets, lengths in scan_chunks(buf, ncols, None):
+        return offsets, lengths
+
+
+def scan_chunks(buf, ncols, max_rows):
+    """Finds the offset and length of every field, max_rows tuples at a time.
+
+    Tuples are framed FRAME_BYTES at a time with array operations, see
+    _frame, so no Python code runs per tuple or field.
+
+    Parameters:
+    buf  Binary COPY stream, a bytes object or mmap
+    ncols  Number of columns per tuple
+    max_rows  Tuples per chunk, or None for a single chunk
+
+    Returns:
+    chunks  A generator of (offsets, lengths) arrays, see scan.
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    pos = data_start(buf)
+    parts = []
+    rows = 0
+    while pos is not None:
+        offsets, lengths, pos = _frame(raw, pos, ncols)
+        parts.append((offsets, lengths))
+        rows += len(offsets)
+        while max_rows is not None and rows >= max_rows:
+            offsets, lengths = _join(parts, ncols)
+            yield offsets[:max_rows], lengths[:max_rows]
+            parts = [(offsets[max_rows:], lengths[max_rows:])]
+            rows -= max_rows
+    if rows or max_rows is None:
+        yield _join(parts, ncols)
+
+
+# Bytes of the stream framed at a time, see _frame
+FRAME_BYTES = 64 << 20
+
+# Pruning passes tried before the tuple chain is followed by doubling
+PRUNE_PASSES = 4
+
+
+def _frame(raw, start, ncols):
+    """Frames the tuples starting within FRAME_BYTES of start.
+
+    Any position holding the column count could start a tuple. The fields of
+    the tuple each one would start are walked one column at a time for all of
+    them at once, which gives the position it would be followed at. The real
+    tuples are the chain of followers from start.
+
+    Parameters:
+    raw  uint8 array of the stream
+    start  Offset of a tuple or the trailer
+    ncols  Number of columns per tuple
+
+    Returns:
+    offsets, lengths  Arrays of the tuples, see scan.
+    pos  Offset of the next tuple, None past the trailer.
+    """
+    end = len(raw) - 2
+    count = _i16.unpack_from(raw, start)[0]
+    # Trailer
+    if count == -1:
+        return np.zeros((0, ncols), dtype=np.int64), np.zeros((0, ncols), dtype=np.int64), None
+    if count != ncols:
+        raise ValueError("Expected %d columns, got %d" % (ncols, count))
+    stop = min(start + FRAME_BYTES, end)
+    cand = start + np.flatnonzero((raw[start:stop] == ncols >> 8) & (raw[start + 1:stop + 1] == ncols & 0xff))
+
+    # Candidates are dropped as soon as a field runs past the stream
+    pos = cand + 2
+    offsets = []
+    lengths = []
+    for j in range(ncols):
+        keep = np.flatnonzero(pos + 4 <= end)
+        length = read_ints(raw, pos[keep], 4)
+        keep = keep[length >= -1]
+        length = length[length >= -1]
+        cand, pos = cand[keep], pos[keep]
+        offsets = [column[keep] for column in offsets] + [pos + 4]
+        lengths = [column[keep] for column in lengths] + [length]
+        pos = pos + 4 + np.maximum(length, 0)
+    keep = pos <= end
+    cand, pos = cand[keep], pos[keep]
+    offsets = np.stack([column[keep] for column in offsets], axis=1)
+    lengths = np.stack([column[keep] for column in lengths], axis=1)
+    if not len(cand) or cand[0] != start:
+        raise ValueError("Malformed binary COPY tuple at offset %d" % start)
+
+    # Index of the candidate each one is followed by, or -1
+    jump = np.minimum(np.searchsorted(cand, pos), len(cand) - 1)
+    jump = np.where(cand[jump] == pos, jump, -1)
+    # Dropping candidates no kept one jumps to, until none is dropped, leaves
+    # those reached from start. Positions inside a tuple are seldom jumped to,
+    # so this takes a pass or two; otherwise the chain is followed by doubling
+    rows = np.arange(len(cand))
+    for _ in range(PRUNE_PASSES):
+        targets = jump[rows]
+        followed = np.zeros(len(cand), dtype=bool)
+        followed[targets[targets >= 0]] = True
+        followed[0] = True
+        if np.count_nonzero(followed) == len(rows):
+            break
+        rows = np.flatnonzero(followed)
+    else:
+        chain = np.zeros(len(cand), dtype=bool)
+        chain[0] = True
+        # chain holds the first 2^k tuples while jump skips 2^k tuples ahead
+        while jump[0] >= 0:
+            reached = jump[chain]
+            chain[reached[reached >= 0]] = True
+            jump = np.where(jump >= 0, jump[np.maximum(jump, 0)], -1)
+        rows = np.flatnonzero(chain)
+    last = rows[-1]
+    if pos[last] < stop:
+        count = _i16.unpack_from(raw, pos[last])[0]
+        if count != ncols:
+            raise ValueError("Expected %d columns, got %d" % (ncols, count))
+        raise ValueError("Malformed binary COPY tuple at offset %d" % pos[last])
+    return offsets[rows], lengths[rows], int(pos[last])
+
+
+def _join(parts, ncols):
+    if not parts:
+        return np.zeros((0, ncols), dtype=np.int64), np.zeros((0, ncols), dtype=np.int64)
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+
+def read_ints(raw, offsets, width):
+    """Reads big endian integers of a fixed width at the given offsets."""
+    idx = np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(width)
+    return raw[idx].copy().view(">i%d" % width).ravel().astype(np.int64)
+
+
+def int_column(buf, offsets, lengths):
+    """Decodes an int4 or int8 column, NULLs become 0."""
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    values = np.zeros(len(offsets), dtype=np.int64)
+    for width in (4, 8):
+        rows = np.flatnonzero(lengths == width)
+        if len(rows):
+            values[rows] = read_ints(raw, offsets[rows], width)
+    return values
+
+
+def int_array_column(buf, offsets, lengths):
+    """Decodes a one dimensional int4[] or int8[] column into CSR arrays.
+    Parameters:
+    buf  Binary COPY stream
+    offsets, lengths  Field offsets and lengths of the column
+
+    Returns:
+    indptr  An int64 array, row i has values[indptr[i]:indptr[i + 1]].
+    values  A flat int64 array of every element.
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    n = len(offsets)
+    counts = np.zeros(n, dtype=np.int64)
+    # Array header; ndim, has nulls, element oid, then size and lower bound per dim
+    present = np.flatnonzero(lengths > 0)
+    ndim = read_ints(raw, offsets[present], 4)
+    if np.any(ndim > 1):
+        raise ValueError("Only one dimensional arrays are supported")
+    if np.any(read_ints(raw, offsets[present] + 4, 4)):
+        raise ValueError("NULL array elements are not supported")
+    rows = present[ndim == 1]
+    counts[rows] = read_ints(raw, offsets[rows] + 12, 4)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    if indptr[-1] == 0:
+        return indptr, np.zeros(0, dtype=np.int64)
+
+    width = 8 if read_ints(raw, offsets[rows[:1]] + 8, 4)[0] == INT8OID else 4
+    # Each element is a 4 byte length followed by the value
+    starts = np.repeat(offsets[rows] + 20 + 4, counts[rows])
+    within = np.arange(indptr[-1]) - np.repeat(indptr[rows], counts[rows])
+    values = read_ints(raw, starts + within * (4 + width), width)
+    return indptr, values
+
+
+def cidr_column(buf, offsets, lengths, seen = None, prefixes = None):
+    """Interns a cidr column.
+
+    Rows are grouped by their binary value, so only distinct prefixes are
+    formatted. Ids are given in order of first appearance.
+
+    Parameters:
+    buf  Binary COPY stream
+    offsets, lengths  Field offsets and lengths of the column
+    seen, prefixes  Optional interning state to continue from a previous chunk
+
+    Returns:
+    ids  An int64 array with the dense id of each row's prefix.
+    prefixes  A list of prefix strings indexed by id.
+    """
+    ids = np.empty(len(offsets), dtype=np.int64)
+    if seen is None:
+        seen = {}
+        prefixes = []
+    if not len(offsets):
+        return ids, prefixes
+    if np.any(lengths < 0):
+        raise ValueError("NULL prefixes are not supported")
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    # Distinct values of each field length: (rows, index of each row's value)
+    groups = []
+    values = []
+    firsts = []
+    for length in np.unique(lengths).tolist():
+        rows = np.flatnonzero(lengths == length)
+        fields = raw[offsets[rows][:, None] + np.arange(length)].view("V%d" % length).reshape(-1)
+        distinct, first, inverse = np.unique(fields, return_index=True, return_inverse=True)
+        groups.append((rows, len(values) + inverse.reshape(-1)))
+        values.extend(value.tobytes() for value in distinct)
+        firsts.append(rows[first])
+    value_ids = np.empty(len(values), dtype=np.int64)
+    for i in np.argsort(np.concatenate(firsts), kind="stable").tolist():
+        key = values[i]
+        pid = seen.get(key)
+        if pid is None:
+            pid = seen[key] = len(prefixes)
+            prefixes.append(decode_cidr(key))
+        value_ids[i] = pid
+    for rows, index in groups:
+        ids[rows] = value_ids[index]
+    return ids, prefixes
+
+
+def cidr_arrays(buf, offsets, lengths):
+    """Decodes a cidr column into the packed arrays of prefix_table.PrefixTable.arrays.
+    Parameters:
+    buf  Binary COPY stream
+    offsets, lengths  Field offsets and lengths of the column
+
+    Returns:
+    hi, lo  uint64 arrays of the address words, IPv4 left aligned
+    length  A uint8 array of prefix lengths
+    v6  A bool array, True for IPv6 prefixes
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # Family, bits, is cidr and address size, then the address bytes
+    size = raw[offsets + 3].astype(np.int64)
+    if np.any(lengths != 4 + size) or np.any(size > 16):
+        raise ValueError("Not a non NULL cidr column")
+    addr = np.zeros((len(offsets), 16), dtype=np.uint8)
+    for width in np.unique(size).tolist():
+        rows = np.flatnonzero(size == width)
+        addr[rows, :width] = raw[offsets[rows][:, None] + 4 + np.arange(width)]
+    words = addr.view(">u8").astype(np.uint64)
+    return words[:, 0], words[:, 1], raw[offsets + 1].copy(), raw[offsets] == PGSQL_AF_INET6
+
+
+def decode_cidr(raw):
+    """Formats a binary cidr value as text."""
+    family, bits = raw[0], raw[1]
+    addr = raw[4:]
+    if family == PGSQL_AF_INET:
+        return str(ipaddress.IPv4Network((addr.ljust(4, b"\0"), bits)))
+    return str(ipaddress.IPv6Network((addr.ljust(16, b"\0"), bits)))
+
+
+def int_columns(buf, ncols):
+    """Decodes a stream of NOT NULL integer columns.
+
+    Tuples of fixed width columns have a constant size, so they are read with
+    a single structured view of the buffer.
+
+    Parameters:
+    buf  Binary COPY stream
+    ncols  Number of columns
+
+    Returns:
+    values  An (n, ncols) int64 array.
+    """
+    pos = data_start(buf)
+    # Trailer only
+    if len(buf) - pos == 2:
+        return np.zeros((0, ncols), dtype=np.int64)
+    widths = []
+    off = pos + 2
+    for _ in range(ncols):
+        widths.append(_i32.unpack_from(buf, off)[0])
+        off += 4 + widths[-1]
+    dtype = [("count", ">i2")]
+    for i, width in enumerate(widths):
+        dtype += [("len%d" % i, ">i4"), ("col%d" % i, ">i%d" % width)]
+    dtype = np.dtype(dtype)
+    n = (len(buf) - pos - 2) // dtype.itemsize
+    if (len(buf) - pos - 2) % dtype.itemsize or widths.count(4) + widths.count(8) != ncols:
+        raise ValueError("Columns are not fixed width integers")
+    tuples = np.frombuffer(buf, dtype=dtype, count=n, offset=pos)
+    for i, width in enumerate(widths):
+        if np.any(tuples["len%d" % i] != width):
+            raise ValueError("Columns are not fixed width integers")
+    return np.stack([tuples["col%d" % i].astype(np.int64) for i in range(ncols)], axis=1)
+
+
+class Announcements:
+    """This class holds a verification table as columnar arrays."""
+
+    def __init__(self, buf, inference = False):
+        """Parameters:
+        buf  Binary COPY stream of (prefix, origin, as_path[, inference length]) rows
+        inference  True if the rows have an inference length column
+        """
+        offsets, lengths = scan(buf, 4 if inference else 3)
+        # (hi, lo, length, v6) arrays of each row's prefix, see cidr_arrays
+        self.prefixes = cidr_arrays(buf, offsets[:, 0], lengths[:, 0])
+        self.origin = int_column(buf, offsets[:, 1], lengths[:, 1])
+        self.path_offsets, self.path_values = int_array_column(buf, offsets[:, 2], lengths[:, 2])
+        if inference:
+            self.inference_l = int_column(buf, offsets[:, 3], lengths[:, 3])
+        else:
+            self.inference_l = None
+
+    def __len__(self):
+        return len(self.origin)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module manages database connections.
+
+The configuration at CONFIG_LOC is read once per process, and connections are
+checked out of a bounded pool shared by the Verifier, Querier and drivers.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+import time
+import threading
+from configparser import ConfigParser
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2
+
+CONFIG_LOC = r"/etc/bgp/bgp.conf"
+
+# Maximum number of connections held by the pool of one process
+POOL_SIZE = 4
+
+# Idle connections older than this are pinged before reuse, in seconds
+PING_AFTER = 60
+
+_config = None
+_connector = None
+_pool = None
+_pool_lock = threading.Lock()
+# Pools inherited from a parent process, kept so their sockets are never closed here
+_inherited = []
+
+
+class LoginError(Exception):
+    """Raised when a database connection can not be established."""
+
+
+def get_config(fn=CONFIG_LOC):
+    """Returns the [bgp] section of the configuration, read once per process."""
+    global _config
+    if _config is None:
+        cparser = ConfigParser()
+        if not cparser.read(fn) or not cparser.has_section('bgp'):
+            raise LoginError("No [bgp] section in " + fn)
+        _config = dict(cparser['bgp'])
+    return _config
+
+
+def set_connector(connector):
+    """Replaces the database with another connection factory, such as standin.connector.
+
+    Pass None to connect to the configured database again.
+    """
+    global _connector, _pool
+    _connector = connector
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+
+
+def connect():
+    """Creates a new connection to the SQL database.
+
+    Returns:
+    conn  A psycopg2 connection.
+    """
+    if _connector is not None:
+        return _connector()
+    config = get_config()
+    print(datetime.now().strftime("%c") + ": Connecting to database...")
+    try:
+        conn = psycopg2.connect(host = config['host'],
+                                database = config['database'],
+                                user = config['user'],
+                                password = config['password'])
+    except (psycopg2.Error, KeyError) as e:
+        print(datetime.now().strftime("%c") + ": Login failed.")
+        raise LoginError("Login to " + str(config.get('host')) + " failed: " + str(e)) from e
+    print(datetime.now().strftime("%c") + ": Login successful.")
+    return conn
+
+
+class Pool:
+    """This class keeps a bounded set of reusable connections."""
+
+    def __init__(self, size=POOL_SIZE):
+        """Parameters:
+        size  Maximum number of connections checked out at once.
+        """
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        """Checks out a healthy connection, blocking while the pool is exhausted."""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, since = self._idle.pop()
+                if healthy(conn, time.monotonic() - since > PING_AFTER):
+                    return conn
+                conn.close()
+            return connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, ending any open transaction."""
+        try:
+            if not conn.closed:
+                conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            # Broken connections are dropped instead of reused
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Closes every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+def healthy(conn, ping=False):
+    """Checks that a connection is open and, if ping is set, answering queries."""
+    if conn.closed:
+        return False
+    if not ping:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_pool():
+    """Returns the connection pool of this process.
+
+    A forked worker gets its own pool instead of sharing the parent's sockets.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            if _pool is not None:
+                _inherited.append(_pool)
+            _pool = Pool()
+        return _pool
+
+
+@contextmanager
+def connection():
+    """Checks a connection out of the pool for the duration of a with block."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
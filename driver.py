@@ -1,31 +1,219 @@
-from verifier import Verifier
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module runs verification for every collector of a trial.
+
+Each collector is verified in three modes; full extrapolation, origin only
+propagation and MRT no propagation. Jobs run sequentially or over a pool of
+worker processes.
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+
+import psycopg2
+
+import db
+import results
+import metrics
+import relationships
+from ledger import Ledger
+from verifier import MultiVerifier
+
+COLLECTORS = {
+    "a": [24961, 23673, 29222, 25160, 64475, 15605, 56730, 61597, 1798, 9304, 29140, 49697, 30132, 49673, 6720, 35369, 8492, 2895, 37239, 39533, 42541, 25220, 50629, 327960, 5769],
+    "b": [20562, 35266, 6079, 28571, 31424, 49709, 1798, 35369, 52091, 52873, 25227, 25152, 29140, 5645, 4181, 59689, 41722, 11039, 14361, 20080, 29222, 52320, 31742, 263508, 24441],
+    "c": [262612, 264911, 25160, 41722, 28260, 31019, 49697, 1798, 5602, 8492, 39821, 38001, 31424, 397143, 20080, 56730, 6079, 50629, 198385, 28917, 263508, 34019, 49037, 8222, 207044],
+    "d": [31424, 49697, 205206, 30132, 264268, 8222, 29222, 42541, 16347, 680, 41695, 327960, 28260, 29686, 58299, 39821, 6079, 38001, 12350, 50629, 61597, 15435, 50304, 4181, 198385],
+    "e": [327983, 42541, 264911, 41811, 23673, 34019, 24441, 39821, 50629, 262612, 24961, 51907, 7660, 64475, 49037, 35369, 35266, 32354, 34177, 5396, 8896, 14537, 38001, 27446, 3402],
+    "f": [34019, 29222, 49673, 31019, 5392, 327960, 49709, 24961, 25160, 41327, 3333, 41695, 58299, 5602, 397143, 41722, 34177, 264268, 6894, 11039, 8492, 327983, 28917, 49697, 15435],
+    "g": [1798, 28329, 39821, 49515, 24961, 2895, 12350, 23106, 12637, 51907, 51088, 41811, 39351, 9304, 28220, 34019, 25227, 207044, 14361, 31019, 31742, 5602, 3333, 263047, 31424],
+    "h": [206499, 42541, 31742, 15605, 6079, 49709, 52873, 50877, 25227, 29222, 11039, 58299, 9304, 3267, 5602, 51907, 24441, 1798, 31424, 39821, 32354, 25220, 35369, 2895, 28329],
+}
+
+TRIAL = "f"
+
+# Full, origin only and MRT only verification
+MODES = (0, 1, 2)
+
+# Per worker results, merged into the trial directory once every job is done
+SHARD_DIR = os.path.join(results.RESULTS_DIR, "shards")
+
+# Stage timings of every job, merged from one file per collector so workers
+# never append to the same file, see metrics.Metrics.write
+METRICS_NAME = "metrics.jsonl"
+
+# Limits the number of workers holding a database connection
+_db_slots = None
+
+
+def _init_worker(db_slots):
+    global _db_slots
+    _db_slots = db_slots
+
+
+def run_job(job):
+    """Verifies the given modes of a single collector in a worker process.
+    Parameters:
+    job  A tuple of (ASN, trial, shard directory, modes, concurrent load), see
+         MultiVerifier for concurrent load
+
+    Returns:
+    AS  The collector ASN.
+    elapsed  Wall time of the job in seconds, None if it failed.
+    """
+    AS, trial, shard_dir, modes, concurrent_load = job
+    start = time.perf_counter()
+    # The ledger records the modes of a job together, so a rerun redoes them all
+    sink = metrics_shard(shard_dir, AS)
+    if os.path.exists(sink):
+        os.remove(sink)
+    metrics.set_sink(sink)
+    try:
+        mv = MultiVerifier(AS, trial, modes, concurrent_load=concurrent_load)
+        mv.run(_db_slots)
+        mv.output(shard_dir)
+    except (db.LoginError, psycopg2.Error) as e:
+        # Left out of the ledger, so a restart runs it again
+        print(datetime.now().strftime("%c") + ": AS%d failed: %s" % (AS, e), file=sys.stderr)
+        return AS, None
+    return AS, time.perf_counter() - start
+
+
+def metrics_shard(shard_dir, AS):
+    """Returns the metrics file of one collector, see merge_results."""
+    return os.path.join(shard_dir, "metrics.%s.jsonl" % AS)
+
+
+def merge_results(shard_dir, collectors, trial):
+    """Merges the result and metrics shards of a trial into trial_dir in collector order."""
+    print(datetime.now().strftime("%c") + ": Merging results.")
+    out_dir = trial_dir(trial)
+    results.merge_shards(shard_dir, collectors, MODES, out_dir)
+    metrics.merge([metrics_shard(shard_dir, AS) for AS in collectors], os.path.join(out_dir, METRICS_NAME))
+
+
+def trial_dir(trial):
+    """Returns the directory of the merged results of a trial, the argument of statistics.py.
+
+    Each trial has its own results so a merge replaces them, where runs used
+    to append to one file in RESULTS_DIR.
+    """
+    return os.path.join(results.RESULTS_DIR, trial)
+
+
+def pending_jobs(ledger, collectors, trial, concurrent_load = False):
+    """Returns the jobs not yet recorded in the ledger, see run_job.
+
+    Files left by interrupted writes are removed first.
+    """
+    removed = ledger.rollback()
+    if removed:
+        print(datetime.now().strftime("%c") + ": Removed %d partial shard files." % removed)
+    jobs = []
+    for AS in collectors:
+        modes = ledger.pending(AS, MODES, trial)
+        if modes:
+            jobs.append((AS, trial, ledger.shard_dir, modes, concurrent_load))
+    print(datetime.now().strftime("%c") + ": %d of %d collectors to verify."
+          % (len(jobs), len(collectors)))
+    return jobs
+
+
+def finish_job(ledger, job, elapsed):
+    """Records a finished job in the ledger."""
+    AS, trial, _, modes, _ = job
+    if elapsed is None:
+        return
+    print(datetime.now().strftime("%c") + ": AS%d finished in %.1fs" % (AS, elapsed))
+    for mode in modes:
+        ledger.record(AS, mode, trial)
+
+
+def main_parallel(collectors, trial, workers, max_conns, concurrent_load = False):
+    """Verifies every collector over a pool of worker processes.
+
+    The relationship index is loaded before the pool forks so every worker
+    shares it copy-on-write. Each worker writes its own result shards, which
+    are merged in collector order into trial_dir once the pool is done, so the
+    output matches the sequential driver. Jobs already in the ledger are
+    skipped.
+
+    Parameters:
+    collectors  List of collector ASNs
+    trial  Trial name used in the table names
+    workers  Number of worker processes
+    max_conns  Maximum number of workers connected to the database at once
+    concurrent_load  If True, each worker fetches its tables concurrently over up to
+                     three connections, see MultiVerifier
+    """
+    shard_dir = os.path.join(SHARD_DIR, trial)
+    ledger = Ledger(shard_dir)
+    jobs = {job[0]: job for job in pending_jobs(ledger, collectors, trial, concurrent_load)}
+    if jobs:
+        with db.connection() as conn:
+            relationships.shared_index(conn)
+
+        ctx = multiprocessing.get_context("fork")
+        db_slots = ctx.BoundedSemaphore(max_conns)
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(db_slots,)) as pool:
+            for AS, elapsed in pool.imap_unordered(run_job, jobs.values()):
+                finish_job(ledger, jobs[AS], elapsed)
+    merge_results(shard_dir, collectors, trial)
+
+
+def main_sequential(collectors, trial, concurrent_load = False):
+    """Verifies every collector in this process, skipping jobs already in the ledger.
+
+    See main_parallel for the parameters.
+    """
+    shard_dir = os.path.join(SHARD_DIR, trial)
+    ledger = Ledger(shard_dir)
+    for job in pending_jobs(ledger, collectors, trial, concurrent_load):
+        # full, origin only and no propagation verification
+        AS, elapsed = run_job(job)
+        finish_job(ledger, job, elapsed)
+    merge_results(shard_dir, collectors, trial)
+
 
 def main():
-    collectors_a = [24961, 23673, 29222, 25160, 64475, 15605, 56730, 61597, 1798, 9304, 29140, 49697, 30132, 49673, 6720, 35369, 8492, 2895, 37239, 39533, 42541, 25220, 50629, 327960, 5769]
-    collectors_b = [20562, 35266, 6079, 28571, 31424, 49709, 1798, 35369, 52091, 52873, 25227, 25152, 29140, 5645, 4181, 59689, 41722, 11039, 14361, 20080, 29222, 52320, 31742, 263508, 24441]
-    collectors_c = [262612, 264911, 25160, 41722, 28260, 31019, 49697, 1798, 5602, 8492, 39821, 38001, 31424, 397143, 20080, 56730, 6079, 50629, 198385, 28917, 263508, 34019, 49037, 8222, 207044]
-    collectors_d = [31424, 49697, 205206, 30132, 264268, 8222, 29222, 42541, 16347, 680, 41695, 327960, 28260, 29686, 58299, 39821, 6079, 38001, 12350, 50629, 61597, 15435, 50304, 4181, 198385]
-    collectors_e = [327983, 42541, 264911, 41811, 23673, 34019, 24441, 39821, 50629, 262612, 24961, 51907, 7660, 64475, 49037, 35369, 35266, 32354, 34177, 5396, 8896, 14537, 38001, 27446, 3402]
-    collectors_f = [34019, 29222, 49673, 31019, 5392, 327960, 49709, 24961, 25160, 41327, 3333, 41695, 58299, 5602, 397143, 41722, 34177, 264268, 6894, 11039, 8492, 327983, 28917, 49697, 15435]
-    collectors_g = [1798, 28329, 39821, 49515, 24961, 2895, 12350, 23106, 12637, 51907, 51088, 41811, 39351, 9304, 28220, 34019, 25227, 207044, 14361, 31019, 31742, 5602, 3333, 263047, 31424]
-    collectors_h = [206499, 42541, 31742, 15605, 6079, 49709, 52873, 50877, 25227, 29222, 11039, 58299, 9304, 3267, 5602, 51907, 24441, 1798, 31424, 39821, 32354, 25220, 35369, 2895, 28329]
-    for AS in collectors_f:
-        # full extrapolation verification
-        v = Verifier(AS, 0, "f")
-        v.run()
-        v.output()
-        v = None
-
-        # origin only extrapolation verification
-        v_oo = Verifier(AS, 1, "f")
-        v_oo.run()
-        v_oo.output()
-        v_oo = None
-
-        # no propagation, mrt only verification
-        v_mo = Verifier(AS, 2, "f")
-        v_mo.run()
-        v_mo.output()
+    """Verifies every collector of the trial.
+
+    Progress is kept in a ledger, so an interrupted trial resumes where it
+    stopped when run again.
+
+    Parameters:
+    argv[1]  Optional number of worker processes, runs sequentially if absent
+    argv[2]  Optional maximum number of workers connected at once
+    --concurrent-load  Fetch each collector's tables concurrently, see MultiVerifier
+    --metrics  Print the stage timings of every run, see metrics.Metrics.report
+    --profile  Profile the compare stage, kept in the metrics records
+    --trace-memory  Trace the allocations of the compare stage, kept in the metrics records
+    """
+    parser = argparse.ArgumentParser(description="Verify every collector of trial " + TRIAL + ".")
+    parser.add_argument("workers", type=int, nargs="?", help="Worker processes, runs sequentially if absent")
+    parser.add_argument("max_conns", type=int, nargs="?", help="Workers connected at once, default workers")
+    parser.add_argument("--concurrent-load", action="store_true",
+                        help="Fetch the tables of a collector at the same time, over up to three "
+                             "connections per worker")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Print the stage timings of every run to the log")
+    parser.add_argument("--profile", action="store_true",
+                        help="Run the compare stage under cProfile, see " + METRICS_NAME)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Run the compare stage under tracemalloc, see " + METRICS_NAME)
+    args = parser.parse_args()
+    # Workers fork after this, and each job only replaces the sink, see run_job
+    metrics.configure(profile=args.profile, trace_memory=args.trace_memory, log=args.metrics)
+    if args.workers is not None:
+        max_conns = args.workers if args.max_conns is None else args.max_conns
+        main_parallel(COLLECTORS[TRIAL], TRIAL, args.workers, max_conns, args.concurrent_load)
+        return
+
+    main_sequential(COLLECTORS[TRIAL], TRIAL, args.concurrent_load)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines the edit distance used to compare AS paths.
+
+The distance is the one originally computed by the recursive
+Verifier.levenshtein_opt: hops may only be deleted from the longer path and
+each substitution costs one. It is computed iteratively with two rows of memory.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+from functools import lru_cache
+
+# Maximum number of (MRT path, extrapolated path) pairs kept in the cache
+CACHE_SIZE = 1 << 16
+
+
+def distance(mrt_path, prop_path, bound=None):
+    """Calculates the edit distance between two paths.
+    Parameters:
+    mrt_path  Correct path given by MRT announcement
+    prop_path  Propagated path given by Extrapolation results
+    bound  Optional upper bound, work stops once the distance exceeds it
+
+    Returns:
+    result  The edit distance between two paths, or bound + 1 if it exceeds bound.
+    """
+    mrt_l = len(mrt_path)
+    prop_l = len(prop_path)
+    # Check for empty paths
+    if not mrt_l:
+        return prop_l if bound is None else min(prop_l, bound + 1)
+    if not prop_l:
+        return mrt_l if bound is None else min(mrt_l, bound + 1)
+    if mrt_path == prop_path:
+        return 0
+    # Distance is at least the difference in length
+    if bound is not None and abs(mrt_l - prop_l) > bound:
+        return bound + 1
+
+    prev = list(range(prop_l + 1))
+    cur = [0] * (prop_l + 1)
+    for i in range(1, mrt_l + 1):
+        mrt_asn = mrt_path[i - 1]
+        cur[0] = i
+        row_min = i
+        for j in range(1, prop_l + 1):
+            sub = prev[j - 1] + (mrt_asn != prop_path[j - 1])
+            # If MRT is longer, need to add
+            if i > j:
+                d = prev[j] + 1
+                if sub < d:
+                    d = sub
+            # If Prop is longer, need to subtract
+            elif j > i:
+                d = cur[j - 1] + 1
+                if sub < d:
+                    d = sub
+            # If equal length, only perform substitution
+            else:
+                d = sub
+            cur[j] = d
+            if d < row_min:
+                row_min = d
+        # Row minimums never decrease, so the result can only be larger
+        if bound is not None and row_min > bound:
+            return bound + 1
+        prev, cur = cur, prev
+    if bound is not None and prev[prop_l] > bound:
+        return bound + 1
+    return prev[prop_l]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_distance(mrt_path, prop_path, bound):
+    return distance(mrt_path, prop_path, bound)
+
+
+def cached_distance(mrt_path, prop_path, bound=None):
+    """Calculates the edit distance through a size capped LRU cache.
+    Parameters:
+    mrt_path  Correct path given by MRT announcement
+    prop_path  Propagated path given by Extrapolation results
+    bound  Optional upper bound, see distance
+
+    Returns:
+    result  The edit distance between two paths.
+    """
+    return _cached_distance(tuple(mrt_path), tuple(prop_path), bound)
+
+
+def cache_info():
+    """Returns the hit, miss and size counters of the distance cache."""
+    return _cached_distance.cache_info()
+
+
+def cache_clear():
+    """Empties the distance cache."""
+    _cached_distance.cache_clear()
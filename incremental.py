@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module stores per prefix comparison outcomes for incremental verification.
+
+Each outcome is kept with a hash of the MRT and extrapolated rows it was
+computed from. A later run fetches only the hashes, recompares the prefixes
+whose rows changed and rebuilds the counters from the stored outcomes.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+
+import numpy as np
+
+import queries
+
+STORE_DIR = "/var/tmp/verify_outcomes"
+
+FORMAT_VERSION = 1
+
+# Outcome classes of a prefix
+COMPARED = 0
+MISSING = 1     # No extrapolated announcement
+ORIGIN = 2      # Extrapolated origin differs
+TRACEBACK = 3   # Extrapolated path could not be traced
+
+# Per prefix outcome arrays
+OUTCOME_FIELDS = (("cls", np.int8),           # Outcome class
+                  ("mrt_l", np.int64),        # MRT path length
+                  ("ext_l", np.int64),        # Extrapolated path length, if compared
+                  ("first", np.int64),        # Matching hops before the first mistake
+                  ("has_diff", bool),         # Paths differ within their common length
+                  ("prop", bool),             # First mistake is a propagation failure
+                  ("missing_rel", bool),      # No relationship at the first mistake
+                  ("distance", np.int64))     # Edit distance
+
+# Hash of a prefix without an extrapolated row
+NO_HASH = b""
+
+
+def empty_outcomes(n):
+    """Returns zeroed outcome arrays for n prefixes."""
+    return {name: np.zeros(n, dtype=dtype) for name, dtype in OUTCOME_FIELDS}
+
+
+def fetch_hashes(conn, mrt_table, ext_table):
+    """Fetches the row hash of every control prefix.
+    Parameters:
+    conn  A psycopg2 connection
+    mrt_table, ext_table  Names of the verification tables
+
+    Returns:
+    prefixes  Array of prefix strings in server prefix order
+    mrt_hash  Array of MRT row hashes
+    ext_hash  Array of extrapolated row hashes, NO_HASH where missing
+    """
+    cur = conn.cursor()
+    cur.execute(queries.prefix_hashes(mrt_table, ext_table))
+    rows = cur.fetchall()
+    cur.close()
+    prefixes = np.array([row[0] for row in rows], dtype=str)
+    mrt_hash = np.array([row[1].encode() for row in rows], dtype="S32")
+    ext_hash = np.array([NO_HASH if row[2] is None else row[2].encode() for row in rows], dtype="S32")
+    return prefixes, mrt_hash, ext_hash
+
+
+class OutcomeStore:
+    """This class holds the outcomes of one extrapolation table, keyed by prefix."""
+
+    def __init__(self, fn, rels_digest):
+        """Parameters:
+        fn  File the outcomes are kept in
+        rels_digest  Digest of the relationships the outcomes depend on
+        """
+        self.fn = fn
+        self.rels_digest = rels_digest
+        self.prefixes = np.zeros(0, dtype=str)
+        self.mrt_hash = np.zeros(0, dtype="S32")
+        self.ext_hash = np.zeros(0, dtype="S32")
+        self.outcomes = empty_outcomes(0)
+
+    @classmethod
+    def load(cls, fn, rels_digest):
+        """Loads stored outcomes, or an empty store if they are missing or stale."""
+        store = cls(fn, rels_digest)
+        if not os.path.exists(fn):
+            return store
+        with np.load(fn) as data:
+            if int(data["version"]) != FORMAT_VERSION or str(data["rels_digest"]) != rels_digest:
+                return store
+            store.prefixes = data["prefixes"]
+            store.mrt_hash = data["mrt_hash"]
+            store.ext_hash = data["ext_hash"]
+            store.outcomes = {name: data[name] for name, _ in OUTCOME_FIELDS}
+        return store
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def _match(self, prefixes):
+        """Returns the stored position of each prefix, -1 where not stored."""
+        # Both prefix lists are in byte order, see queries.PREFIX_KEY
+        pos = np.searchsorted(self.prefixes, prefixes)
+        found = pos < len(self.prefixes)
+        found[found] = self.prefixes[pos[found]] == prefixes[found]
+        return np.where(found, pos, -1)
+
+    def changed(self, prefixes, mrt_hash, ext_hash):
+        """Returns a mask of the prefixes that have to be compared again."""
+        pos = self._match(prefixes)
+        stale = pos < 0
+        known = np.flatnonzero(~stale)
+        stale[known] = ((self.mrt_hash[pos[known]] != mrt_hash[known]) |
+                        (self.ext_hash[pos[known]] != ext_hash[known]))
+        return stale
+
+    def update(self, prefixes, mrt_hash, ext_hash, changed, outcomes):
+        """Replaces the store with the current prefixes.
+        Parameters:
+        prefixes, mrt_hash, ext_hash  Current prefixes and hashes, see fetch_hashes
+        changed  Mask of recompared prefixes, see changed
+        outcomes  Outcomes of the changed prefixes, in order
+
+        Returns:
+        outcomes  Outcomes of every current prefix, in order.
+        """
+        pos = self._match(prefixes)
+        kept = np.flatnonzero(~changed)
+        merged = empty_outcomes(len(prefixes))
+        for name, _ in OUTCOME_FIELDS:
+            merged[name][kept] = self.outcomes[name][pos[kept]]
+            merged[name][changed] = outcomes[name]
+        self.prefixes = prefixes
+        self.mrt_hash = mrt_hash
+        self.ext_hash = ext_hash
+        self.outcomes = merged
+        return merged
+
+    def save(self):
+        """Writes the store, replacing the file atomically."""
+        os.makedirs(os.path.dirname(self.fn) or ".", exist_ok=True)
+        tmp = self.fn + ".tmp%d" % os.getpid()
+        with open(tmp, "wb") as f:
+            np.savez(f, version=np.array(FORMAT_VERSION), rels_digest=np.array(self.rels_digest),
+                     prefixes=self.prefixes, mrt_hash=self.mrt_hash, ext_hash=self.ext_hash,
+                     **self.outcomes)
+        os.replace(tmp, self.fn)
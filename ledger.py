@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines the Ledger class for checkpointing driver runs.
+
+Every finished (collector ASN, mode, trial) job is appended to a ledger with a
+checksum of its result shard. A restarted run skips jobs whose shard still
+matches its checksum, and removes files left behind by interrupted writes.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+import glob
+import hashlib
+
+import results
+
+LEDGER_NAME = "ledger"
+
+# Extensions of the files making up one shard, see results.write_shard
+SHARD_FILES = (".csv", ".npz")
+
+
+def checksum(base):
+    """Returns the SHA-256 of a result shard, or None if it is incomplete."""
+    h = hashlib.sha256()
+    for ext in SHARD_FILES:
+        try:
+            with open(base + ext, "rb") as f:
+                h.update(f.read())
+        except FileNotFoundError:
+            return None
+    return h.hexdigest()
+
+
+class Ledger:
+    """This class records the completed jobs of a trial."""
+
+    def __init__(self, shard_dir):
+        """Parameters:
+        shard_dir  Directory holding the result shards and the ledger
+        """
+        self.shard_dir = shard_dir
+        self.fn = os.path.join(shard_dir, LEDGER_NAME)
+        self.done = {}
+        os.makedirs(shard_dir, exist_ok=True)
+        if os.path.exists(self.fn):
+            self.load()
+
+    def load(self):
+        """Reads the ledger, truncating a record cut short by a crash."""
+        with open(self.fn, "r+") as f:
+            text = f.read()
+            if not text.endswith("\n"):
+                text = text[:text.rfind("\n") + 1]
+                f.seek(0)
+                f.truncate(len(text.encode()))
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            trial, asn, mode, digest = fields
+            self.done[(int(asn), int(mode), trial)] = digest
+
+    def rollback(self):
+        """Removes temporary files of interrupted shard writes.
+
+        Returns:
+        removed  Number of files removed.
+        """
+        removed = 0
+        for fn in glob.glob(os.path.join(self.shard_dir, "*.tmp*")):
+            os.remove(fn)
+            removed += 1
+        return removed
+
+    def shard(self, asn, mode):
+        """Returns the shard path of a job, see results.shard_name."""
+        return results.shard_name(self.shard_dir, asn, results.MODE_FILES[mode])
+
+    def is_done(self, asn, mode, trial):
+        """Checks that a job was recorded and its shard is unchanged."""
+        digest = self.done.get((int(asn), int(mode), trial))
+        return digest is not None and digest == checksum(self.shard(asn, mode))
+
+    def pending(self, asn, modes, trial):
+        """Returns the modes of a collector that still have to run."""
+        return tuple(mode for mode in modes if not self.is_done(asn, mode, trial))
+
+    def record(self, asn, mode, trial):
+        """Marks a job as done once its shard has been written."""
+        digest = checksum(self.shard(asn, mode))
+        if digest is None:
+            raise FileNotFoundError("No complete shard for AS%s mode %d" % (asn, mode))
+        with open(self.fn, "a") as f:
+            f.write("%s %d %d %s\n" % (trial, int(asn), int(mode), digest))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[(int(asn), int(mode), trial)] = digest
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module records per stage timing and memory of a verification run.
+
+A Metrics object is kept by every Verifier. Each named stage; connect, fetch,
+normalize, compare, diagnose and output, accumulates wall time, CPU time, rows and the
+process maximum resident set size when it ends. Records can be appended to a
+JSON lines sink, and the compare stage can optionally run under cProfile and
+tracemalloc, which gives its own allocation peak.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+STAGES = ("connect", "fetch", "normalize", "compare", "diagnose", "output")
+
+# Stages covered by the profile and trace_memory hooks
+PROFILED_STAGES = ("compare",)
+
+# Entries kept in the cProfile and tracemalloc summaries
+TOP_N = 15
+
+# Process wide defaults, see configure
+_defaults = {"sink": None, "profile": False, "trace_memory": False, "log": False}
+
+
+def configure(sink = None, profile = False, trace_memory = False, log = False):
+    """Sets the defaults of every Metrics created afterwards.
+    Parameters:
+    sink  File name of a JSON lines file each run is appended to, or None
+    profile  If True, run the compare stage under cProfile
+    trace_memory  If True, run the compare stage under tracemalloc
+    log  If True, write also prints the stage table of each run, see report
+    """
+    _defaults.update(sink=sink, profile=profile, trace_memory=trace_memory, log=log)
+
+
+def set_sink(sink):
+    """Sets the sink of every Metrics created afterwards, keeping the other defaults."""
+    _defaults["sink"] = sink
+
+
+def max_rss():
+    """Returns the peak resident set size of this process in bytes."""
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage:
+    """This class holds the totals of one named stage.
+
+    max_rss is the high water mark of the whole process when the stage last
+    ended, so it includes every earlier stage. traced_peak is the peak of the
+    memory allocated within the stage, only measured for PROFILED_STAGES when
+    trace_memory is set.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows = 0
+        self.max_rss = 0
+        self.traced_peak = None
+        self._lock = threading.Lock()
+
+    def add(self, rows = 0, wall = 0.0, cpu = 0.0, calls = 0):
+        """Adds to the totals, safe to call from several threads."""
+        with self._lock:
+            self.rows += rows
+            self.wall += wall
+            self.cpu += cpu
+            self.calls += calls
+
+    def to_dict(self):
+        record = {"calls": self.calls, "wall_s": self.wall, "cpu_s": self.cpu,
+                  "rows": self.rows, "max_rss_bytes": self.max_rss}
+        if self.traced_peak is not None:
+            record["traced_peak_bytes"] = self.traced_peak
+        return record
+
+
+class Metrics:
+    """This class records the stages of one verification run."""
+
+    def __init__(self, labels = None, sink = None, profile = None, trace_memory = None):
+        """Parameters:
+        labels  Dictionary identifying the run in records, such as the ASN and table
+        sink, profile, trace_memory  Override the defaults set by configure
+        """
+        self.labels = dict(labels or {})
+        self.sink = _defaults["sink"] if sink is None else sink
+        self.profile = _defaults["profile"] if profile is None else profile
+        self.trace_memory = _defaults["trace_memory"] if trace_memory is None else trace_memory
+        self.log = _defaults["log"]
+        self.stages = {name: Stage(name) for name in STAGES}
+        self.profiler = cProfile.Profile() if self.profile else None
+        self.allocations = []
+        # Stages open in each thread, loader threads time their own
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Returns the stages open in the calling thread."""
+        if not hasattr(self._local, "stages"):
+            self._local.stages = []
+        return self._local.stages
+
+    def stage(self, name, rows = 0):
+        """Returns a context manager timing a stage, see _stage.
+
+        Nested stages are only recorded by the outermost one, so stage totals never
+        overlap within a thread. Stages run by several threads sum their times.
+        """
+        with self._lock:
+            st = self.stages.setdefault(name, Stage(name))
+        if self._open():
+            return _Nested(st, rows)
+        return self._stage(st, rows)
+
+    @contextmanager
+    def _stage(self, st, rows):
+        hooked = st.name in PROFILED_STAGES
+        # A trace started by the caller is left alone, resetting its peak would skew it
+        tracing = hooked and self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if hooked and self.profiler is not None:
+            self.profiler.enable()
+        self._open().append(st.name)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield st
+        finally:
+            wall = time.perf_counter() - wall
+            # process_time covers every thread of the process
+            cpu = time.process_time() - cpu
+            self._open().pop()
+            if hooked and self.profiler is not None:
+                self.profiler.disable()
+            st.add(rows, wall, cpu, 1)
+            if tracing:
+                st.traced_peak = max(st.traced_peak or 0, tracemalloc.get_traced_memory()[1])
+                stats = tracemalloc.take_snapshot().statistics("lineno")
+                self.allocations = [(str(s.traceback), s.size) for s in stats[:TOP_N]]
+                tracemalloc.stop()
+            st.max_rss = max_rss()
+
+    def to_dict(self):
+        """Returns the run as a JSON serializable record."""
+        record = dict(self.labels)
+        record["time"] = datetime.now().isoformat(timespec="seconds")
+        record["stages"] = {name: st.to_dict() for name, st in self.stages.items() if st.calls}
+        if self.allocations:
+            record["top_allocations"] = [{"line": line, "bytes": size} for line, size in self.allocations]
+        if self.profiler is not None:
+            record["profile"] = self.profile_report()
+        return record
+
+    def profile_report(self):
+        """Returns the cumulative time listing of the profiled stages."""
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(TOP_N)
+        return out.getvalue()
+
+    def write(self, sink = None):
+        """Appends the run to a JSON lines file, by default the configured sink.
+
+        The stage table is printed too when log is set, see configure.
+        """
+        if self.log:
+            labels = " ".join("%s=%s" % item for item in self.labels.items())
+            print(datetime.now().strftime("%c") + ": Stage timings " + labels + "\n" + self.report())
+        sink = sink or self.sink
+        if sink is None:
+            return
+        with open(sink, "a") as f:
+            f.write(json.dumps(self.to_dict()) + "\n")
+
+    def report(self):
+        """Returns a table of the stages for the log."""
+        lines = ["%-10s %6s %10s %10s %10s %12s" % ("stage", "calls", "wall s", "cpu s", "rows", "max RSS MiB")]
+        for name, st in self.stages.items():
+            if st.calls:
+                lines.append("%-10s %6d %10.3f %10.3f %10d %12.1f"
+                             % (name, st.calls, st.wall, st.cpu, st.rows, st.max_rss / 2**20))
+        return "\n".join(lines)
+
+
+def merge(fns, out):
+    """Concatenates JSON lines files into out in the given order, replacing it atomically.
+
+    Files that do not exist are skipped, such as those of jobs that failed.
+    """
+    tmp = out + ".tmp%d" % os.getpid()
+    with open(tmp, "w") as f:
+        for fn in fns:
+            if os.path.exists(fn):
+                with open(fn) as part:
+                    f.write(part.read())
+    os.replace(tmp, out)
+
+
+class _Nested:
+    """Counts the rows and calls of a stage opened inside another stage."""
+
+    def __init__(self, st, rows):
+        self.st = st
+        self.rows = rows
+
+    def __enter__(self):
+        return self.st
+
+    def __exit__(self, *exc):
+        self.st.add(self.rows, calls=1)
+        return False
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module keeps AS paths interned in flat CSR arrays.
+
+Most prefixes of a collector share a small number of distinct paths. A
+PathStore holds each distinct path once, as a slice of one uint32 array, and
+an AnnSet refers to the path of every prefix by id instead of holding its own
+list of ints. Comparisons can then run once per distinct pair of path ids.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+
+import numpy as np
+
+import prefix_table
+
+# Value used to pad paths shorter than the matrix width, see batch_compare.PAD
+PAD = -1
+
+# Per prefix columns of a data set, see columns
+Columns = namedtuple("Columns", "store found path_ids origins inference_l")
+
+
+class PathStore:
+    """This class holds distinct AS paths in CSR layout, referenced by id."""
+
+    def __init__(self):
+        # Packed path bytes: id, used to intern
+        self._ids = {}
+        self._values = array("I")
+        self._ends = array("q")
+        self._csr = None
+
+    def __len__(self):
+        return len(self._ends)
+
+    def intern(self, path):
+        """Returns the id of a path, adding it if it is new."""
+        return self._intern_key(array("I", path).tobytes())
+
+    def _intern_key(self, key):
+        pid = self._ids.get(key)
+        if pid is None:
+            pid = len(self._ends)
+            self._ids[key] = pid
+            self._values.frombytes(key)
+            self._ends.append(len(self._values))
+            self._csr = None
+        return pid
+
+    def intern_csr(self, indptr, values):
+        """Interns every row of a CSR array, see copy_loader.int_array_column.
+
+        Rows are keyed by slices of one byte string of the values, so no
+        list is built per row.
+
+        Returns:
+        ids  An int64 array of the path id of each row.
+        """
+        n = len(indptr) - 1
+        raw = np.asarray(values, dtype=np.uint32).tobytes()
+        bounds = (np.asarray(indptr, dtype=np.int64) * 4).tolist()
+        intern = self._intern_key
+        return np.fromiter((intern(raw[bounds[i]:bounds[i + 1]]) for i in range(n)), dtype=np.int64, count=n)
+
+    def csr(self):
+        """Returns the paths as (offsets, values) arrays, path i is values[offsets[i]:offsets[i + 1]]."""
+        if self._csr is None:
+            offsets = np.zeros(len(self._ends) + 1, dtype=np.int64)
+            offsets[1:] = self._ends
+            self._csr = (offsets, np.array(self._values, dtype=np.uint32))
+        return self._csr
+
+    def lengths(self, ids = None):
+        """Returns the length of every path, or of the paths in ids."""
+        offsets, _ = self.csr()
+        lengths = np.diff(offsets)
+        return lengths if ids is None else lengths[ids]
+
+    def path(self, pid):
+        """Returns a path as a list of ints."""
+        start = self._ends[pid - 1] if pid else 0
+        return self._values[start:self._ends[pid]].tolist()
+
+    def pack(self, ids, reverse = False):
+        """Packs paths into a padded matrix, see batch_compare.pack_paths.
+        Parameters:
+        ids  Array of path ids, one per row
+        reverse  If True, each path is stored last hop first
+
+        Returns:
+        matrix  A 2D int64 array with one path per row, padded with PAD.
+        lengths  A 1D int64 array of path lengths.
+        """
+        offsets, values = self.csr()
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = offsets[ids + 1] - offsets[ids]
+        width = int(lengths.max()) if len(ids) else 0
+        matrix = np.full((len(ids), width), PAD, dtype=np.int64)
+        total = int(lengths.sum())
+        if total:
+            rows = np.repeat(np.arange(len(ids)), lengths)
+            within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            cols = lengths[rows] - 1 - within if reverse else within
+            matrix[rows, cols] = values[offsets[ids][rows] + within]
+        return matrix, lengths
+
+    @property
+    def nbytes(self):
+        """Bytes held by the path arrays."""
+        return self._values.itemsize * len(self._values) + self._ends.itemsize * len(self._ends)
+
+
+class AnnSet(Mapping):
+    """This class holds one announcement per prefix, with paths in a PathStore.
+
+    Rows are keyed by prefix id in a prefix_table.PrefixTable, which sets of
+    one Verifier share so they can be joined by id. It reads like the
+    dictionaries it replaces; {prefix: (as_path, origin)}, or {prefix: (as_path,
+    origin, inference length)} with inference set. as_path is None for paths
+    that could not be traced.
+    """
+
+    def __init__(self, inference = False, table = None):
+        """Parameters:
+        inference  True if announcements have an inference length
+        table  PrefixTable the prefixes are interned in, a new one if None
+        """
+        self.store = PathStore()
+        self.table = prefix_table.PrefixTable() if table is None else table
+        self.inference = inference
+        # Prefix id of each row, and row of each prefix id or -1
+        self._ids = array("q")
+        self._row = array("q")
+        self._path_ids = array("q")
+        self._origins = array("q")
+        self._inference_l = array("q")
+
+    @classmethod
+    def from_announcements(cls, anns, table = None):
+        """Builds a set from a copy_loader.Announcements, later rows of a prefix win."""
+        ann_set = cls(anns.inference_l is not None, table)
+        ids = ann_set.store.intern_csr(anns.path_offsets, anns.path_values)
+        prefix_ids = ann_set.table.intern_arrays(*anns.prefixes)
+        inference_l = anns.inference_l if ann_set.inference else np.zeros(len(ids), dtype=np.int64)
+        ann_set.add_columns(prefix_ids, ids, anns.origin, inference_l)
+        return ann_set
+
+    def add_columns(self, prefix_ids, path_ids, origins, inference_l):
+        """Adds rows given as arrays, later rows of a prefix win."""
+        prefix_ids = np.asarray(prefix_ids, dtype=np.int64)
+        if not len(prefix_ids):
+            return
+        self._grow(int(prefix_ids.max()) + 1)
+        # Last row of each prefix
+        _, last = np.unique(prefix_ids[::-1], return_index=True)
+        keep = np.sort(len(prefix_ids) - 1 - last)
+        prefix_ids = prefix_ids[keep]
+        row = np.frombuffer(self._row, dtype=np.int64).copy()
+        new = prefix_ids[row[prefix_ids] < 0]
+        row[new] = np.arange(len(self._ids), len(self._ids) + len(new))
+        self._row = array("q", row.tobytes())
+        self._ids.frombytes(new.tobytes())
+        at = row[prefix_ids]
+        for name, values in (("_path_ids", path_ids), ("_origins", origins), ("_inference_l", inference_l)):
+            column = np.zeros(len(self._ids), dtype=np.int64)
+            old = np.frombuffer(getattr(self, name), dtype=np.int64)
+            column[:len(old)] = old
+            column[at] = np.asarray(values, dtype=np.int64)[keep]
+            setattr(self, name, array("q", column.tobytes()))
+
+    def _grow(self, size):
+        """Extends the row index to size prefix ids."""
+        if len(self._row) < size:
+            self._row.frombytes(np.full(size - len(self._row), -1, dtype=np.int64).tobytes())
+
+    def add_rows(self, rows):
+        """Adds (prefix, origin, as_path[, inference length]) rows, see queries.mrt_anns."""
+        prefix_ids = self.table.intern_many([row[0] for row in rows])
+        if len(prefix_ids):
+            self._grow(int(prefix_ids.max()) + 1)
+        for pid, row in zip(prefix_ids.tolist(), rows):
+            self.add(pid, row[2], row[1], row[3] if self.inference else 0)
+
+    def add(self, pid, path, origin, inference_l = 0):
+        """Sets the announcement of a prefix id, path may be None."""
+        self._grow(pid + 1)
+        path_id = -1 if path is None else self.store.intern(path)
+        i = self._row[pid]
+        if i < 0:
+            self._row[pid] = len(self._ids)
+            self._ids.append(pid)
+            self._path_ids.append(path_id)
+            self._origins.append(origin)
+            self._inference_l.append(inference_l)
+        else:
+            self._path_ids[i] = path_id
+            self._origins[i] = origin
+            self._inference_l[i] = inference_l
+
+    def __getitem__(self, prefix):
+        pid = self.table.get(prefix)
+        i = self._row[pid] if pid is not None and pid < len(self._row) else -1
+        if i < 0:
+            raise KeyError(prefix)
+        path_id = self._path_ids[i]
+        path = None if path_id < 0 else self.store.path(path_id)
+        if self.inference:
+            return (path, self._origins[i], self._inference_l[i])
+        return (path, self._origins[i])
+
+    def __contains__(self, prefix):
+        pid = self.table.get(prefix)
+        return pid is not None and pid < len(self._row) and self._row[pid] >= 0
+
+    def __iter__(self):
+        return iter(self.table.texts(self._ids))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def prefix_ids(self):
+        """Returns the prefix id of every row, in row order."""
+        return np.frombuffer(self._ids, dtype=np.int64).copy()
+
+    def rows(self, ids):
+        """Returns the row of each prefix id, -1 where missing."""
+        ids = np.asarray(ids, dtype=np.int64)
+        row = np.frombuffer(self._row, dtype=np.int64)
+        found = (ids >= 0) & (ids < len(row))
+        out = np.full(len(ids), -1, dtype=np.int64)
+        out[found] = row[ids[found]]
+        return out
+
+
+def columns(anns, prefixes):
+    """Returns the announcements of prefixes as arrays.
+    Parameters:
+    anns  An AnnSet, or a dictionary of the same values
+    prefixes  List of prefixes, or an array of ids in the PrefixTable of anns
+
+    Returns:
+    columns  A Columns of the path store, then per prefix arrays of found, path
+             ids, origins and inference lengths. Path ids are -1 for missing
+             prefixes and None paths, inference lengths 0 without them.
+    """
+    n = len(prefixes)
+    if isinstance(anns, AnnSet):
+        ids = prefixes if isinstance(prefixes, np.ndarray) else anns.table.lookup(prefixes)
+        rows = anns.rows(ids)
+        found = rows >= 0
+        at = rows[found]
+        path_ids = np.full(n, -1, dtype=np.int64)
+        origins = np.zeros(n, dtype=np.int64)
+        inference_l = np.zeros(n, dtype=np.int64)
+        path_ids[found] = np.frombuffer(anns._path_ids, dtype=np.int64)[at]
+        origins[found] = np.frombuffer(anns._origins, dtype=np.int64)[at]
+        inference_l[found] = np.frombuffer(anns._inference_l, dtype=np.int64)[at]
+        return Columns(anns.store, found, path_ids, origins, inference_l)
+
+    # Dictionaries are interned into a store of their own
+    store = PathStore()
+    values = [anns.get(prefix) for prefix in prefixes]
+    found = np.fromiter((v is not None for v in values), dtype=bool, count=n)
+    path_ids = np.fromiter((-1 if v is None or v[0] is None else store.intern(v[0]) for v in values),
+                           dtype=np.int64, count=n)
+    origins = np.fromiter((0 if v is None else v[1] for v in values), dtype=np.int64, count=n)
+    inference_l = np.fromiter((v[2] if v is not None and len(v) > 2 else 0 for v in values),
+                              dtype=np.int64, count=n)
+    return Columns(store, found, path_ids, origins, inference_l)
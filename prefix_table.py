@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module interns prefixes as packed integers with dense ids.
+
+Each CIDR is parsed once into a packed integer of its family, address bits and
+length, and given the next dense id. IPv4 addresses are left aligned in the
+128 address bits and IPv6 keys have a family bit above them, so a prefix of
+one family never shares a key or an address range with the other. Per prefix
+structures are then arrays indexed by id, and data sets sharing a PrefixTable
+are joined with array lookups instead of string hashing.
+
+Ids are keyed on the packed integer, so prefixes decoded from binary COPY are
+interned from their address bytes and only formatted as text when asked for.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import socket
+import threading
+import ipaddress
+from array import array
+
+import numpy as np
+
+# Bits holding the prefix length below the address
+LEN_BITS = 8
+
+# Set above the address bits of IPv6 prefixes
+V6_BIT = 1 << (128 + LEN_BITS)
+
+# IPv4 addresses are shifted into the high bits
+V4_SHIFT = 96
+
+_MASK64 = (1 << 64) - 1
+_MASK128 = (1 << 128) - 1
+
+
+def pack(prefix):
+    """Packs CIDR text into V6_BIT | (address << LEN_BITS) | prefix length, over 128 address bits."""
+    addr, _, bits = prefix.partition("/")
+    try:
+        if ":" in addr:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, addr), "big")
+            plen = int(bits) if bits else 128
+            if 0 <= plen <= 128:
+                # Host bits are cleared, as ip_network with strict off
+                value &= ~((1 << (128 - plen)) - 1)
+                return V6_BIT | value << LEN_BITS | plen
+        else:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, addr), "big")
+            plen = int(bits) if bits else 32
+            if 0 <= plen <= 32:
+                value &= ~((1 << (32 - plen)) - 1)
+                return value << (V4_SHIFT + LEN_BITS) | plen
+    except (OSError, ValueError):
+        pass
+    net = ipaddress.ip_network(prefix, strict = False)
+    if net.version == 4:
+        return int(net.network_address) << (V4_SHIFT + LEN_BITS) | net.prefixlen
+    return V6_BIT | int(net.network_address) << LEN_BITS | net.prefixlen
+
+
+def unpack(key):
+    """Formats a packed prefix as CIDR text."""
+    plen = key & ((1 << LEN_BITS) - 1)
+    addr = (key >> LEN_BITS) & _MASK128
+    if key & V6_BIT:
+        return str(ipaddress.IPv6Network((addr, plen)))
+    return socket.inet_ntoa((addr >> V4_SHIFT).to_bytes(4, "big")) + "/" + str(plen)
+
+
+def join(hi, lo, length, v6):
+    """Returns the packed integer of every prefix given as arrays, see PrefixTable.arrays."""
+    return [(family << 128 | high << 64 | low) << LEN_BITS | plen for high, low, plen, family in
+            zip(np.asarray(hi).tolist(), np.asarray(lo).tolist(), np.asarray(length).tolist(),
+                np.asarray(v6, dtype=np.int64).tolist())]
+
+
+class PrefixTable:
+    """This class assigns dense ids to prefixes and keeps their packed form."""
+
+    def __init__(self):
+        # packed prefix: id, see pack
+        self._ids = {}
+        # CIDR text of each id, None until first asked for when interned packed
+        self._texts = []
+        # Packed keys split into high and low address words, length and family
+        self._hi = array("Q")
+        self._lo = array("Q")
+        self._len = array("B")
+        self._v6 = array("B")
+        # Loader threads intern into one table, see Verifier.load_concurrent
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._len)
+
+    def _add(self, key, prefix):
+        pid = len(self._len)
+        self._ids[key] = pid
+        self._texts.append(prefix)
+        addr = (key >> LEN_BITS) & _MASK128
+        self._hi.append(addr >> 64)
+        self._lo.append(addr & _MASK64)
+        self._len.append(key & ((1 << LEN_BITS) - 1))
+        self._v6.append(key >> (128 + LEN_BITS))
+        return pid
+
+    def intern(self, prefix):
+        """Returns the id of a prefix, adding it if it is new."""
+        key = pack(prefix)
+        pid = self._ids.get(key)
+        if pid is None:
+            with self._lock:
+                pid = self._ids.get(key)
+                if pid is None:
+                    pid = self._add(key, prefix)
+        return pid
+
+    def intern_many(self, prefixes):
+        """Returns an int64 array of the ids of prefixes, adding new ones."""
+        ids = np.empty(len(prefixes), dtype=np.int64)
+        with self._lock:
+            get = self._ids.get
+            for i, prefix in enumerate(prefixes):
+                key = pack(prefix)
+                pid = get(key)
+                ids[i] = self._add(key, prefix) if pid is None else pid
+        return ids
+
+    def intern_arrays(self, hi, lo, length, v6):
+        """Returns an int64 array of the ids of prefixes given as arrays, adding new ones.
+
+        The rows are sorted together with the interned prefixes, so each run of
+        equal prefixes starts with its id if it has one. Only new prefixes are
+        packed into integers for the id dictionary, and they are added without
+        formatting their text, see copy_loader.cidr_arrays.
+
+        Parameters:
+        hi, lo, length, v6  Arrays of the prefixes, as returned by arrays
+        """
+        rows = (np.asarray(hi, dtype=np.uint64), np.asarray(lo, dtype=np.uint64),
+                np.asarray(length, dtype=np.uint8), np.asarray(v6, dtype=bool))
+        with self._lock:
+            known = len(self)
+            cols = [np.concatenate(pair) for pair in zip(self.arrays(), rows)]
+            # Stable, so interned prefixes and then first rows lead each run
+            order = np.lexsort((cols[2], cols[1], cols[0], cols[3]))
+            start = np.zeros(len(order), dtype=bool)
+            start[:1] = True
+            for col in cols:
+                col = col[order]
+                start[1:] |= col[1:] != col[:-1]
+            heads = order[start]
+            # New ids follow the order of each prefix's first row
+            new = np.flatnonzero(heads >= known)
+            new = new[np.argsort(heads[new])]
+            first = heads[new] - known
+            heads[new] = np.arange(known, known + len(new))
+            ids = np.empty(len(order), dtype=np.int64)
+            ids[order] = heads[np.cumsum(start) - 1]
+            if len(first):
+                hi, lo, length, v6 = (col[first] for col in rows)
+                self._ids.update(zip(join(hi, lo, length, v6), range(known, known + len(first))))
+                self._texts.extend([None] * len(first))
+                self._hi.frombytes(hi.tobytes())
+                self._lo.frombytes(lo.tobytes())
+                self._len.frombytes(length.tobytes())
+                self._v6.frombytes(v6.astype(np.uint8).tobytes())
+            return ids[known:]
+
+    def lookup(self, prefixes):
+        """Returns an int64 array of the ids of prefixes, -1 where not interned."""
+        return np.fromiter((self.get(prefix, -1) for prefix in prefixes), dtype=np.int64, count=len(prefixes))
+
+    def get(self, prefix, default = None):
+        """Returns the id of a prefix, or default if it is not interned."""
+        try:
+            key = pack(prefix)
+        except ValueError:
+            return default
+        return self._ids.get(key, default)
+
+    def text(self, pid):
+        """Returns the CIDR text of an id."""
+        text = self._texts[pid]
+        if text is None:
+            text = self._texts[pid] = unpack(self.key(pid))
+        return text
+
+    def texts(self, ids):
+        """Returns the CIDR text of every id."""
+        texts = self._texts
+        return [texts[pid] or self.text(pid) for pid in np.asarray(ids).tolist()]
+
+    def key(self, pid):
+        """Returns the packed integer of an id, see pack."""
+        return (self._v6[pid] * V6_BIT | (self._hi[pid] << 64 | self._lo[pid]) << LEN_BITS |
+                self._len[pid])
+
+    def arrays(self):
+        """Returns (hi, lo, length, v6) arrays of every id.
+
+        The address words are uint64, IPv4 left aligned, and v6 is True for
+        IPv6 prefixes.
+        """
+        return (np.array(self._hi, dtype=np.uint64), np.array(self._lo, dtype=np.uint64),
+                np.array(self._len, dtype=np.uint8), np.array(self._v6, dtype=bool))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module finds covering and more specific prefixes with a binary trie.
+
+A trie holds the packed prefixes of one address family of a
+prefix_table.PrefixTable, IPv4 addresses left aligned in 128 bits, and
+classify_ids builds one trie per family so the families never match each
+other. Nodes are stored one depth at a time as sorted 128 bit keys, and only
+at the depths of stored prefix lengths: the node of the first d bits of an
+address exists if a stored prefix of at least d bits starts with them. A batch
+of queries descends the trie one stored depth per step with a single
+searchsorted over every query still inside it, so for n stored prefixes of
+d distinct lengths each query costs O(d log n) and no query scans the stored
+prefixes.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import numpy as np
+
+# Kinds of missing prefix, indexes of Verifier.pref_cover_f
+LESS_SPECIFIC = 0
+MORE_SPECIFIC = 1
+ABSENT = 2
+KINDS = ("less_specific", "more_specific", "absent")
+
+_ONES = np.uint64(0xffffffffffffffff)
+
+
+def masks(depth):
+    """Returns the (hi, lo) uint64 masks of the first depth address bits, depth 0 to 128."""
+    depth = np.asarray(depth, dtype=np.int64)
+    # Shifts are clipped below 64, the full and empty words are set apart
+    hi = np.where(depth >= 64, _ONES, ~(_ONES >> np.clip(depth, 0, 63).astype(np.uint64)))
+    lo = ~(_ONES >> np.clip(depth - 64, 0, 63).astype(np.uint64))
+    lo = np.where(depth <= 64, np.uint64(0), np.where(depth >= 128, _ONES, lo))
+    return hi, lo
+
+
+def keys(hi, lo, depth, fill = False):
+    """Returns the first depth bits of each address as sortable 16 byte keys.
+    Parameters:
+    hi, lo  uint64 arrays of the address words
+    depth  Bits kept, one for every address or one per address
+    fill  If True, the bits past depth are set instead of cleared
+
+    Returns:
+    keys  A void array ordered as the 128 bit addresses.
+    """
+    hi_mask, lo_mask = masks(depth)
+    words = np.empty((len(hi), 2), dtype=">u8")
+    if fill:
+        words[:, 0] = hi | ~hi_mask
+        words[:, 1] = lo | ~lo_mask
+    else:
+        words[:, 0] = hi & hi_mask
+        words[:, 1] = lo & lo_mask
+    return words.view("V16").reshape(-1)
+
+
+class PrefixTrie:
+    """This class answers longest match and more specific queries over a set of prefixes.
+
+    Stored and queried prefixes must all be of one address family.
+    """
+
+    def __init__(self, hi, lo, length):
+        """Parameters:
+        hi, lo, length  Arrays of the stored prefixes, see prefix_table.PrefixTable.arrays
+        """
+        hi = np.asarray(hi, dtype=np.uint64)
+        lo = np.asarray(lo, dtype=np.uint64)
+        length = np.asarray(length, dtype=np.int64)
+        self.depths = np.unique(length)
+        # Truncating sorted addresses keeps them sorted, so every level is
+        # built without sorting again
+        order = np.lexsort((lo, hi))
+        hi, lo, length = hi[order], lo[order], length[order]
+        # depth: (sorted node keys, stored prefix ending at each node or -1)
+        self._levels = {}
+        for depth in self.depths.tolist():
+            below = np.flatnonzero(length >= depth)
+            level = keys(hi[below], lo[below], depth)
+            new = np.ones(len(level), dtype=bool)
+            new[1:] = level[1:] != level[:-1]
+            nodes = level[new]
+            node = np.cumsum(new) - 1
+            ends = np.full(len(nodes), -1, dtype=np.int64)
+            at = length[below] == depth
+            ends[node[at]] = order[below[at]]
+            self._levels[depth] = (nodes, ends)
+
+    @classmethod
+    def from_table(cls, table, ids):
+        """Builds a trie of the prefixes in ids, indexes returned by queries are into ids."""
+        hi, lo, length, v6 = table.arrays()
+        if len(ids) and v6[ids].any() and not v6[ids].all():
+            raise ValueError("Prefixes of both address families in one trie")
+        return cls(hi[ids], lo[ids], length[ids])
+
+    def __len__(self):
+        return sum(int(np.count_nonzero(ends >= 0)) for _, ends in self._levels.values())
+
+    def longest_match(self, hi, lo, length, strict = False):
+        """Finds the longest stored prefix covering each query.
+        Parameters:
+        hi, lo, length  Arrays of the queried prefixes
+        strict  If True, only less specific prefixes match, not the query itself
+
+        Returns:
+        match  An int64 array of the index of the stored prefix, -1 if none.
+        """
+        hi = np.asarray(hi, dtype=np.uint64)
+        lo = np.asarray(lo, dtype=np.uint64)
+        length = np.asarray(length, dtype=np.int64)
+        match = np.full(len(length), -1, dtype=np.int64)
+        active = np.arange(len(length))
+        for depth in self.depths.tolist():
+            # Queries drop out past their own length or once outside the trie
+            inside = length[active] > depth if strict else length[active] >= depth
+            active = active[inside]
+            if not len(active):
+                break
+            nodes, ends = self._levels[depth]
+            level = keys(hi[active], lo[active], depth)
+            pos = np.minimum(np.searchsorted(nodes, level), len(nodes) - 1)
+            hit = nodes[pos] == level
+            end = np.where(hit, ends[pos], -1)
+            match[active[end >= 0]] = end[end >= 0]
+            active = active[hit]
+        return match
+
+    def more_specific(self, hi, lo, length):
+        """Returns a bool array, True where a stored prefix is more specific than the query."""
+        hi = np.asarray(hi, dtype=np.uint64)
+        lo = np.asarray(lo, dtype=np.uint64)
+        length = np.asarray(length, dtype=np.int64)
+        found = np.zeros(len(length), dtype=bool)
+        # Every longer stored prefix has a node at the first stored depth past
+        # the query, within the address range of the query
+        deeper = np.searchsorted(self.depths, length, side="right")
+        for i, depth in enumerate(self.depths.tolist()):
+            at = np.flatnonzero(deeper == i)
+            if not len(at):
+                continue
+            nodes, _ = self._levels[depth]
+            first = np.searchsorted(nodes, keys(hi[at], lo[at], length[at]), side="left")
+            last = np.searchsorted(nodes, keys(hi[at], lo[at], length[at], fill=True), side="right")
+            found[at] = first < last
+        return found
+
+    def classify(self, hi, lo, length):
+        """Classifies prefixes that are not stored by what is stored around them.
+
+        A prefix with both a less specific and more specifics is counted as
+        covered by the less specific, its addresses are all still routed.
+
+        Returns:
+        kinds  An int64 array of LESS_SPECIFIC, MORE_SPECIFIC or ABSENT.
+        """
+        kinds = np.full(len(length), ABSENT, dtype=np.int64)
+        kinds[self.more_specific(hi, lo, length)] = MORE_SPECIFIC
+        kinds[self.longest_match(hi, lo, length, strict=True) >= 0] = LESS_SPECIFIC
+        return kinds
+
+
+def classify_ids(table, ids, stored_ids):
+    """Classifies the prefixes of ids against the trie of stored_ids, see PrefixTrie.classify.
+
+    Each address family is classified against a trie of its own stored prefixes.
+
+    Parameters:
+    table  PrefixTable both id arrays are in
+    ids  Array of the prefix ids to classify
+    stored_ids  Array of the prefix ids in the trie
+
+    Returns:
+    counts  An int64 array of the number of prefixes of each kind, see KINDS.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    stored_ids = np.asarray(stored_ids, dtype=np.int64)
+    kinds = np.full(len(ids), ABSENT, dtype=np.int64)
+    hi, lo, length, v6 = table.arrays()
+    for family in (False, True):
+        at = np.flatnonzero(v6[ids] == family)
+        stored = stored_ids[v6[stored_ids] == family]
+        if not len(at) or not len(stored):
+            continue
+        trie = PrefixTrie(hi[stored], lo[stored], length[stored])
+        query = ids[at]
+        kinds[at] = trie.classify(hi[query], lo[query], length[query])
+    return np.bincount(kinds, minlength=len(KINDS))
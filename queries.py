@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module builds the SQL used to fetch verification tables.
+
+Every query returns one row per prefix, ordered by prefix, with only the
+columns the Verifier uses and the AS path already deduplicated server side.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+# Byte order collation so Python string comparison matches the server sort
+PREFIX_KEY = "prefix::text COLLATE \"C\""
+
+# Removes duplicate ASNs, keeping the first occurrence of each
+DEDUP_PATH = ("ARRAY(SELECT asn FROM unnest(as_path) WITH ORDINALITY AS p(asn, i) "
+              "GROUP BY asn ORDER BY MIN(i))")
+
+# Breaks ties between rows of one prefix by heap position, the order the
+# rows were read in before the fetch was done server side
+ROW_ORDER = "ctid"
+
+# Inference length column of the extrapolation tables
+INFERENCE_COL = "inference_l"
+
+
+# Restricts a query to the prefixes passed as the "prefixes" parameter
+PREFIX_FILTER = "prefix = ANY(%(prefixes)s::cidr[])"
+
+
+def first_per_prefix(table, columns, only = False):
+    """Selects the first row of each prefix, in heap order as a plain scan returns them.
+    Parameters:
+    table  Name of the table
+    columns  List of column expressions returned after the prefix
+    only  If True, keep only the prefixes given by PREFIX_FILTER
+
+    Returns:
+    sql  The query string.
+    """
+    where = " WHERE " + PREFIX_FILTER if only else ""
+    # The columns are computed over the kept rows only, the subquery order is
+    # kept as nothing above it joins or sorts
+    return ("SELECT prefix, " + ", ".join(columns) + " FROM (SELECT DISTINCT ON (" + PREFIX_KEY + ") * FROM " +
+            table + where + " ORDER BY " + PREFIX_KEY + ", " + ROW_ORDER + ") AS first")
+
+
+def mrt_anns(table, only = False):
+    """Selects (prefix, origin, as_path) rows from a control table."""
+    return first_per_prefix(table, ["origin", DEDUP_PATH], only)
+
+
+def ext_anns(table, only = False):
+    """Selects (prefix, origin, as_path, inference length) rows from an extrapolation table."""
+    return first_per_prefix(table, ["origin", DEDUP_PATH, INFERENCE_COL], only)
+
+
+def prefix_hashes(mrt_table, ext_table):
+    """Selects (prefix, MRT row hash, extrapolated row hash or NULL) for every control prefix.
+
+    The hashes cover the same columns mrt_anns and ext_anns return.
+    """
+    mrt = first_per_prefix(mrt_table, ["md5(ROW(origin, " + DEDUP_PATH + ")::text) AS h"])
+    ext = first_per_prefix(ext_table, ["md5(ROW(origin, " + DEDUP_PATH + ", " +
+                                       INFERENCE_COL + ")::text) AS h"])
+    return ("SELECT m.prefix::text, m.h, e.h FROM (" + mrt + ") m LEFT JOIN (" + ext +
+            ") e ON e.prefix = m.prefix ORDER BY m." + PREFIX_KEY)
+
+
+def tb_anns(table):
+    """Selects (asn, prefix, origin, received from) rows from an extrapolation table."""
+    return "SELECT asn, prefix, origin, received_from_asn FROM " + table
+
+
+# Every CAIDA relationship as (a, b) in both orders, each pair once, see
+# relationships.RelationshipIndex.rel_mask
+REL_PAIRS = ("SELECT peer_as_1 AS a, peer_as_2 AS b FROM peers UNION "
+             "SELECT peer_as_2, peer_as_1 FROM peers UNION "
+             "SELECT provider_as, customer_as FROM customer_providers UNION "
+             "SELECT customer_as, provider_as FROM customer_providers")
+
+
+def server_outcomes(mrt_table, ext_table):
+    """Compares every control prefix inside the database.
+
+    Prefixes are classified as compared (0), missing (1) or origin mismatch (2)
+    as in incremental.OUTCOME_FIELDS, and K compared last hop first. Prefixes
+    whose paths agree over their common length are grouped into counts of
+    identical outcomes. Prefixes that differ are returned one per row with
+    both paths and a NULL distance, which is left to the client.
+
+    The relationship tables are joined once against the first mismatching hop
+    of every prefix. Each row carries the positions of its prefixes in
+    control order, so the client puts the outcomes back in that order for the
+    running means, see summary_outcomes.
+
+    Returns:
+    sql  Query of (cls, mrt_l, ext_l, first, has_diff, prop, missing_rel,
+         distance, count, positions, mrt_path, ext_path) rows.
+    """
+    mrt = first_per_prefix(mrt_table, ["origin", DEDUP_PATH + " AS as_path"])
+    ext = first_per_prefix(ext_table, ["origin", DEDUP_PATH + " AS as_path", INFERENCE_COL])
+    # c is the position of the prefix, d the index of the first mismatch
+    joined = ("SELECT row_number() OVER (ORDER BY m." + PREFIX_KEY + ") AS c, "
+              "cardinality(m.as_path) AS mrt_l, "
+              "CASE WHEN e.prefix IS NULL THEN 1 WHEN e.origin <> m.origin THEN 2 ELSE 0 END AS cls, "
+              "COALESCE(cardinality(e.as_path), 0) AS ext_l, "
+              "m.as_path AS mp, e.as_path AS ep, e." + INFERENCE_COL + " AS inf "
+              "FROM m LEFT JOIN e ON e.prefix = m.prefix")
+    hops = ("SELECT j.*, CASE WHEN cls = 0 THEN (SELECT min(i) FROM generate_series(0, LEAST(mrt_l, ext_l) - 1) AS i "
+            "WHERE mp[mrt_l - i] <> ep[ext_l - i]) END AS d FROM j")
+    outcomes = ("SELECT cls, mrt_l, CASE WHEN cls = 0 THEN ext_l ELSE 0 END AS ext_l, "
+                "CASE WHEN cls = 0 THEN COALESCE(d, LEAST(mrt_l, ext_l)) ELSE 0 END AS first, "
+                "d IS NOT NULL AS has_diff, "
+                "COALESCE(ext_l - d <= inf, false) AS prop, "
+                "d IS NOT NULL AND r.a IS NULL AS missing_rel, "
+                "CASE WHEN cls <> 0 THEN mrt_l WHEN d IS NULL THEN abs(mrt_l - ext_l) END AS distance, "
+                "c, mp, ep FROM h LEFT JOIN r ON r.a = mp[mrt_l - d] AND r.b = ep[ext_l - d]")
+    return ("WITH m AS (" + mrt + "), e AS (" + ext + "), r AS (" + REL_PAIRS + "), j AS (" + joined +
+            "), h AS (" + hops + "), o AS (" + outcomes + ") "
+            "SELECT cls, mrt_l, ext_l, first, has_diff, prop, missing_rel, distance, 1, ARRAY[c], mp, ep "
+            "FROM o WHERE has_diff UNION ALL "
+            "SELECT cls, mrt_l, ext_l, first, has_diff, prop, missing_rel, distance, count(*), array_agg(c), "
+            "NULL, NULL FROM o WHERE NOT has_diff "
+            "GROUP BY cls, mrt_l, ext_l, first, has_diff, prop, missing_rel, distance")
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines the RelationshipIndex class.
+
+The index stores the CAIDA peer and provider-customer relationships as sorted
+arrays of ASN pairs packed into 64-bit integers. It is built once per process
+and shared by every Verifier, and persisted to a snapshot file that later runs
+memory map instead of querying the database. A snapshot is only trusted while
+the version counters kept by install_versioning triggers are unchanged.
+
+For whole path checks the same relationships are also held as a
+RelationshipGraph, a CSR adjacency of dense AS ids with edge types.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+import sys
+import struct
+import zlib
+import hashlib
+from datetime import datetime
+
+import numpy as np
+from psycopg2.extensions import quote_ident
+
+import db
+import copy_loader
+
+SNAPSHOT_LOC = r"/var/tmp/verify_relationships.snap"
+
+# Snapshot layout: header, then the sorted peer keys followed by the ptc keys
+SNAPSHOT_MAGIC = b"VRELSNAP"
+SNAPSHOT_VERSION = 2
+# magic, version, crc32 of data, number of distinct peer keys, number of
+# distinct ptc keys (duplicate rows are collapsed, see from_pairs),
+# customer_providers version, peers version, digest of the source signature
+HEADER = struct.Struct("<8sIIQQQQ16s")
+HEADER_SIZE = 64
+
+# Tables the index is built from, in signature order
+REL_TABLES = ("customer_providers", "peers")
+
+# Change counters of the relationship tables, bumped by a statement trigger
+# in the same transaction as every change, see install_versioning
+VERSION_TABLE = "relationship_versions"
+VERSION_TRIGGER = "bump_relationship_version"
+
+VERSIONING_DDL = """
+CREATE TABLE IF NOT EXISTS {versions} (relid oid PRIMARY KEY, version bigint NOT NULL);
+CREATE OR REPLACE FUNCTION {schema}.{trigger}() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO {versions} AS v VALUES (TG_RELID, 1)
+        ON CONFLICT (relid) DO UPDATE SET version = v.version + 1;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+"""
+
+TRIGGER_DDL = """
+DROP TRIGGER IF EXISTS {trigger} ON {table};
+CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE PROCEDURE {schema}.{trigger}();
+INSERT INTO {versions} AS v VALUES ('{table}'::regclass, 1)
+    ON CONFLICT (relid) DO UPDATE SET version = v.version + 1;
+"""
+
+# One row per relationship table, resolved through the search path as the
+# loader resolves it, so same named tables in other schemas never match
+SIGNATURE_SQL = """
+SELECT n.nspname, c.relname, c.oid, c.relfilenode, v.version,
+       EXISTS (SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND t.tgname = %(trigger)s
+               AND t.tgenabled <> 'D')
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN {versions} v ON v.relid = c.oid
+WHERE c.oid IN (to_regclass('customer_providers'), to_regclass('peers'))
+ORDER BY c.relname
+"""
+
+# Index shared by every Verifier in this process
+_shared = None
+
+# Relationship of a neighbor to an AS, see RelationshipGraph
+NO_REL = -1
+CUSTOMER = 0
+PEER = 1
+PROVIDER = 2
+
+
+def pack(a, b):
+    """Packs two 32-bit ASNs, or arrays of ASNs, into 64-bit integers."""
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    return (a << np.uint64(32)) | b
+
+
+def unpack(keys):
+    """Splits packed 64-bit integers back into two arrays of ASNs."""
+    keys = np.asarray(keys, dtype=np.uint64)
+    return (keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+
+def _contains(sorted_keys, keys):
+    """Returns a boolean mask of which keys are present in sorted_keys."""
+    keys = np.atleast_1d(np.asarray(keys, dtype=np.uint64))
+    if len(sorted_keys) == 0:
+        return np.zeros(keys.shape, dtype=bool)
+    pos = np.searchsorted(sorted_keys, keys)
+    pos[pos == len(sorted_keys)] = 0
+    return sorted_keys[pos] == keys
+
+
+class RelationshipIndex:
+    """This class answers relationship queries between pairs of ASes."""
+
+    def __init__(self, peers, ptc):
+        """Parameters:
+        peers  Sorted uint64 array of packed (lower ASN, higher ASN) peer keys.
+        ptc  Sorted uint64 array of packed (provider ASN, customer ASN) keys.
+        """
+        self.peers = peers
+        self.ptc = ptc
+        self._graph = None
+
+    @classmethod
+    def from_pairs(cls, peers, ptc):
+        """Builds an index from ASN pairs.
+        Parameters:
+        peers  An (n, 2) array of peer ASN pairs, in any order.
+        ptc  An (n, 2) array of (provider ASN, customer ASN) pairs.
+        """
+        peers = np.asarray(peers, dtype=np.int64).reshape(-1, 2)
+        ptc = np.asarray(ptc, dtype=np.int64).reshape(-1, 2)
+        # Peer pairs are stored lower ASN first
+        return cls(np.unique(pack(peers.min(axis=1), peers.max(axis=1))),
+                   np.unique(pack(ptc[:, 0], ptc[:, 1])))
+
+    @classmethod
+    def from_db(cls, conn):
+        """Loads the peers and customer_providers tables.
+        Parameters:
+        conn  A psycopg2 connection
+
+        Returns:
+        index  A RelationshipIndex of every CAIDA relationship.
+        """
+        print(datetime.now().strftime("%c") + ": Loading CAIDA relationships...")
+        peers = copy_loader.int_columns(
+            copy_loader.copy_binary(conn, "SELECT peer_as_1, peer_as_2 FROM peers"), 2)
+        ptc = copy_loader.int_columns(
+            copy_loader.copy_binary(conn, "SELECT provider_as, customer_as FROM customer_providers"), 2)
+        return cls.from_pairs(peers, ptc)
+
+    @classmethod
+    def load(cls, conn, fn=SNAPSHOT_LOC):
+        """Memory maps the snapshot if it is current, otherwise rebuilds it.
+        Parameters:
+        conn  A psycopg2 connection
+        fn  Path of the snapshot file
+
+        Returns:
+        index  A RelationshipIndex of every CAIDA relationship.
+        """
+        signature = source_signature(conn)
+        if signature is None:
+            print(datetime.now().strftime("%c") + ": Relationship tables are not versioned, " +
+                  "snapshot skipped. Run relationships.py install to enable it.")
+            return cls.from_db(conn)
+        index = cls.from_snapshot(fn, signature)
+        if index is None:
+            index = cls.from_db(conn)
+            try:
+                index.save(fn, signature)
+            except OSError as e:
+                print(datetime.now().strftime("%c") + ": Snapshot not written: " + str(e))
+        return index
+
+    @classmethod
+    def from_snapshot(cls, fn, signature=None):
+        """Memory maps a snapshot file.
+        Parameters:
+        fn  Path of the snapshot file
+        signature  Source signature the snapshot must match, or None to skip the check
+
+        Returns:
+        index  A RelationshipIndex backed by the file, or None if it is missing or stale.
+        """
+        if not os.path.exists(fn):
+            return None
+        with open(fn, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        if len(raw) < HEADER_SIZE:
+            return None
+        magic, version, crc, n_peers, n_ptc, ptc_version, peers_version, digest = HEADER.unpack_from(raw)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None
+        if signature is not None and (digest != _digest(signature) or
+                                      (ptc_version, peers_version) != signature[0]):
+            print(datetime.now().strftime("%c") + ": Relationship snapshot is stale.")
+            return None
+        if os.path.getsize(fn) != HEADER_SIZE + 8 * (n_peers + n_ptc):
+            return None
+        if n_peers + n_ptc == 0:
+            keys = np.zeros(0, dtype=np.uint64)
+        else:
+            keys = np.memmap(fn, dtype=np.uint64, mode="r", offset=HEADER_SIZE,
+                             shape=(n_peers + n_ptc,))
+        if zlib.crc32(keys) != crc:
+            print(datetime.now().strftime("%c") + ": Relationship snapshot checksum mismatch.")
+            return None
+        print(datetime.now().strftime("%c") + ": Loaded CAIDA relationships from " + fn)
+        return cls(keys[:n_peers], keys[n_peers:])
+
+    def save(self, fn, signature):
+        """Atomically writes the index to a snapshot file.
+        Parameters:
+        fn  Path of the snapshot file
+        signature  Source signature, as returned by source_signature
+        """
+        keys = np.ascontiguousarray(np.concatenate([self.peers, self.ptc]), dtype=np.uint64)
+        ptc_version, peers_version = signature[0]
+        header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(keys),
+                             len(self.peers), len(self.ptc), ptc_version, peers_version,
+                             _digest(signature))
+        tmp = fn + ".%d.tmp" % os.getpid()
+        with open(tmp, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(keys.tobytes())
+        os.replace(tmp, fn)
+        print(datetime.now().strftime("%c") + ": Wrote relationship snapshot " + fn)
+
+    def is_peer(self, a, b):
+        """Returns True if a and b are peers."""
+        return bool(self.peer_mask(a, b))
+
+    def is_provider(self, provider, customer):
+        """Returns True if provider is a provider of customer."""
+        return bool(self.ptc_mask(provider, customer))
+
+    def is_customer(self, customer, provider):
+        """Returns True if customer is a customer of provider."""
+        return bool(self.ptc_mask(provider, customer))
+
+    def has_rel(self, a, b):
+        """Returns True if any relationship exists between a and b."""
+        return bool(self.rel_mask(a, b))
+
+    def peer_mask(self, a, b):
+        """Batch lookup of peer relationships between arrays of ASNs."""
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        return _contains(self.peers, pack(np.minimum(a, b), np.maximum(a, b)))
+
+    def ptc_mask(self, provider, customer):
+        """Batch lookup of provider to customer relationships."""
+        return _contains(self.ptc, pack(provider, customer))
+
+    def rel_mask(self, a, b):
+        """Batch lookup of any relationship between arrays of ASNs."""
+        return self.peer_mask(a, b) | self.ptc_mask(a, b) | self.ptc_mask(b, a)
+
+    def graph(self):
+        """Returns the relationships as a RelationshipGraph, built on first use."""
+        if self._graph is None:
+            self._graph = RelationshipGraph.from_index(self)
+        return self._graph
+
+    def __len__(self):
+        return len(self.peers) + len(self.ptc)
+
+    def digest(self):
+        """Returns a hex digest of the relationships held."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(self.peers).tobytes())
+        h.update(b"/")
+        h.update(np.ascontiguousarray(self.ptc).tobytes())
+        return h.hexdigest()
+
+
+class RelationshipGraph:
+    """This class holds the relationships as a CSR adjacency with edge types.
+
+    ASNs are mapped to dense ids in the order of the sorted asns array. The
+    neighbors of id i are neighbors[indptr[i]:indptr[i + 1]], sorted, and
+    types holds the relationship of each neighbor to i; CUSTOMER, PEER or
+    PROVIDER.
+    """
+
+    def __init__(self, asns, indptr, neighbors, types):
+        self.asns = asns
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.types = types
+
+    @classmethod
+    def from_index(cls, index):
+        """Builds the graph of a RelationshipIndex.
+
+        A pair listed as both provider-customer and peers keeps the provider-customer edge.
+        """
+        provider, customer = unpack(index.ptc)
+        peer_a, peer_b = unpack(index.peers)
+        src = np.concatenate([provider, customer, peer_a, peer_b])
+        dst = np.concatenate([customer, provider, peer_b, peer_a])
+        types = np.concatenate([np.full(len(provider), CUSTOMER, dtype=np.int8),
+                                np.full(len(customer), PROVIDER, dtype=np.int8),
+                                np.full(2 * len(peer_a), PEER, dtype=np.int8)])
+        asns = np.unique(np.concatenate([src, dst]))
+        src = np.searchsorted(asns, src)
+        dst = np.searchsorted(asns, dst)
+        # lexsort is stable, so the first edge of a pair is the provider-customer one
+        order = np.lexsort((dst, src))
+        src, dst, types = src[order], dst[order], types[order]
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        indptr = np.zeros(len(asns) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(src[keep], minlength=len(asns)))
+        return cls(asns, indptr, dst[keep].astype(np.int32), types[keep])
+
+    def __len__(self):
+        return len(self.asns)
+
+    def ids(self, asns):
+        """Returns the dense id of each ASN, -1 for ASes without relationships."""
+        asns = np.asarray(asns, dtype=np.int64)
+        if not len(self.asns):
+            return np.full(asns.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.asns, asns), len(self.asns) - 1)
+        return np.where(self.asns[pos] == asns, pos, -1)
+
+    def edge_types(self, a, b):
+        """Batch lookup of the relationship of each b to each a.
+
+        Returns:
+        types  An int8 array of CUSTOMER, PEER, PROVIDER or NO_REL.
+        """
+        u = self.ids(a)
+        v = self.ids(b)
+        out = np.full(u.shape, NO_REL, dtype=np.int8)
+        if not len(self.neighbors):
+            return out
+        pairs = np.flatnonzero((u >= 0) & (v >= 0))
+        v = v[pairs]
+        lo = self.indptr[u[pairs]]
+        end = self.indptr[u[pairs] + 1]
+        # Binary search of v within the row of u, one step for every open search at once
+        hi = end.copy()
+        active = np.flatnonzero(lo < hi)
+        while len(active):
+            mid = (lo[active] + hi[active]) // 2
+            less = self.neighbors[mid] < v[active]
+            lo[active[less]] = mid[less] + 1
+            hi[active[~less]] = mid[~less]
+            active = active[lo[active] < hi[active]]
+        at = np.minimum(lo, len(self.neighbors) - 1)
+        found = (lo < end) & (self.neighbors[at] == v)
+        out[pairs[found]] = self.types[at[found]]
+        return out
+
+    def check_paths(self, matrix, lengths):
+        """Checks every edge of a batch of paths.
+        Parameters:
+        matrix  A 2D array with one path per row origin first, padded past its
+                length, see path_store.PathStore.pack with reverse set
+        lengths  A 1D array of path lengths
+
+        Returns:
+        hop_rels  An int8 array of the relationship of the sender of each hop
+                  to its receiver; CUSTOMER going up, PEER, PROVIDER going down,
+                  NO_REL if unknown or past the path.
+        missing  A bool array, True for hops without a relationship. Repeated
+                 ASNs of prepended paths are not hops.
+        valley  A bool array, True for paths that are not valley free; a hop
+                going up or across after one going across or down.
+        """
+        matrix = np.asarray(matrix, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        width = max(matrix.shape[1] - 1, 0)
+        sender = matrix[:, :width]
+        receiver = matrix[:, 1:width + 1]
+        hops = (np.arange(width) < (lengths - 1)[:, None]) & (sender != receiver)
+        hop_rels = np.full(hops.shape, NO_REL, dtype=np.int8)
+        # Paths share most of their edges, each distinct one is looked up once
+        edges, inverse = np.unique(pack(receiver[hops], sender[hops]), return_inverse=True)
+        hop_rels[hops] = self.edge_types(*unpack(edges))[inverse.reshape(-1)]
+        missing = hops & (hop_rels == NO_REL)
+        turned = (hop_rels == PEER) | (hop_rels == PROVIDER)
+        # Hops after the first one across or down
+        after = (np.cumsum(turned, axis=1) - turned) > 0
+        valley = (after & ((hop_rels == CUSTOMER) | (hop_rels == PEER))).any(axis=1)
+        return hop_rels, missing, valley
+
+
+def source_signature(conn):
+    """Describes the current state of the relationship tables.
+
+    The version counters are bumped by a trigger in the same transaction as
+    every insert, update, delete or truncate, so unlike the statistics
+    collector they are never late, reset or lost in a crash. Reading them
+    costs a catalog lookup, not a scan of the tables.
+
+    Parameters:
+    conn  A psycopg2 connection
+
+    Returns:
+    signature  A tuple of ((customer_providers version, peers version), table
+               identities), or None if the tables are not versioned.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (VERSION_TABLE,))
+    rows = []
+    if cur.fetchone()[0]:
+        cur.execute(SIGNATURE_SQL.format(versions=VERSION_TABLE), {"trigger": VERSION_TRIGGER})
+        rows = cur.fetchall()
+    cur.close()
+    if len(rows) != len(REL_TABLES) or not all(row[5] and row[4] is not None for row in rows):
+        return None
+    versions = tuple(int(row[4]) for row in rows)
+    return (versions, tuple(tuple(row[:4]) for row in rows))
+
+
+def install_versioning(conn):
+    """Creates the version table and the triggers that keep it current.
+
+    They are created in the schema the relationship tables resolve to. Safe
+    to run again, each run also invalidates existing snapshots.
+
+    Parameters:
+    conn  A psycopg2 connection allowed to create tables and triggers
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT n.nspname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE c.oid = to_regclass(%s)", (REL_TABLES[0],))
+    schema = quote_ident(cur.fetchone()[0], cur)
+    versions = schema + "." + VERSION_TABLE
+    cur.execute(VERSIONING_DDL.format(schema=schema, versions=versions, trigger=VERSION_TRIGGER))
+    for table in REL_TABLES:
+        cur.execute(TRIGGER_DDL.format(schema=schema, versions=versions, trigger=VERSION_TRIGGER,
+                                       table=schema + "." + table))
+    cur.close()
+    conn.commit()
+    print(datetime.now().strftime("%c") + ": Installed relationship versioning in " + schema)
+
+
+def _digest(signature):
+    """Hashes a source signature into the 16 bytes stored in the header."""
+    return hashlib.blake2b(repr(signature).encode(), digest_size=16).digest()
+
+
+def shared_index(conn, fn=SNAPSHOT_LOC):
+    """Returns the process wide RelationshipIndex, loading it on first use.
+    Parameters:
+    conn  A psycopg2 connection used if the index is not loaded yet
+    fn  Path of the snapshot file, or None to always read the database
+    """
+    global _shared
+    if _shared is None:
+        if fn is None:
+            _shared = RelationshipIndex.from_db(conn)
+        else:
+            _shared = RelationshipIndex.load(conn, fn)
+    return _shared
+
+
+def set_shared_index(index):
+    """Installs an already built RelationshipIndex as the process wide index."""
+    global _shared
+    _shared = index
+
+
+def main():
+    """Installs the relationship table versioning.
+
+    Parameters:
+    argv[1]  install
+    """
+    if len(sys.argv) != 2 or sys.argv[1] != "install":
+        print("Usage: relationships.py install", file=sys.stderr)
+        sys.exit(-1)
+    with db.connection() as conn:
+        install_versioning(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module reads and writes verification results in a columnar format.
+
+Each results file is a NumPy .npz archive with one row per collector and one
+array per counter, so a whole trial loads with a single read. The archive
+carries a format version and the list of fields it holds.
+
+The DIAGNOSTICS fields are only computed by engines holding every path in
+memory. The streaming, incremental and server side engines write them as
+NOT_COMPUTED in every entry, so a zero is always a real count.
+
+Concurrent workers write one shard per collector and mode, which merge_shards
+combines into the per mode results in collector order.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+import sys
+
+import numpy as np
+
+FORMAT_VERSION = 4
+
+# Version of the .csv results, given by their first line. Version 2 replaced
+# the list of edit distances of each collector with their histogram
+CSV_VERSION = 2
+CSV_HEADER = "version,%d\n" % CSV_VERSION
+
+RESULTS_DIR = "results"
+
+# Results file names indexed by the Verifier origin_only mode
+MODE_FILES = ("full_verified", "origin_verified", "no_prop_verified")
+
+# One value per collector, named after the Verifier attributes
+SCALARS = (("ctrl_AS", np.int64),
+           ("prefixes", np.int64),
+           ("verifiable", np.int64),
+           ("mrt_avg_len", np.float64),
+           ("mrt_max_len", np.int64),
+           ("ext_avg_len", np.float64),
+           ("ext_max_len", np.int64),
+           ("pref_f", np.int64),
+           ("orig_f", np.int64),
+           ("traceback_f", np.int64),
+           ("compare_f", np.int64),
+           ("levenshtein_avg", np.float64),
+           ("missing_f", np.int64),
+           ("mrt_valley_f", np.int64),
+           ("ext_valley_f", np.int64))
+
+# Fixed length counters per collector
+VECTORS = ("k", "l", "seed_f", "prop_f", "pref_cover_f", "mrt_rel_f", "ext_rel_f")
+
+# Histogram of edit distances, zero padded to the widest collector
+HISTOGRAM = "levenshtein_d"
+
+FIELDS = tuple(name for name, _ in SCALARS) + VECTORS + (HISTOGRAM,)
+
+# Failure diagnostics, see Verifier.classify_missing and Verifier.check_paths
+DIAGNOSTICS = ("pref_cover_f", "mrt_rel_f", "ext_rel_f", "mrt_valley_f", "ext_valley_f")
+
+# Value of every entry of a diagnostic the engine did not compute
+NOT_COMPUTED = -1
+
+
+class FormatError(Exception):
+    """Raised when a results file has an unknown version or missing fields."""
+
+
+def from_verifier(v):
+    """Returns the results of a Verifier as a one row column set."""
+    columns = {name: np.array([getattr(v, name)], dtype=dtype) for name, dtype in SCALARS}
+    for name in VECTORS:
+        columns[name] = np.array([getattr(v, name)], dtype=np.int64)
+    columns[HISTOGRAM] = np.array([v.levenshtein_d.trimmed()], dtype=np.int64)
+    return columns
+
+
+def concat(column_sets):
+    """Stacks column sets row wise, padding histograms to a common width."""
+    columns = {}
+    for name in FIELDS:
+        arrays = [c[name] for c in column_sets]
+        if name == HISTOGRAM:
+            width = max(a.shape[1] for a in arrays)
+            arrays = [np.pad(a, ((0, 0), (0, width - a.shape[1]))) for a in arrays]
+        columns[name] = np.concatenate(arrays)
+    return columns
+
+
+def save(fn, columns):
+    """Writes a column set, replacing fn atomically."""
+    tmp = fn + ".tmp%d" % os.getpid()
+    with open(tmp, "wb") as f:
+        np.savez(f, version=np.array(FORMAT_VERSION), fields=np.array(FIELDS),
+                 **{name: columns[name] for name in FIELDS})
+    os.replace(tmp, fn)
+
+
+def load(fn):
+    """Reads a column set.
+
+    Returns:
+    columns  Dictionary of {field: array} with one row per collector.
+    """
+    with np.load(fn) as data:
+        version = int(data["version"]) if "version" in data else None
+        if version != FORMAT_VERSION:
+            raise FormatError("%s has results format version %s, expected %d"
+                              % (fn, version, FORMAT_VERSION))
+        missing = [name for name in FIELDS if name not in data]
+        if missing:
+            raise FormatError("%s is missing fields %s" % (fn, ", ".join(missing)))
+        return {name: data[name] for name in FIELDS}
+
+
+def check_csv_header(fn, row):
+    """Raises FormatError unless row is the header of the current .csv version."""
+    if row != ["version", str(CSV_VERSION)]:
+        raise FormatError("%s is not a version %d results .csv, first line %s"
+                          % (fn, CSV_VERSION, ",".join(row or [])))
+
+
+def append_text(fn, text):
+    """Adds the lines of one collector to the .csv results fn, creating it with a header."""
+    with open(fn, "a+") as f:
+        if f.tell() == 0:
+            f.write(CSV_HEADER)
+        f.write(text)
+
+
+def append(fn, columns):
+    """Adds rows to the results file fn, creating it if needed.
+
+    The whole file is read and written again on every call. Only
+    Verifier.output without a shard directory appends, one collector at a
+    time; the drivers build their results once with merge_shards.
+    """
+    if os.path.exists(fn):
+        columns = concat([load(fn), columns])
+    save(fn, columns)
+
+
+def shard_name(shard_dir, asn, name):
+    """Returns the shard path of one collector and mode, without an extension."""
+    return os.path.join(shard_dir, "%s.%s" % (name, asn))
+
+
+def write_shard(base, text, columns):
+    """Writes the .csv and .npz shard of one collector and mode atomically.
+    Parameters:
+    base  Shard path without an extension, see shard_name
+    text  Lines of the .csv results, without the header
+    columns  One row column set, see from_verifier
+    """
+    os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+    save(base + ".npz", columns)
+    # The .csv is renamed last, it marks the shard as complete
+    tmp = base + ".csv.tmp%d" % os.getpid()
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, base + ".csv")
+
+
+def merge_shards(shard_dir, asns, modes = (0, 1, 2), out_dir = RESULTS_DIR):
+    """Builds the per mode results from shards in collector order.
+
+    Every shard of a mode is read once and the merged arrays are built with a
+    single concat, replacing the results in out_dir. The drivers give each
+    trial its own out_dir, so merging again after a resume does not repeat
+    collectors, see driver.trial_dir.
+
+    Parameters:
+    shard_dir  Directory the shards were written to
+    asns  Collector ASNs in output order
+    modes  The origin_only modes to merge
+    out_dir  Directory of the merged results
+
+    Returns:
+    missing  List of (ASN, mode) pairs without a complete shard.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    missing = []
+    for mode in modes:
+        name = MODE_FILES[mode]
+        texts = []
+        column_sets = []
+        for asn in asns:
+            base = shard_name(shard_dir, asn, name)
+            if not os.path.exists(base + ".csv"):
+                missing.append((asn, mode))
+                continue
+            with open(base + ".csv") as f:
+                texts.append(f.read())
+            column_sets.append(load(base + ".npz"))
+        fn = os.path.join(out_dir, name)
+        tmp = fn + ".csv.tmp%d" % os.getpid()
+        with open(tmp, "w") as f:
+            f.write(CSV_HEADER + "".join(texts))
+        os.replace(tmp, fn + ".csv")
+        if column_sets:
+            save(fn + ".npz", concat(column_sets))
+    for asn, mode in missing:
+        print("No results for AS%s %s" % (asn, MODE_FILES[mode]), file=sys.stderr)
+    return missing
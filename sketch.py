@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines compact, mergeable accumulators for verification stats.
+
+Per prefix values are folded into fixed size state as they are produced, so
+memory and output size do not grow with the number of prefixes, and the state
+of several workers or shards can be merged into one.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import numpy as np
+
+
+class Histogram:
+    """This class counts small non-negative integers, such as edit distances.
+
+    The counts are exact. A running mean and variance are kept alongside with
+    Welford's method, merged with the parallel formula of Chan et al.
+    """
+
+    def __init__(self, counts = None):
+        """Parameters:
+        counts  Optional list of counts, counts[i] is the number of times i was seen
+        """
+        self.counts = [0] * 16
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        if counts:
+            values = np.arange(len(counts))
+            self.add_many(np.repeat(values, counts))
+
+    def __len__(self):
+        return self.n
+
+    def __eq__(self, other):
+        return isinstance(other, Histogram) and self.trimmed() == other.trimmed()
+
+    def add(self, value):
+        """Adds a single value."""
+        if value >= len(self.counts):
+            self.counts.extend([0] * (value + 1 - len(self.counts)))
+        self.counts[value] += 1
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def add_many(self, values):
+        """Adds an array of values at once."""
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        counts = np.bincount(values).tolist()
+        if len(counts) > len(self.counts):
+            self.counts.extend([0] * (len(counts) - len(self.counts)))
+        for i, c in enumerate(counts):
+            self.counts[i] += c
+        mean = float(values.mean())
+        self._combine(len(values), mean, float(((values - mean) ** 2).sum()))
+
+    def merge(self, other):
+        """Adds every value counted by another Histogram."""
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        if other.n:
+            self._combine(other.n, other.mean, other.m2)
+        return self
+
+    def _combine(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+
+    def variance(self):
+        """Returns the sample variance, 0 for fewer than two values."""
+        if self.n < 2:
+            return 0.0
+        return self.m2 / (self.n - 1)
+
+    def trimmed(self):
+        """Returns the counts without trailing zeros."""
+        end = len(self.counts)
+        while end > 1 and self.counts[end - 1] == 0:
+            end -= 1
+        return self.counts[:end]
+
+
+def merge_mean(mean_a, n_a, mean_b, n_b):
+    """Combines the means of two disjoint samples."""
+    if n_a + n_b == 0:
+        return 0
+    return mean_a + (mean_b - mean_a) * n_b / (n_a + n_b)
+
+
+def merge_counts(a, b):
+    """Adds two equal length lists of counters element wise."""
+    return [x + y for x, y in zip(a, b)]
@@ -9,9 +9,10 @@ import sys
 import psycopg2
 import psycopg2.extras
 import shutil
-from configparser import ConfigParser
 from datetime import datetime
 
+import db
+
 
 class Querier:
     
@@ -20,29 +21,15 @@ class Querier:
         asn  A string or int representation of 32 bit ASN.
         origin_only  A integer to select extrapolator data.
         """
-        CONFIG_LOC = r"/etc/bgp/bgp.conf"
+        CONFIG_LOC = db.CONFIG_LOC
 
     def connect_to_db(self):
         """Creates a connection to the SQL database.
         
         Returns:
-        cur  A reference to the psycopg2 SQL named tuple cursor.
+        conn  A psycopg2 connection.
         """
-        # Get the config profile
-        cparser = ConfigParser()
-        cparser.read("/etc/bgp/bgp.conf")
-        # Establish DB connection
-        print(datetime.now().strftime("%c") + ": Connecting to database...")
-        try:
-            conn = psycopg2.connect(host = cparser['bgp']['host'],
-                                    database = cparser['bgp']['database'],
-                                    user = cparser['bgp']['user'],
-                                    password = cparser['bgp']['password'])
-            print(datetime.now().strftime("%c") + ": Login successful.")
-        except:
-            print(datetime.now().strftime("%c") + ": Login failed.")
-        # Return connection
-        return conn
+        return db.connect()
 
     def collectors_tbl(self, cursor):
         # Counts for collectors’s prefixes
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module generates synthetic BGP data and serves it as a stand-in database.
+
+The generator builds a tiered AS topology with CAIDA style relationships and
+valley free announcements, then derives the control and extrapolation tables
+the Verifier reads. StandInConnection answers exactly the queries built by the
+queries and relationships modules, through cursors and binary COPY, so the
+Verifier runs end to end without Postgres.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import io
+import struct
+import random
+import hashlib
+import ipaddress
+from collections import namedtuple
+
+import queries
+import copy_loader
+
+# Column types of the binary COPY encoder
+CIDR, INT8, INT8_ARRAY = "cidr", "int8", "int8[]"
+
+Scale = namedtuple("Scale", "ases prefixes collectors max_hops dups missing origin_err path_err seed")
+
+DEFAULT_SCALE = Scale(ases=2000, prefixes=20000, collectors=1, max_hops=8, dups=1,
+                      missing=0.05, origin_err=0.02, path_err=0.3, seed=0)
+
+
+class Topology:
+    """This class holds a tiered AS graph with provider and peer links."""
+
+    def __init__(self, ases, rand):
+        """Parameters:
+        ases  Number of ASes, numbered from 1
+        rand  A random.Random instance
+        """
+        self.ases = list(range(1, ases + 1))
+        self.tier1 = self.ases[:max(ases // 200, 3)]
+        self.providers = {asn: [] for asn in self.ases}
+        self.peers = set()
+        # Tier 1 ASes peer with each other
+        for i, a in enumerate(self.tier1):
+            for b in self.tier1[i + 1:]:
+                self.peers.add((a, b))
+        # Every other AS buys transit from one to three lower numbered ASes
+        for asn in self.ases[len(self.tier1):]:
+            upstream = self.ases[:asn - 1]
+            self.providers[asn] = rand.sample(upstream, min(len(upstream), rand.randint(1, 3)))
+            if rand.random() < 0.3:
+                peer = rand.choice(upstream[len(self.tier1):] or upstream)
+                self.peers.add((min(asn, peer), max(asn, peer)))
+
+    def up_chain(self, asn, rand):
+        """Returns a path from asn up its providers to a tier 1 AS."""
+        chain = [asn]
+        while self.providers[chain[-1]]:
+            chain.append(rand.choice(self.providers[chain[-1]]))
+        return chain
+
+    def route(self, src, origin, rand):
+        """Returns a valley free AS path from src to origin."""
+        up = self.up_chain(src, rand)
+        down = self.up_chain(origin, rand)
+        # Meet at the first common AS, or across the tier 1 clique
+        common = set(up) & set(down)
+        if common:
+            meet = min(common, key=up.index)
+            return up[:up.index(meet)] + down[down.index(meet)::-1]
+        return up + down[::-1]
+
+    def customer_providers(self):
+        return [(p, c) for c, provs in self.providers.items() for p in provs]
+
+
+class Dataset:
+    """This class holds every synthetic table, as lists of row tuples."""
+
+    def __init__(self, scale = DEFAULT_SCALE, trial = "bench"):
+        """Parameters:
+        scale  A Scale of the data to generate
+        trial  Trial name used in the table names
+        """
+        rand = random.Random(scale.seed)
+        self.scale = scale
+        self.trial = trial
+        self.topology = Topology(scale.ases, rand)
+        self.peers = sorted(self.topology.peers)
+        self.customer_providers = self.topology.customer_providers()
+        self.collectors = rand.sample(self.topology.ases[len(self.topology.tier1):], scale.collectors)
+        self.prefixes = [str(ipaddress.IPv4Network(((10 << 24) + (i << 8), 24)))
+                         for i in range(scale.prefixes)]
+        origins = [rand.choice(self.topology.ases) for _ in self.prefixes]
+
+        # (prefix, as_path, origin), collector first
+        self.mrt_announcements = []
+        # Table name: list of rows
+        self.tables = {}
+        for asn in self.collectors:
+            ctrl = []
+            data = {mode: [] for mode in ("", "_oo", "_mo")}
+            for prefix, origin in zip(self.prefixes, origins):
+                path = self.topology.route(asn, origin, rand)
+                if len(path) > scale.max_hops:
+                    path = path[:scale.max_hops - 1] + [origin]
+                for _ in range(1 + rand.randint(0, scale.dups)):
+                    # Duplicates repeat hops, as prepending does
+                    dup = list(path)
+                    if rand.random() < 0.2:
+                        i = rand.randrange(len(dup))
+                        dup[i:i] = [dup[i]] * rand.randint(1, 3)
+                    ctrl.append((prefix, origin, dup))
+                    self.mrt_announcements.append((prefix, dup, origin))
+                for mode in data:
+                    if rand.random() < scale.missing:
+                        continue
+                    ext_origin = origin
+                    if rand.random() < scale.origin_err:
+                        ext_origin = rand.choice(self.topology.ases)
+                    ext_path = self.perturb(path, rand) if rand.random() < scale.path_err else list(path)
+                    data[mode].append((prefix, ext_origin, ext_path, rand.randint(0, len(ext_path))))
+            self.tables["verify_ctrl_%d_%s" % (asn, trial)] = ctrl
+            for mode, rows in data.items():
+                self.tables["verify_data_%d%s_%s" % (asn, mode, trial)] = rows
+
+    def perturb(self, path, rand):
+        """Applies an extrapolator style mistake to a path."""
+        path = list(path)
+        op = rand.randint(0, 2)
+        hop = rand.randrange(len(path))
+        if op == 0:
+            path[hop] = rand.choice(self.topology.ases)
+        elif op == 1 and len(path) > 1:
+            del path[hop]
+        else:
+            path.insert(hop, rand.choice(self.topology.ases))
+        return path
+
+    def rows(self):
+        """Returns the total number of verification table rows."""
+        return sum(len(rows) for rows in self.tables.values())
+
+
+def dedup(path):
+    """Removes duplicate ASNs, keeping the first occurrence, see queries.DEDUP_PATH."""
+    return list(dict.fromkeys(path))
+
+
+def first_per_prefix(rows):
+    """Keeps the first row of each prefix, in byte order of the prefix text."""
+    first = {}
+    for row in rows:
+        first.setdefault(row[0], row)
+    return [first[prefix] for prefix in sorted(first)]
+
+
+class StandIn:
+    """This class maps the SQL the Verifier sends to result rows of a Dataset."""
+
+    def __init__(self, dataset):
+        """Parameters:
+        dataset  The Dataset to serve
+        """
+        self.dataset = dataset
+        # sql: (types, function of params returning rows)
+        self.handlers = {}
+        self.add("SELECT 1", (INT8,), lambda: [(1,)])
+        self.add("SELECT peer_as_1, peer_as_2 FROM peers", (INT8, INT8),
+                 lambda: list(dataset.peers))
+        self.add("SELECT provider_as, customer_as FROM customer_providers", (INT8, INT8),
+                 lambda: list(dataset.customer_providers))
+        for table, rows in dataset.tables.items():
+            if table.startswith("verify_ctrl_"):
+                self.add_ctrl(table, rows)
+            else:
+                self.add_data(table, rows)
+        for ctrl in [t for t in dataset.tables if t.startswith("verify_ctrl_")]:
+            asn = ctrl[len("verify_ctrl_"):-len("_" + dataset.trial)]
+            for mode in ("", "_oo", "_mo"):
+                data = "verify_data_%s%s_%s" % (asn, mode, dataset.trial)
+                self.add_hashes(ctrl, data)
+                self.add_server(ctrl, data)
+
+    def add(self, sql, types, rows):
+        self.handlers[sql] = (types, rows)
+
+    def add_ctrl(self, table, rows):
+        """Serves mrt_anns of a control table of (prefix, origin, as_path) rows."""
+        first = [(p, o, dedup(path)) for p, o, path in first_per_prefix(rows)]
+        types = (CIDR, INT8, INT8_ARRAY)
+        self.add(queries.mrt_anns(table), types, lambda: first)
+        self.add(queries.mrt_anns(table, True), types, lambda prefixes: _only(first, prefixes))
+
+    def add_data(self, table, rows):
+        """Serves ext_anns and tb_anns of an extrapolation table."""
+        first = [(p, o, dedup(path), inf) for p, o, path, inf in first_per_prefix(rows)]
+        types = (CIDR, INT8, INT8_ARRAY, INT8)
+        self.add(queries.ext_anns(table), types, lambda: first)
+        self.add(queries.ext_anns(table, True), types, lambda prefixes: _only(first, prefixes))
+        self.add(queries.tb_anns(table), (INT8, CIDR, INT8, INT8), lambda: _received_from(first))
+
+    def add_hashes(self, ctrl, data):
+        """Serves prefix_hashes of a control and extrapolation table pair."""
+        def rows():
+            ext = {row[0]: _md5(row[1:]) for row in self.rows(queries.ext_anns(data))}
+            return [(row[0], _md5(row[1:]), ext.get(row[0])) for row in self.rows(queries.mrt_anns(ctrl))]
+        self.add(queries.prefix_hashes(ctrl, data), (CIDR, None, None), rows)
+
+    def add_server(self, ctrl, data):
+        """Serves server_outcomes of a control and extrapolation table pair."""
+        def rows():
+            rels = set(self.dataset.peers) | set(self.dataset.customer_providers)
+            ext = {row[0]: row[1:] for row in self.rows(queries.ext_anns(data))}
+            groups = {}
+            out = []
+            for c, (prefix, origin, mp) in enumerate(self.rows(queries.mrt_anns(ctrl)), 1):
+                row = _outcome(mp, origin, ext.get(prefix), rels)
+                if row[4]:
+                    out.append(tuple(row[:8]) + (1, [c]) + tuple(row[8:]))
+                else:
+                    groups.setdefault(tuple(row[:8]), []).append(c)
+            return out + [key + (len(cs), cs, None, None) for key, cs in groups.items()]
+        self.add(queries.server_outcomes(ctrl, data), (None,) * 12, rows)
+
+    def lookup(self, sql):
+        """Returns the (types, rows function) of a query, for unknown SQL a LookupError."""
+        try:
+            return self.handlers[sql.strip()]
+        except KeyError:
+            raise LookupError("Stand-in database can not answer: " + sql[:200]) from None
+
+    def rows(self, sql, params = None):
+        types, func = self.lookup(sql)
+        if params and "prefixes" in params and params["prefixes"] is not None:
+            return func(params["prefixes"])
+        return func()
+
+
+def _only(rows, prefixes):
+    keep = set(prefixes)
+    return [row for row in rows if row[0] in keep]
+
+
+def _outcome(mp, origin, ext, rels):
+    """Returns the outcome of a control prefix as a server_outcomes row without the count and positions."""
+    mrt_l = len(mp)
+    if ext is None or ext[0] != origin:
+        cls = 1 if ext is None else 2
+        return [cls, mrt_l, 0, 0, False, False, False, mrt_l, mp, None]
+    _, ep, inf = ext
+    ext_l = len(ep)
+    common = min(mrt_l, ext_l)
+    d = next((i for i in range(common) if mp[mrt_l - 1 - i] != ep[ext_l - 1 - i]), None)
+    if d is None:
+        return [0, mrt_l, ext_l, common, False, False, False, abs(mrt_l - ext_l), None, None]
+    a, b = mp[mrt_l - 1 - d], ep[ext_l - 1 - d]
+    missing_rel = not ((a, b) in rels or (b, a) in rels)
+    return [0, mrt_l, ext_l, d, True, ext_l - d <= inf, missing_rel, None, mp, ep]
+
+
+def _md5(values):
+    return hashlib.md5(repr(values).encode()).hexdigest()
+
+
+def _received_from(rows):
+    """Expands extrapolated paths into (asn, prefix, origin, received from) rows."""
+    out = []
+    for prefix, origin, path, _ in rows:
+        for asn, recv in zip(path, path[1:]):
+            out.append((asn, prefix, origin, recv))
+        out.append((path[-1], prefix, origin, path[-1]))
+    return out
+
+
+class StandInCursor:
+    """This class implements the psycopg2 cursor methods the Verifier uses."""
+
+    def __init__(self, conn, name = None):
+        self.conn = conn
+        self.name = name
+        self.itersize = 2000
+        self.rowcount = -1
+        self._rows = iter(())
+
+    def execute(self, sql, params = None):
+        sql = self.conn.bound.get(sql, sql)
+        if isinstance(sql, tuple):
+            sql, params = sql
+        rows = self.conn.standin.rows(sql, params)
+        self.rowcount = len(rows)
+        self._rows = iter(rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size = None):
+        return [row for _, row in zip(range(size or self.itersize), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def mogrify(self, sql, params):
+        """Returns a unique query string standing for sql bound to params."""
+        bound = "%s /* bound %d */" % (sql, len(self.conn.bound))
+        self.conn.bound[bound] = (sql, params)
+        return bound.encode()
+
+    def copy_expert(self, sql, out):
+        prefix, suffix = "COPY (", ") TO STDOUT (FORMAT binary)"
+        if not (sql.startswith(prefix) and sql.endswith(suffix)):
+            raise LookupError("Stand-in database only supports binary COPY out")
+        inner = sql[len(prefix):-len(suffix)]
+        inner = self.conn.bound.get(inner, inner)
+        params = None
+        if isinstance(inner, tuple):
+            inner, params = inner
+        types, _ = self.conn.standin.lookup(inner)
+        out.write(encode_copy(types, self.conn.standin.rows(inner, params)))
+
+    def close(self):
+        self._rows = iter(())
+
+
+class StandInConnection:
+    """This class implements the psycopg2 connection methods the Verifier uses."""
+
+    def __init__(self, standin):
+        self.standin = standin
+        self.closed = 0
+        self.bound = {}
+
+    def cursor(self, name = None):
+        return StandInCursor(self, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.bound.clear()
+
+    def close(self):
+        self.closed = 1
+
+
+_i16 = struct.Struct(">h")
+_i32 = struct.Struct(">i")
+_i64 = struct.Struct(">q")
+
+
+def _encode_field(kind, value):
+    if value is None:
+        return _i32.pack(-1)
+    if kind == INT8:
+        data = _i64.pack(value)
+    elif kind == CIDR:
+        # The whole address is sent, as inet_send does
+        net = ipaddress.ip_network(value)
+        addr = net.network_address.packed
+        family = copy_loader.PGSQL_AF_INET if net.version == 4 else copy_loader.PGSQL_AF_INET6
+        data = bytes((family, net.prefixlen, 1, len(addr))) + addr
+    elif kind == INT8_ARRAY:
+        if not value:
+            data = struct.pack(">iii", 0, 0, copy_loader.INT8OID)
+        else:
+            data = struct.pack(">iiiii", 1, 0, copy_loader.INT8OID, len(value), 1)
+            data += b"".join(_i32.pack(8) + _i64.pack(v) for v in value)
+    else:
+        data = str(value).encode()
+    return _i32.pack(len(data)) + data
+
+
+def encode_copy(types, rows):
+    """Encodes rows as a binary COPY stream."""
+    out = io.BytesIO()
+    out.write(copy_loader.SIGNATURE + _i32.pack(0) + _i32.pack(0))
+    for row in rows:
+        out.write(_i16.pack(len(row)))
+        for kind, value in zip(types, row):
+            out.write(_encode_field(kind, value))
+    out.write(_i16.pack(-1))
+    return out.getvalue()
+
+
+def connector(dataset):
+    """Returns a function creating connections to a stand-in for dataset, see db.set_connector."""
+    standin = StandIn(dataset)
+    return lambda: StandInConnection(standin)
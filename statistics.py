@@ -12,6 +12,7 @@ import sys
 import shutil
 import csv
 import numpy as np
+import results
 import matplotlib.pyplot as plt
 import scipy.stats as sts
 from scipy import mean
@@ -34,6 +35,7 @@ class Trial_Set:
         self.kcomp_success = []
         self.kcomp_failure = []
         self.prefix_f = []
+        self.prefix_cover_f = []
         self.origin_f = []
         self.traceback_f = []
         self.compare_f = []
@@ -41,6 +43,37 @@ class Trial_Set:
         self.inference_f = []
         self.levenshtein_avg = []
         self.levenshtein_d = []
+        self.missing_f = []
+        self.seed_f = []
+        self.prop_f = []
+        self.mrt_rel_f = []
+        self.ext_rel_f = []
+        self.mrt_valley_f = []
+        self.ext_valley_f = []
+
+    def load(self, fn):
+        """Loads every collector of a results .npz file as arrays."""
+        columns = results.load(check_file(fn))
+        self.asns = columns["ctrl_AS"].astype(str)
+        self.verifiable = columns["verifiable"]
+        self.mrt_len = columns["mrt_avg_len"]
+        self.ext_len = columns["ext_avg_len"]
+        self.kcomp_success = columns["k"]
+        self.kcomp_failure = columns["l"]
+        self.prefix_f = columns["pref_f"]
+        self.prefix_cover_f = columns["pref_cover_f"]
+        self.origin_f = columns["orig_f"]
+        self.traceback_f = columns["traceback_f"]
+        self.compare_f = columns["compare_f"]
+        self.levenshtein_avg = columns["levenshtein_avg"]
+        self.levenshtein_d = columns["levenshtein_d"]
+        self.missing_f = columns["missing_f"]
+        self.seed_f = columns["seed_f"]
+        self.prop_f = columns["prop_f"]
+        self.mrt_rel_f = columns["mrt_rel_f"]
+        self.ext_rel_f = columns["ext_rel_f"]
+        self.mrt_valley_f = columns["mrt_valley_f"]
+        self.ext_valley_f = columns["ext_valley_f"]
 
     def add_asn(self, asn):
         self.asns.append(asn)
@@ -84,6 +117,15 @@ class Trial_Set:
     def add_levenshtein_d(self, lst):
         self.levenshtein_d.append(lst)
 
+    def add_missing_f(self, num):
+        self.missing_f.append(num)
+
+    def add_seed_f(self, lst):
+        self.seed_f.append(lst)
+
+    def add_prop_f(self, lst):
+        self.prop_f.append(lst)
+
 """ Handles loading data into the Trials objects."""
 class Switch(object):
     def num_to_method(self, num, trial, row):
@@ -128,8 +170,18 @@ class Switch(object):
         trial.add_levenshtein_avg(float(row[0]))
 
     def n_11(self, trial, row):
+        # Histogram of distances, row[i] is the count of distance i
         trial.add_levenshtein_d(list(map(int, row)))
 
+    def n_12(self, trial, row):
+        trial.add_missing_f(int(row[0]))
+
+    def n_13(self, trial, row):
+        trial.add_seed_f(list(map(int, row)))
+
+    def n_14(self, trial, row):
+        trial.add_prop_f(list(map(int, row)))
+
 def average(lst):
     return sum(lst) / len(lst)
 
@@ -141,14 +193,27 @@ def check_file(fn):
         print("%s missing" % fn, file=sys.stderr)
         sys.exit(-1)
 
+# Lines written per collector by Verifier.output
+CSV_LINES = 15
+
 def load_data(trial, fn):
-    """Loads data of a given file into a given trial."""
+    """Loads data of a given file into a given trial.
+
+    The .npz results next to fn are used when present. A .csv must start with
+    the header of results.CSV_VERSION, older files held every distance where
+    the histogram now is and are rejected.
+    """
+    npz = path.splitext(fn)[0] + ".npz"
+    if path.exists(npz):
+        trial.load(npz)
+        return
     line_n = 0
     s = Switch()
     with open(check_file(fn), "r+") as csvFile:
         readCSV = csv.reader(csvFile, delimiter=',')
+        results.check_csv_header(fn, next(readCSV, None))
         for row in readCSV:
-            s.num_to_method(line_n%12, trial, row)
+            s.num_to_method(line_n%CSV_LINES, trial, row)
             line_n += 1
 
 def calc_std(lst_of_lsts):
@@ -173,6 +238,31 @@ def calc_ci(lst_of_lsts):
         std_lst.append(conf_int(lst))
     return np.array(std_lst)
 
+def hist_mean(counts):
+    """Returns the mean of the values counted by a histogram."""
+    counts = np.asarray(counts, dtype=np.float64)
+    return np.dot(np.arange(len(counts)), counts) / counts.sum()
+
+def hist_conf_int(counts):
+    """Same as conf_int, for a histogram where counts[i] is the number of values equal to i.
+
+    Like conf_int, returns nan for fewer than two values.
+    """
+    confidence = 0.95
+    counts = np.asarray(counts, dtype=np.float64)
+    values = np.arange(len(counts))
+    n = counts.sum()
+    if n < 2:
+        return np.nan
+    m = hist_mean(counts)
+    std_err = np.sqrt(np.dot(counts, (values - m) ** 2) / (n - 1) / n)
+    h = std_err * sts.t.ppf((1 + confidence) / 2, n - 1)
+    return h
+
+def calc_hist_ci(hists):
+    """Generates a numpy array storing confidence intervals for each histogram."""
+    return np.array([hist_conf_int(counts) for counts in hists])
+
 def kcomp_to_arr(kc_lists, max_p_l):
     """ Generates a numpy array of kcomp averages from a list of lists.
     
@@ -220,9 +310,9 @@ def plot_ld(full, origin_o, no_prop):
     asn_index = np.array(unzipped[3])
     print(asn_index)
 
-    f_ci = calc_ci(full.levenshtein_d)
-    oo_ci = calc_ci(origin_o.levenshtein_d)
-    np_ci = calc_ci(no_prop.levenshtein_d)
+    f_ci = calc_hist_ci(full.levenshtein_d)
+    oo_ci = calc_hist_ci(origin_o.levenshtein_d)
+    np_ci = calc_hist_ci(no_prop.levenshtein_d)
 
     N = f_lev_d.size
     f_ind = np.arange(1,N+1) # the x collectors for the trial
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines generators for streaming verification.
+
+Both verification tables are read in prefix order through server side cursors,
+using the queries module, and merge joined one prefix at a time, so memory does
+not grow with the size of either table.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+from itertools import groupby
+from operator import itemgetter
+
+# Rows fetched from the server per round trip
+ITERSIZE = 20000
+
+# Prefix position in a verification table row
+PREFIX_COL = 0
+
+
+def iter_rows(conn, name, sql, itersize=ITERSIZE):
+    """Iterates over the result of a query through a named server side cursor.
+    Parameters:
+    conn  A psycopg2 connection
+    name  Name of the server side cursor
+    sql  The query to execute
+    itersize  Rows fetched per round trip
+
+    Returns:
+    rows  A generator of result rows.
+    """
+    cur = conn.cursor(name)
+    cur.itersize = itersize
+    try:
+        cur.execute(sql)
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+
+def first_per_prefix(rows, col=PREFIX_COL):
+    """Keeps the first row of each prefix from rows sorted by prefix.
+    Parameters:
+    rows  An iterable of rows sorted by prefix
+    col  Prefix position in a row
+
+    Returns:
+    rows  A generator of (prefix, row) pairs, one per prefix.
+    """
+    for prefix, group in groupby(rows, key=itemgetter(col)):
+        yield str(prefix), next(group)
+
+
+def merge_join(mrt_rows, ext_rows):
+    """Left joins two (prefix, row) streams sorted by prefix.
+    Parameters:
+    mrt_rows  Control set stream, as returned by first_per_prefix
+    ext_rows  Extrapolation stream, as returned by first_per_prefix
+
+    Returns:
+    rows  A generator of (prefix, mrt row, ext row or None) for every control prefix.
+    """
+    ext_rows = iter(ext_rows)
+    ext = next(ext_rows, None)
+    for prefix, mrt_row in mrt_rows:
+        # Skip extrapolated prefixes missing from the control set
+        while ext is not None and ext[0] < prefix:
+            ext = next(ext_rows, None)
+        if ext is not None and ext[0] == prefix:
+            yield prefix, mrt_row, ext[1]
+        else:
+            yield prefix, mrt_row, None
@@ -0,0 +1,62 @@
+import contextlib
+import io
+
+import relationships
+from verifier import Verifier
+
+# Counters compared between the engines
+COUNTERS = ("k", "l", "seed_f", "prop_f", "missing_f", "pref_f", "orig_f", "compare_f",
+            "mrt_avg_len", "ext_avg_len", "levenshtein_avg")
+
+
+def run(sets, batch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        v = Verifier(1, 0, "test", batch = batch)
+    rels = relationships.RelationshipIndex.from_pairs([(100, 101)], [(200, 201)])
+    if batch:
+        v.compare_batch(*sets, rels)
+    else:
+        v.compare(*sets, rels)
+    return v
+
+
+def test_long_paths_clip_in_both_engines():
+    long_path = list(range(100, 114))
+    diverging = long_path[:2] + [999] + long_path[3:]
+    mrt_set = {"10.0.0.0/24": (long_path, 113),
+               "10.0.1.0/24": (long_path, 113),
+               "10.0.2.0/24": (long_path[:11], 110)}
+    ext_set = {"10.0.0.0/24": (list(long_path), 113, 0),
+               "10.0.1.0/24": (diverging, 113, 20),
+               "10.0.2.0/24": (long_path[:10] + [5], 110, 0)}
+    scalar = run((mrt_set, ext_set), False)
+    batch = run((mrt_set, ext_set), True)
+    for name in COUNTERS:
+        assert getattr(scalar, name) == getattr(batch, name), name
+    # Matches past the tenth hop are not counted
+    assert scalar.k == [2] * 10
+    # The mismatch at hop 11 from the origin is past the counters, only the
+    # one at the origin is counted
+    assert scalar.l == [1] + [0] * 9
+    assert scalar.seed_f == [1] + [0] * 9 and scalar.prop_f == [0] * 10
+    # Absent relationships are counted for every mismatch
+    assert scalar.missing_f == 2
+
+
+def test_no_prefix_reaches_path_comparison():
+    mrt_set = {"10.0.0.0/8": ([5, 1], 1), "10.1.0.0/16": ([6, 2], 2)}
+    for ext_set in ({}, {"10.1.0.0/16": ([6, 2], 3, 0)}):
+        scalar = run((mrt_set, ext_set), False)
+        batch = run((mrt_set, ext_set), True)
+        for name in COUNTERS:
+            assert getattr(scalar, name) == getattr(batch, name), name
+        assert batch.l[0] == 2 and batch.levenshtein_avg == 2.0
+
+
+def test_empty_paths_on_one_side():
+    mrt_set = {"10.0.0.0/8": ([5, 1], 1), "10.1.0.0/16": ([6, 1], 1)}
+    ext_set = {"10.0.0.0/8": ([], 1, 0), "10.1.0.0/16": ([], 1, 0)}
+    scalar = run((mrt_set, ext_set), False)
+    batch = run((mrt_set, ext_set), True)
+    for name in COUNTERS:
+        assert getattr(scalar, name) == getattr(batch, name), name
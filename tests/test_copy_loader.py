@@ -0,0 +1,99 @@
+import struct
+
+import numpy as np
+import pytest
+
+import copy_loader
+import standin
+from standin import CIDR, INT8, INT8_ARRAY
+
+TYPES = (CIDR, INT8, INT8_ARRAY)
+
+
+def reference(buf, ncols):
+    """Returns the field offsets and lengths of a stream, walked one tuple at a time."""
+    pos = copy_loader.data_start(buf)
+    offsets, lengths = [], []
+    while struct.unpack_from(">h", buf, pos)[0] != -1:
+        pos += 2
+        row_offsets, row_lengths = [], []
+        for _ in range(ncols):
+            length = struct.unpack_from(">i", buf, pos)[0]
+            row_offsets.append(pos + 4)
+            row_lengths.append(length)
+            pos += 4 + max(length, 0)
+        offsets.append(row_offsets)
+        lengths.append(row_lengths)
+    return (np.array(offsets, dtype=np.int64).reshape(-1, ncols),
+            np.array(lengths, dtype=np.int64).reshape(-1, ncols))
+
+
+def stream(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        # ASN 3 encodes as 00 03, the column count, so paths of it look like tuple starts
+        path = rng.choice([3, 3, 3, 0x30003, 64512], size=rng.integers(0, 6)).tolist()
+        prefix = "10.%d.%d.0/24" % (i >> 8 & 255, i & 255) if i % 3 else "2001:db8:%x::/48" % i
+        rows.append((prefix, None if i % 7 == 0 else 3, None if i % 11 == 0 else path))
+    return standin.encode_copy(TYPES, rows), rows
+
+
+def assert_scanned(buf):
+    expected = reference(buf, 3)
+    offsets, lengths = copy_loader.scan(buf, 3)
+    assert np.array_equal(offsets, expected[0])
+    assert np.array_equal(lengths, expected[1])
+
+
+def test_scan_matches_tuple_walk():
+    buf, rows = stream(500)
+    assert_scanned(buf)
+    offsets, lengths = copy_loader.scan(buf, 3)
+    assert len(offsets) == len(rows)
+    assert lengths[:, 1].tolist() == [-1 if row[1] is None else 8 for row in rows]
+    indptr, values = copy_loader.int_array_column(buf, offsets[:, 2], lengths[:, 2])
+    assert [values[indptr[i]:indptr[i + 1]].tolist() for i in range(len(rows))] == \
+        [row[2] or [] for row in rows]
+
+
+def test_small_frames_and_doubling(monkeypatch):
+    buf, _ = stream(300, seed=1)
+    for frame_bytes in (7, 64, 1000):
+        monkeypatch.setattr(copy_loader, "FRAME_BYTES", frame_bytes)
+        assert_scanned(buf)
+    # Without pruning passes the tuple chain is always followed by doubling
+    monkeypatch.setattr(copy_loader, "PRUNE_PASSES", 0)
+    for frame_bytes in (64, 1 << 20):
+        monkeypatch.setattr(copy_loader, "FRAME_BYTES", frame_bytes)
+        assert_scanned(buf)
+
+
+def test_chunks_split_the_scan(monkeypatch):
+    buf, _ = stream(250, seed=2)
+    offsets, lengths = copy_loader.scan(buf, 3)
+    monkeypatch.setattr(copy_loader, "FRAME_BYTES", 512)
+    for max_rows in (1, 7, 100, 250, 1000):
+        chunks = list(copy_loader.scan_chunks(buf, 3, max_rows))
+        assert [len(o) for o, _ in chunks[:-1]] == [max_rows] * (len(chunks) - 1)
+        assert 0 < len(chunks[-1][0]) <= max_rows
+        assert np.array_equal(np.concatenate([o for o, _ in chunks]), offsets)
+        assert np.array_equal(np.concatenate([l for _, l in chunks]), lengths)
+
+
+def test_empty_stream():
+    buf = standin.encode_copy(TYPES, [])
+    offsets, lengths = copy_loader.scan(buf, 3)
+    assert offsets.shape == lengths.shape == (0, 3)
+    assert list(copy_loader.scan_chunks(buf, 3, 10)) == []
+
+
+def test_malformed_streams():
+    buf, _ = stream(20)
+    with pytest.raises(ValueError):
+        copy_loader.scan(b"COPY" + buf[4:], 3)
+    with pytest.raises(ValueError, match="Expected 4 columns"):
+        copy_loader.scan(buf, 4)
+    # Cut inside the last tuple
+    with pytest.raises(ValueError):
+        copy_loader.scan(buf[:-8] + buf[-2:], 3)
@@ -0,0 +1,66 @@
+import contextlib
+import io
+
+import db
+import relationships
+import results
+import standin
+from verifier import Verifier
+
+# Counters compared between the incremental and batch engines
+COUNTERS = ("prefixes", "k", "l", "seed_f", "prop_f", "missing_f", "pref_f", "orig_f", "compare_f",
+            "mrt_avg_len", "mrt_max_len", "ext_avg_len", "ext_max_len", "levenshtein_avg")
+
+
+def run(dataset, **kwargs):
+    db.set_connector(standin.connector(dataset))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with db.connection() as conn:
+                relationships.set_shared_index(relationships.RelationshipIndex.from_db(conn))
+            v = Verifier(dataset.collectors[0], 0, dataset.trial, **kwargs)
+            v.run()
+    finally:
+        db.set_connector(None)
+        relationships.set_shared_index(None)
+    return v
+
+
+def assert_same(a, b):
+    for name in COUNTERS:
+        assert getattr(a, name) == getattr(b, name), name
+
+
+def test_rerun_after_changes_matches_batch(tmp_path):
+    dataset = standin.Dataset(standin.DEFAULT_SCALE._replace(prefixes=300, collectors=1))
+    assert_same(run(dataset, store_dir=str(tmp_path)), run(dataset, batch=True))
+
+    table = "verify_data_%d_%s" % (dataset.collectors[0], dataset.trial)
+    rows = dataset.tables[table]
+    # A changed path, a changed origin and a prefix no longer extrapolated
+    prefix, origin, path, inf = rows[0]
+    rows[0] = (prefix, origin, [7] + path, inf)
+    prefix, origin, path, inf = rows[1]
+    rows[1] = (prefix, origin + 1, path, inf)
+    dropped = rows[2][0]
+    dataset.tables[table] = [row for row in rows if row[0] != dropped]
+
+    assert_same(run(dataset, store_dir=str(tmp_path)), run(dataset, batch=True))
+
+
+def test_rerun_of_only_missing_prefixes(tmp_path):
+    dataset = standin.Dataset(standin.DEFAULT_SCALE._replace(prefixes=100, collectors=1))
+    run(dataset, store_dir=str(tmp_path))
+    table = "verify_data_%d_%s" % (dataset.collectors[0], dataset.trial)
+    dropped = {row[0] for row in dataset.tables[table][:3]}
+    dataset.tables[table] = [row for row in dataset.tables[table] if row[0] not in dropped]
+    assert_same(run(dataset, store_dir=str(tmp_path)), run(dataset, batch=True))
+
+
+def test_diagnostics_are_marked_not_computed(tmp_path):
+    dataset = standin.Dataset(standin.DEFAULT_SCALE._replace(prefixes=100, collectors=1))
+    skipped = results.from_verifier(run(dataset, store_dir=str(tmp_path)))
+    counted = results.from_verifier(run(dataset, batch=True))
+    for name in results.DIAGNOSTICS:
+        assert (skipped[name] == results.NOT_COMPUTED).all(), name
+        assert (counted[name] >= 0).all(), name
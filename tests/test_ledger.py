@@ -0,0 +1,63 @@
+import pytest
+
+from ledger import LEDGER_NAME, Ledger
+
+
+def write(ledger, asn, mode, text = "x"):
+    base = ledger.shard(asn, mode)
+    for ext in (".csv", ".npz"):
+        with open(base + ext, "w") as f:
+            f.write(text + ext)
+
+
+def test_resume_skips_recorded_jobs(tmp_path):
+    ledger = Ledger(str(tmp_path))
+    for mode in (0, 1):
+        write(ledger, 10, mode)
+        ledger.record(10, mode, "t")
+    write(ledger, 20, 0)
+    ledger.record(20, 0, "t")
+
+    resumed = Ledger(str(tmp_path))
+    assert resumed.pending(10, (0, 1, 2), "t") == (2,)
+    assert resumed.pending(20, (0, 1, 2), "t") == (1, 2)
+    # Jobs of another trial are not done
+    assert resumed.pending(10, (0, 1, 2), "u") == (0, 1, 2)
+
+
+def test_changed_or_missing_shards_run_again(tmp_path):
+    ledger = Ledger(str(tmp_path))
+    for mode in (0, 1):
+        write(ledger, 10, mode)
+        ledger.record(10, mode, "t")
+    write(ledger, 10, 0, "changed")
+    (tmp_path / "origin_verified.10.npz").unlink()
+    assert Ledger(str(tmp_path)).pending(10, (0, 1), "t") == (0, 1)
+
+
+def test_record_cut_short_is_dropped(tmp_path):
+    ledger = Ledger(str(tmp_path))
+    for asn in (10, 20):
+        write(ledger, asn, 0)
+        ledger.record(asn, 0, "t")
+    fn = tmp_path / LEDGER_NAME
+    text = fn.read_text()
+    fn.write_text(text[:-10])
+
+    resumed = Ledger(str(tmp_path))
+    assert resumed.pending(10, (0,), "t") == ()
+    assert resumed.pending(20, (0,), "t") == (0,)
+    assert fn.read_text() == text[:text.index("\n") + 1]
+    # Records appended after the truncation are read back
+    resumed.record(20, 0, "t")
+    assert Ledger(str(tmp_path)).pending(20, (0,), "t") == ()
+
+
+def test_rollback_and_incomplete_shards(tmp_path):
+    ledger = Ledger(str(tmp_path))
+    (tmp_path / "full_verified.10.csv.tmp123").write_text("partial")
+    write(ledger, 20, 0)
+    assert ledger.rollback() == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["full_verified.20.csv", "full_verified.20.npz"]
+    with pytest.raises(FileNotFoundError):
+        ledger.record(10, 0, "t")
@@ -0,0 +1,26 @@
+import numpy as np
+
+import prefix_table
+
+
+def test_interned_arrays_match_text_ids():
+    prefixes = ["10.0.0.0/24", "2001:db8::/32", "10.0.0.0/16", "::ffff:10.0.0.0/120",
+                "10.0.0.0/24", "192.0.2.0/24", "2001:db8::/32"]
+    source = prefix_table.PrefixTable()
+    rows = source.intern_many(prefixes)
+    hi, lo, length, v6 = (column[rows] for column in source.arrays())
+    table = prefix_table.PrefixTable()
+    known = table.intern_many(["192.0.2.0/24", "2001:db8::/32"])
+    ids = table.intern_arrays(hi, lo, length, v6)
+    # Known prefixes keep their ids, new ones are numbered by first row
+    assert ids.tolist() == [2, known[1], 3, 4, 2, known[0], known[1]]
+    assert [table.key(pid) for pid in ids.tolist()] == [prefix_table.pack(prefix) for prefix in prefixes]
+    assert [table.get(prefix) for prefix in prefixes] == ids.tolist()
+    assert table.intern_arrays(hi, lo, length, v6).tolist() == ids.tolist()
+    assert len(table) == 5
+
+
+def test_empty_arrays():
+    table = prefix_table.PrefixTable()
+    ids = table.intern_arrays(*(column[:0] for column in table.arrays()))
+    assert ids.dtype == np.int64 and len(ids) == 0 and len(table) == 0
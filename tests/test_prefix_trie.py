@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import prefix_table
+import prefix_trie
+from prefix_trie import ABSENT, LESS_SPECIFIC, MORE_SPECIFIC
+
+
+def classify(stored, queries):
+    """Returns the kind of each query against the stored prefixes."""
+    table = prefix_table.PrefixTable()
+    stored_ids = table.intern_many(stored)
+    return [int(np.argmax(prefix_trie.classify_ids(table, table.intern_many([q]), stored_ids)))
+            for q in queries]
+
+
+def test_families_are_kept_apart():
+    stored = ["10.0.0.0/8", "10.1.0.0/16", "2001:db8::/32"]
+    assert classify(stored, ["::/0", "::ffff:10.0.0.0/104", "10.2.0.0/16", "8.0.0.0/6",
+                             "2001:db8:1::/48", "2001::/16", "192.0.2.0/24"]) == \
+        [MORE_SPECIFIC, ABSENT, LESS_SPECIFIC, MORE_SPECIFIC, LESS_SPECIFIC, MORE_SPECIFIC, ABSENT]
+    # A default route of one family does not cover the other
+    assert classify(["::/0"], ["10.0.0.0/24", "2001:db8::/32"]) == [ABSENT, LESS_SPECIFIC]
+    assert classify(["0.0.0.0/0"], ["::/0", "::ffff:0:0/96", "10.0.0.0/24"]) == \
+        [ABSENT, ABSENT, LESS_SPECIFIC]
+
+
+def test_mapped_addresses_have_their_own_ids():
+    table = prefix_table.PrefixTable()
+    ids = table.intern_many(["10.0.0.0/24", "::ffff:10.0.0.0/120", "10.0.0.0/24"])
+    assert ids.tolist() == [0, 1, 0]
+    assert [prefix_table.unpack(table.key(pid)) for pid in (0, 1)] == ["10.0.0.0/24", "::ffff:a00:0/120"]
+
+
+def test_trie_of_both_families_is_rejected():
+    table = prefix_table.PrefixTable()
+    ids = table.intern_many(["10.0.0.0/8", "2001:db8::/32"])
+    with pytest.raises(ValueError):
+        prefix_trie.PrefixTrie.from_table(table, ids)
@@ -0,0 +1,50 @@
+import numpy as np
+
+import batch_compare
+import relationships
+from relationships import CUSTOMER, NO_REL, PEER, PROVIDER
+
+# 10 is the provider of 20 and 30, 20 of 40, and 20 and 30 peer
+INDEX = relationships.RelationshipIndex.from_pairs([(30, 20)], [(10, 20), (10, 30), (20, 40)])
+
+
+def check(paths):
+    """Returns check_paths of paths given origin first."""
+    matrix, lengths = batch_compare.pack_paths(paths)
+    return INDEX.graph().check_paths(matrix, lengths)
+
+
+def test_edge_types():
+    graph = INDEX.graph()
+    assert graph.edge_types([10, 20, 20, 30, 40, 10, 99], [20, 10, 30, 20, 10, 99, 10]).tolist() == \
+        [CUSTOMER, PROVIDER, PEER, PEER, NO_REL, NO_REL, NO_REL]
+
+
+def test_pair_listed_twice_keeps_provider_customer():
+    index = relationships.RelationshipIndex.from_pairs([(1, 2)], [(1, 2)])
+    assert index.graph().edge_types([1, 2], [2, 1]).tolist() == [CUSTOMER, PROVIDER]
+
+
+def test_hop_relations_and_valleys():
+    hop_rels, missing, valley = check([[40, 20, 10, 30],   # up, up, down
+                                       [40, 20, 30],       # up, across
+                                       [30, 20, 10],       # across, then up
+                                       [10, 30, 20]])      # down, then across
+    assert hop_rels.tolist() == [[CUSTOMER, CUSTOMER, PROVIDER],
+                                 [CUSTOMER, PEER, NO_REL],
+                                 [PEER, CUSTOMER, NO_REL],
+                                 [PROVIDER, PEER, NO_REL]]
+    assert not missing.any()
+    assert valley.tolist() == [False, False, True, True]
+
+
+def test_missing_and_prepended_hops():
+    hop_rels, missing, valley = check([[40, 99, 20], [40, 40, 20, 20, 10], [20]])
+    assert missing.tolist() == [[True, True, False, False],
+                                [False, False, False, False],
+                                [False, False, False, False]]
+    # Repeated ASNs are not hops
+    assert hop_rels[1].tolist() == [NO_REL, CUSTOMER, NO_REL, CUSTOMER]
+    assert not valley.any()
+    # Missing hops agree with the index lookups
+    assert not INDEX.has_rel(40, 99) and not INDEX.has_rel(99, 20)
@@ -0,0 +1,114 @@
+import types
+
+import numpy as np
+import pytest
+
+import results
+import sketch
+
+
+def columns(asn, distances):
+    """Returns the one row results of a collector with the given edit distances."""
+    v = types.SimpleNamespace(**{name: asn for name, _ in results.SCALARS})
+    for i, name in enumerate(results.VECTORS):
+        setattr(v, name, [asn, i])
+    v.levenshtein_d = sketch.Histogram()
+    v.levenshtein_d.add_many(distances)
+    return results.from_verifier(v)
+
+
+def write(shard_dir, asn, mode, distances):
+    base = results.shard_name(str(shard_dir), asn, results.MODE_FILES[mode])
+    results.write_shard(base, "%d,row\n" % asn, columns(asn, distances))
+
+
+def test_merge_follows_collector_order(tmp_path):
+    shards = tmp_path / "shards"
+    # Written out of order, as workers finish
+    write(shards, 30, 0, [0, 5])
+    write(shards, 10, 0, [1])
+    write(shards, 20, 0, [])
+    out = tmp_path / "trial"
+    assert results.merge_shards(str(shards), [10, 20, 30], (0,), str(out)) == []
+
+    with open(out / "full_verified.csv") as f:
+        assert f.read() == results.CSV_HEADER + "10,row\n20,row\n30,row\n"
+    merged = results.load(str(out / "full_verified.npz"))
+    assert merged["ctrl_AS"].tolist() == [10, 20, 30]
+    assert merged["k"].tolist() == [[10, 0], [20, 0], [30, 0]]
+    # Histograms are padded to the widest collector
+    assert merged[results.HISTOGRAM].tolist() == [[0, 1, 0, 0, 0, 0], [0] * 6, [1, 0, 0, 0, 0, 1]]
+
+
+def test_merge_skips_missing_shards_and_replaces_output(tmp_path):
+    shards = tmp_path / "shards"
+    write(shards, 10, 0, [2])
+    write(shards, 30, 0, [3])
+    write(shards, 30, 1, [3])
+    out = tmp_path / "trial"
+    assert results.merge_shards(str(shards), [10, 20, 30], (0, 1), str(out)) == [(20, 0), (10, 1), (20, 1)]
+    assert results.load(str(out / "full_verified.npz"))["ctrl_AS"].tolist() == [10, 30]
+    assert results.load(str(out / "origin_verified.npz"))["ctrl_AS"].tolist() == [30]
+
+    # Merging again after a resume gives each collector once
+    write(shards, 20, 0, [1])
+    results.merge_shards(str(shards), [10, 20, 30], (0,), str(out))
+    with open(out / "full_verified.csv") as f:
+        assert f.read() == results.CSV_HEADER + "10,row\n20,row\n30,row\n"
+    assert results.load(str(out / "full_verified.npz"))["ctrl_AS"].tolist() == [10, 20, 30]
+
+
+def test_modes_without_shards_are_written_empty(tmp_path):
+    out = tmp_path / "trial"
+    assert results.merge_shards(str(tmp_path / "none"), [10], (2,), str(out)) == [(10, 2)]
+    with open(out / "no_prop_verified.csv") as f:
+        assert f.read() == results.CSV_HEADER
+    assert not (out / "no_prop_verified.npz").exists()
+    assert [p.name for p in out.iterdir()] == ["no_prop_verified.csv"]
+
+
+def test_save_load_round_trip(tmp_path):
+    fn = str(tmp_path / "r.npz")
+    written = results.concat([columns(10, [0, 2]), columns(20, [1, 1, 4])])
+    results.save(fn, written)
+    read = results.load(fn)
+    assert list(read) == list(results.FIELDS)
+    for name, dtype in results.SCALARS:
+        assert read[name].dtype == dtype
+    for name in results.FIELDS:
+        assert np.array_equal(read[name], written[name]), name
+    # Appending keeps the rows in order
+    results.append(fn, columns(30, [7]))
+    assert results.load(fn)["ctrl_AS"].tolist() == [10, 20, 30]
+    assert results.load(fn)[results.HISTOGRAM].shape == (3, 8)
+
+
+def test_load_rejects_other_versions_and_missing_fields(tmp_path):
+    row = columns(10, [1])
+    old = str(tmp_path / "old.npz")
+    np.savez(old, version=np.array(results.FORMAT_VERSION - 1), **row)
+    with pytest.raises(results.FormatError, match="version %d" % (results.FORMAT_VERSION - 1)):
+        results.load(old)
+    unversioned = str(tmp_path / "unversioned.npz")
+    np.savez(unversioned, **row)
+    with pytest.raises(results.FormatError, match="version None"):
+        results.load(unversioned)
+    partial = str(tmp_path / "partial.npz")
+    np.savez(partial, version=np.array(results.FORMAT_VERSION),
+             **{name: a for name, a in row.items() if name != "mrt_rel_f"})
+    with pytest.raises(results.FormatError, match="missing fields mrt_rel_f"):
+        results.load(partial)
+
+
+def test_csv_header(tmp_path):
+    fn = str(tmp_path / "r.csv")
+    results.append_text(fn, "10,row\n")
+    results.append_text(fn, "20,row\n")
+    with open(fn) as f:
+        lines = f.read().splitlines()
+    assert lines == ["version,%d" % results.CSV_VERSION, "10,row", "20,row"]
+    results.check_csv_header(fn, lines[0].split(","))
+    with pytest.raises(results.FormatError):
+        results.check_csv_header(fn, ["10", "row"])
+    with pytest.raises(results.FormatError):
+        results.check_csv_header(fn, [])
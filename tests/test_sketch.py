@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import sketch
+
+
+def test_merge_matches_adding_every_value():
+    rng = np.random.default_rng(3)
+    parts = [rng.integers(0, 40, n) for n in (0, 1, 7, 250)]
+    merged = sketch.Histogram()
+    for values in parts:
+        part = sketch.Histogram()
+        for value in values.tolist():
+            part.add(value)
+        merged.merge(part)
+    every = np.concatenate(parts)
+    added = sketch.Histogram()
+    added.add_many(every)
+
+    assert merged == added
+    assert merged.trimmed() == np.bincount(every).tolist()
+    assert len(merged) == len(every)
+    assert merged.mean == pytest.approx(every.mean())
+    assert merged.variance() == pytest.approx(every.var(ddof=1))
+    assert added.variance() == pytest.approx(every.var(ddof=1))
+
+
+def test_merge_with_empty_and_wider_histograms():
+    a = sketch.Histogram([0, 2])
+    b = sketch.Histogram()
+    b.add(20)
+    assert a.merge(sketch.Histogram()) is a
+    assert (len(a), a.mean, a.variance()) == (2, 1.0, 0.0)
+    a.merge(b)
+    assert a.trimmed() == [0, 2] + [0] * 18 + [1]
+    assert a.mean == pytest.approx(22 / 3)
+    assert a.variance() == pytest.approx(np.var([1, 1, 20], ddof=1))
+    # The merged histogram is left unchanged
+    assert b.trimmed() == [0] * 20 + [1] and len(b) == 1
+    empty = sketch.Histogram()
+    assert empty.merge(sketch.Histogram()).trimmed() == [0] and empty.variance() == 0.0
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module defines the TracebackIndex class.
+
+Extrapolator results that only store the AS each announcement was received
+from are indexed by integer keys, so AS paths can be rebuilt by following the
+received from pointers back to the origin.
+
+DiskTracebackIndex keeps the same sorted arrays in memory mapped files, built
+by an external sort, for tables larger than memory.
+"""
+
+__version__ = '0.1'
+__author__ = 'James Breslin'
+
+import os
+import mmap
+import shutil
+import tempfile
+
+import numpy as np
+
+import copy_loader
+
+# Paths longer than this are treated as loops
+MAX_HOPS = 64
+
+# Default memory budget of a disk backed index build, in bytes
+MEMORY_BUDGET = 1 << 30
+
+# Rough peak memory per row while scanning and sorting a run, in bytes
+ROW_BYTES = 256
+
+# On disk record of a sorted run
+RECORD = np.dtype([("key", "<u8"), ("origin", "<u4"), ("recv", "<u4")])
+
+
+def pack_key(pid, asn):
+    """Packs an interned prefix id and an ASN into a 64-bit integer."""
+    return (np.asarray(pid, dtype=np.uint64) << np.uint64(32)) | np.asarray(asn, dtype=np.uint64)
+
+
+class TracebackIndex:
+    """This class maps (prefix, ASN, origin) to the ASN it was received from."""
+
+    def __init__(self, pids, asns, origins, recv, prefixes):
+        """Parameters:
+        pids  Array of interned prefix ids, one per announcement
+        asns  Array of ASNs holding each announcement
+        origins  Array of origin ASNs
+        recv  Array of received from ASNs
+        prefixes  List of prefix strings indexed by prefix id
+        """
+        keys = pack_key(pids, asns)
+        origins = np.asarray(origins, dtype=np.uint32)
+        # Sort by (prefix, ASN) then origin
+        order = np.lexsort((origins, keys))
+        self.keys = keys[order]
+        self.origins = origins[order]
+        self.recv = np.asarray(recv, dtype=np.uint32)[order]
+        self.prefixes = prefixes
+        self.pids = {prefix: pid for pid, prefix in enumerate(prefixes)}
+
+    @classmethod
+    def load(cls, conn, sql):
+        """Loads (asn, prefix, origin, received from) rows with binary COPY.
+        Parameters:
+        conn  A psycopg2 connection
+        sql  The query, see queries.tb_anns
+        """
+        buf = copy_loader.copy_binary(conn, sql)
+        offsets, lengths = copy_loader.scan(buf, 4)
+        pids, prefixes = copy_loader.cidr_column(buf, offsets[:, 1], lengths[:, 1])
+        asns = copy_loader.int_column(buf, offsets[:, 0], lengths[:, 0])
+        origins = copy_loader.int_column(buf, offsets[:, 2], lengths[:, 2])
+        recv = copy_loader.int_column(buf, offsets[:, 3], lengths[:, 3])
+        return cls(pids, asns, origins, recv, prefixes)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        """Releases the index, a no-op for in memory indexes."""
+
+    def lookup_many(self, pids, asns, origins):
+        """Batched lookup, see lookup.
+        Parameters:
+        pids, asns, origins  Equal length integer arrays
+
+        Returns:
+        recv  An int64 array of received from ASNs, -1 where missing.
+        """
+        keys = pack_key(pids, asns)
+        origins = np.asarray(origins, dtype=np.int64)
+        recv = np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.keys, keys)
+        todo = np.arange(len(keys))
+        # Step through the adjacent origins of each key until one matches
+        while len(todo):
+            todo = todo[pos[todo] < len(self.keys)]
+            todo = todo[self.keys[pos[todo]] == keys[todo]]
+            hit = self.origins[pos[todo]] == origins[todo]
+            recv[todo[hit]] = self.recv[pos[todo[hit]]]
+            todo = todo[~hit]
+            pos[todo] += 1
+        return recv
+
+    def origin_many(self, pids, asns):
+        """Batched origin_of, returns an int64 array with -1 where missing."""
+        keys = pack_key(pids, asns)
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        origins = np.full(len(keys), -1, dtype=np.int64)
+        origins[found] = self.origins[pos[found]]
+        return origins
+
+    def trace_many(self, pids, asns, origins):
+        """Traces many prefixes, returns a list of paths or None, see trace."""
+        return [self.trace(pid, asn, origin) for pid, asn, origin
+                in zip(np.asarray(pids).tolist(), np.asarray(asns).tolist(),
+                       np.asarray(origins).tolist())]
+
+    def origin_of(self, pid, asn):
+        """Returns the first origin announced to asn for a prefix, or None."""
+        key = np.uint64((pid << 32) | asn)
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.origins[i])
+        return None
+
+    def lookup(self, pid, asn, origin):
+        """Returns the ASN asn received the prefix/origin from, or None."""
+        key = np.uint64((pid << 32) | asn)
+        lo = int(np.searchsorted(self.keys, key))
+        # Multiple origins of one prefix are adjacent
+        while lo < len(self.keys) and self.keys[lo] == key:
+            if self.origins[lo] == origin:
+                return int(self.recv[lo])
+            lo += 1
+        return None
+
+    def trace(self, pid, asn, origin):
+        """Rebuilds the AS path from asn back to the origin.
+        Parameters:
+        pid  Interned prefix id
+        asn  32-bit integer ASN to start from
+        origin  32-bit integer ASN of the prefix origin
+
+        Returns:
+        path  A tuple of ASNs from asn to origin, or None if a hop is missing or loops.
+        """
+        path = [asn]
+        seen = {asn}
+        cur = asn
+        while cur != origin:
+            recv = self.lookup(pid, cur, origin)
+            if recv is None or recv in seen or len(path) > MAX_HOPS:
+                return None
+            path.append(recv)
+            seen.add(recv)
+            cur = recv
+        return tuple(path)
+
+
+class DiskTracebackIndex(TracebackIndex):
+    """This class keeps the sorted traceback arrays in memory mapped files.
+
+    Rows are copied to a spill file, sorted in runs that fit the memory budget
+    and block merged into one key, origin and received from file each. Lookups
+    are batched binary searches that only fault in the pages they touch.
+    """
+
+    FILES = ("keys", "origins", "recv")
+
+    def __init__(self, directory, owned = False):
+        """Parameters:
+        directory  Directory written by build
+        owned  If True, close removes the directory
+        """
+        self.directory = directory
+        self.owned = owned
+        self.keys = _map(os.path.join(directory, "keys"), np.uint64)
+        self.origins = _map(os.path.join(directory, "origins"), np.uint32)
+        self.recv = _map(os.path.join(directory, "recv"), np.uint32)
+        with open(os.path.join(directory, "prefixes")) as f:
+            self.prefixes = f.read().split()
+        self.pids = {prefix: pid for pid, prefix in enumerate(self.prefixes)}
+
+    @classmethod
+    def build(cls, conn, sql, directory = None, budget = MEMORY_BUDGET):
+        """Builds the index files with an external sort.
+        Parameters:
+        conn  A psycopg2 connection
+        sql  The query, see queries.tb_anns
+        directory  Directory for the index files, a temporary one if None
+        budget  Memory budget of the build in bytes
+
+        Returns:
+        index  A DiskTracebackIndex over the new files.
+        """
+        owned = directory is None
+        if owned:
+            directory = tempfile.mkdtemp(prefix="verify_tb_")
+        else:
+            os.makedirs(directory, exist_ok=True)
+        spill = os.path.join(directory, "copy")
+        with open(spill, "w+b") as f:
+            copy_loader.copy_binary(conn, sql, f)
+            f.flush()
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                runs, prefixes = _write_runs(buf, directory, max(budget // ROW_BYTES, 1))
+            finally:
+                buf.close()
+        os.remove(spill)
+        _merge_runs(runs, directory, budget)
+        for run in runs:
+            os.remove(run)
+        with open(os.path.join(directory, "prefixes"), "w") as f:
+            f.write("\n".join(prefixes))
+        return cls(directory, owned)
+
+    def close(self):
+        """Unmaps the index and removes its files if they are temporary."""
+        self.keys = self.origins = self.recv = None
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def trace_many(self, pids, asns, origins):
+        """Traces many prefixes hop by hop, with one batched lookup per hop.
+        Parameters:
+        pids, asns, origins  Equal length integer arrays
+
+        Returns:
+        paths  A list of tuples from asn to origin, or None if a hop is missing or loops.
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        cur = np.array(asns, dtype=np.int64)
+        pids = np.asarray(pids, dtype=np.int64)
+        hops = [cur.copy()]
+        failed = np.zeros(len(cur), dtype=bool)
+        active = cur != origins
+        for _ in range(MAX_HOPS):
+            rows = np.flatnonzero(active)
+            if not len(rows):
+                break
+            recv = self.lookup_many(pids[rows], cur[rows], origins[rows])
+            bad = recv < 0
+            for hop in hops:
+                bad |= hop[rows] == recv
+            failed[rows[bad]] = True
+            cur[rows] = recv
+            hop = np.full(len(cur), -1, dtype=np.int64)
+            hop[rows] = recv
+            hops.append(hop)
+            active[rows] = ~bad & (recv != origins[rows])
+        failed |= active
+        hops = np.stack(hops, axis=1)
+        lengths = np.count_nonzero(hops >= 0, axis=1).tolist()
+        return [None if bad else tuple(row[:n]) for row, n, bad
+                in zip(hops.tolist(), lengths, failed.tolist())]
+
+
+def _map(fn, dtype):
+    """Maps an index file read only, empty files can not be mapped."""
+    if os.path.getsize(fn) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fn, dtype=dtype, mode="r")
+
+
+def _write_runs(buf, directory, run_rows):
+    """Sorts (asn, prefix, origin, received from) rows into run files.
+
+    Returns:
+    runs  List of sorted run file names.
+    prefixes  List of prefix strings indexed by prefix id.
+    """
+    runs = []
+    seen = {}
+    prefixes = []
+    for offsets, lengths in copy_loader.scan_chunks(buf, 4, run_rows):
+        pids, prefixes = copy_loader.cidr_column(buf, offsets[:, 1], lengths[:, 1], seen, prefixes)
+        run = np.empty(len(pids), dtype=RECORD)
+        run["key"] = pack_key(pids, copy_loader.int_column(buf, offsets[:, 0], lengths[:, 0]))
+        run["origin"] = copy_loader.int_column(buf, offsets[:, 2], lengths[:, 2])
+        run["recv"] = copy_loader.int_column(buf, offsets[:, 3], lengths[:, 3])
+        run = run[np.lexsort((run["origin"], run["key"]))]
+        runs.append(os.path.join(directory, "run%d" % len(runs)))
+        run.tofile(runs[-1])
+    return runs, prefixes
+
+
+def _merge_runs(runs, directory, budget):
+    """Block merges sorted run files into the key, origin and received from files."""
+    sources = [_map(run, RECORD) for run in runs]
+    total = sum(len(src) for src in sources)
+    outs = []
+    for name, dtype in zip(DiskTracebackIndex.FILES, (np.uint64, np.uint32, np.uint32)):
+        fn = os.path.join(directory, name)
+        if total:
+            outs.append(np.memmap(fn, dtype=dtype, mode="w+", shape=(total,)))
+        else:
+            open(fn, "wb").close()
+    # Half the budget for the blocks read, half for the merged copy
+    block_rows = max(budget // (2 * 2 * RECORD.itemsize * max(len(sources), 1)), 1)
+    pos = [0] * len(sources)
+    out = 0
+    while out < total:
+        blocks = [(i, src[pos[i]:pos[i] + block_rows]) for i, src in enumerate(sources)
+                  if pos[i] < len(src)]
+        # Every record up to the smallest block end is in a loaded block
+        bound = min((int(block["key"][-1]), int(block["origin"][-1])) for _, block in blocks)
+        parts = []
+        for i, block in blocks:
+            take = int(np.count_nonzero((block["key"] < bound[0]) |
+                                        ((block["key"] == bound[0]) & (block["origin"] <= bound[1]))))
+            parts.append(block[:take])
+            pos[i] += take
+        merged = np.concatenate(parts)
+        merged = merged[np.lexsort((merged["origin"], merged["key"]))]
+        end = out + len(merged)
+        for arr, name in zip(outs, ("key", "origin", "recv")):
+            arr[out:end] = merged[name]
+        out = end
+    for arr in outs:
+        arr.flush()
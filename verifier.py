@@ -9,6 +9,7 @@ __version__ = '0.5'
 __author__ = 'James Breslin'
 
 import sys
+import io
 import psycopg2
 import psycopg2.extras
 import shutil
@@ -16,23 +17,62 @@ import os
 import gc
 import logging
 from os import path
-from configparser import ConfigParser
+from itertools import chain
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from profilehooks import profile
+import numpy as np
 
-CONFIG_LOC = r"/etc/bgp/bgp.conf"
+import db
+import edit_distance
+import batch_compare
+import relationships
+import stream
+import queries
+import copy_loader
+import trace_index
+import sketch
+import results
+import incremental
+import metrics
+import path_store
+import prefix_table
+import prefix_trie
+
+CONFIG_LOC = db.CONFIG_LOC
+
+# Rows converted per fetch stage, see get_mrt_anns
+FETCH_ROWS = 2000
 
 class Verifier:
     """This class performs verification for a single AS."""
     
-    def __init__(self, asn, origin_only, trial, trace_back = False):
+    def __init__(self, asn, origin_only, trial, trace_back = False, batch = False, stream = False,
+                 binary = False, tb_budget = None, store_dir = None, server = False,
+                 concurrent_load = False):
         """Parameters:
         asn  A string or int representation of 32 bit ASN.
         origin_only  A integer to select extrapolator data.
+        batch  If True, compare all prefixes with the vectorized kernels.
+        stream  If True, merge join both tables in prefix order with bounded memory.
+        binary  If True, load tables with binary COPY instead of cursor fetches.
+        tb_budget  If set, build the traceback index on disk within this many bytes.
+        store_dir  If set, keep per prefix outcomes here and only recompare changed prefixes.
+        server  If True, compare inside the database and fetch only aggregates and differing paths.
+        concurrent_load  If True, fetch the tables at the same time over separate pooled connections.
+
+        Stage timings are kept in self.metrics, see metrics.configure for the sink and hooks.
         """
         self.ctrl_AS = int(asn)
         self.oo = int(origin_only)
         self.tb = trace_back
+        self.tb_budget = tb_budget
+        self.store_dir = store_dir
+        self.batch = batch
+        self.stream = stream
+        self.binary = binary
+        self.server = server
+        self.concurrent_load = concurrent_load
         
         # Set dynamic SQL table names
         self.mrt_table =  r"verify_ctrl_" + str(asn) + "_" + str(trial)
@@ -48,6 +88,10 @@ class Verifier:
             print(datetime.now().strftime("%c") + ": Performing verification for AS" + str(asn))
             print(datetime.now().strftime("%c") + ": Setting MRT only verification.")
             self.ext_table = "verify_data_" + str(asn) + "_mo_" + str(trial)
+        # Prefixes of every data set this Verifier loads
+        self.prefix_table = prefix_table.PrefixTable()
+        self.metrics = metrics.Metrics({"asn": self.ctrl_AS, "mode": results.MODE_FILES[self.oo],
+                                        "table": self.ext_table})
 
         # Number of prefixes in MRT and number verifiable
         self.prefixes = 0
@@ -68,11 +112,12 @@ class Verifier:
         # Verified prefixes for AVG. calc 
         self.ver_count = 0
         # Records for Levenshtein compare
-        self.levenshtein_d = []
+        self.levenshtein_d = sketch.Histogram()
         self.levenshtein_avg = 0
         # Failure Classification
         self.pref_f = 0
-        self.pref_f_set = []
+        # Missing prefixes by what was extrapolated instead, see prefix_trie.KINDS
+        self.pref_cover_f = [0] * len(prefix_trie.KINDS)
         self.orig_f = 0
         self.traceback_f = 0
         self.compare_f = 0
@@ -80,198 +125,161 @@ class Verifier:
         self.missing_f = 0              # Rel missing from caida
         self.seed_f = [0] * 10          # Seeding failure
         self.prop_f = [0] * 10          # Propagation Failure
+        # Whole path checks, see check_paths
+        self.mrt_rel_f = [0] * 10       # MRT hops missing from caida
+        self.ext_rel_f = [0] * 10       # Extrapolated hops missing from caida
+        self.mrt_valley_f = 0           # MRT paths that are not valley free
+        self.ext_valley_f = 0           # Extrapolated paths that are not valley free
+        # Engines that do not hold every path call skip_diagnostics
 
 
     def connect_to_db(self):
         """Creates a connection to the SQL database.
+
+        Prefer db.connection(), which reuses pooled connections.
         
         Returns:
-        cur  A reference to the psycopg2 SQL named tuple cursor.
+        conn  A psycopg2 connection.
         """
-        # Get the config profile
-        cparser = ConfigParser()
-        cparser.read("/etc/bgp/bgp.conf")
-        # Establish DB connection
-        print(datetime.now().strftime("%c") + ": Connecting to database...")
+        return db.connect()
+
+    @contextmanager
+    def connection(self):
+        """Checks a connection out of the pool, timing the wait as the connect stage."""
+        pool = db.get_pool()
+        with self.metrics.stage("connect"):
+            conn = pool.getconn()
         try:
-            conn = psycopg2.connect(host = cparser['bgp']['host'],
-                                    database = cparser['bgp']['database'],
-                                    user = cparser['bgp']['user'],
-                                    password = cparser['bgp']['password'])
-            print(datetime.now().strftime("%c") + ": Login successful.")
-        except:
-            print(datetime.now().strftime("%c") + ": Login failed.")
-        return conn
-
-    def get_mrt_anns(self, cursor, AS):
-        """Creates a dictionary from the the set of prefix/origins as key-value pairs.
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+    def convert_rows(self, cursor, ann_set):
+        """Fetches the rows of an executed query into an AnnSet.
         Parameters:
-        AS  String of 32-bit integer ASN of target AS
+        cursor  A psycopg2 cursor the query was executed on
+        ann_set  path_store.AnnSet the rows are added to
 
         Returns:
-        prefix_dict  A dictionary of every prefix-origin pair passing through an AS according to the control set.
+        ann_set  The AnnSet, read as {prefix: (as_path, origin[, inference length])}
         """
-        parameters=(AS,)
-        sql_select = ("SELECT * FROM " + self.mrt_table)
-        # Execute the dynamic query
-        cursor.execute(sql_select, parameters)
-        announcements = cursor.fetchall()
-        mrt_dict = {}
-        
-        # For each announcemennt
-        for ann in announcements:
-            # If prefix not in the dictionary, add it
-            prefix = ann[1]
-            if prefix not in mrt_dict:
-                # Create AS path for current prefix
-                as_path = []
-                for asn in ann[3]:
-                    # Removes duplicate ASNs
-                    if asn not in as_path:
-                        as_path.append(int(asn))
-                mrt_dict[prefix]=(as_path, ann[2])
-        return mrt_dict
- 
-    def get_fp_anns(self, cursor):
+        while True:
+            with self.metrics.stage("fetch") as st:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                st.add(len(rows))
+            if not rows:
+                return ann_set
+            with self.metrics.stage("normalize", len(rows)):
+                ann_set.add_rows(rows)
+
+    def get_mrt_anns(self, cursor, AS, prefixes = None):
         """Creates a dictionary from the the set of prefix/origins as key-value pairs.
         Parameters:
         AS  String of 32-bit integer ASN of target AS
+        prefixes  Optional list of prefixes to restrict the query to
 
         Returns:
-        prefix_dict  A dictionary of every prefix-origin pair passing through an AS according to the control set.
-        """
-        sql_select = ("SELECT * FROM " + self.ext_table)
-        # Execute the dynamic query
-        cursor.execute(sql_select)
-        announcements = cursor.fetchall()
-        ext_dict = {}
-        
-        # For each announcemennt
-        for ann in announcements:
-            # If prefix not in the dictionary, add it
-            prefix = ann[1]
-            if prefix not in ext_dict:
-                # Create AS path for current prefix
-                # This does not handle loops 
-                as_path = []
-                for asn in ann[3]:
-                    # Removes duplicate ASNs
-                    if asn not in as_path:
-                        as_path.append(int(asn))
-                ext_dict[prefix]=(as_path, ann[2], ann[4])
-        return ext_dict
-       
-    def get_tb_anns(self, cursor):
-        """ Creates a dictionary for all announcements keyed to AS/prefix.
-       
-        Returns:
-        ann_set  A dictionary of AS-prefix : (origin, recv from AS) key-value pairs
-        """
-        sql_select = ("SELECT * FROM " + self.ext_table)
-        # Execute the dynamic query
-        cursor.execute(sql_select)
-        print(datetime.now().strftime("%c") + ": Cursor fetchall...")
-        anns = cursor.fetchall()
-        collected = gc.collect()
-        print(datetime.now().strftime("%c") + ": Fetch complete.")
-        anns_sz = len(anns)
-        # Returns DICT or None
-        ext_dict = {}
-        print(datetime.now().strftime("%c") + ": Creating Dictionary...")
-        if anns_sz != 0:
-            # Create dictionary of {current ASN + prefix + origin: received from ASN} pairs
-            for ann in anns:
-                key = str(ann[0]) + ann[1] + str(ann[2])
-                ext_dict[key] = (ann[3])
-            print(datetime.now().strftime("%c") + ": Dictionary construction complete.")
-            return ext_dict
-        else:
-            return None
-    
-    def get_ptp_rel(self, cursor):
-        """ Creates a dictionary for all peer-to-peer relationships.
-       
-        Returns:
-        ptp_set  A dictionary of {lower ASN: higher ASN} pairs.
+        mrt_set  An AnnSet of every prefix-origin pair passing through an AS according to the control set.
         """
-        sql_select = ("SELECT * FROM peers")
-        cursor.execute(sql_select)
-        relationships = cursor.fetchall()
-        ptp_dict = {}
-        for rel in relationships:
-            key = str(rel[0]) + str(rel[1])
-            ptp_dict[key] = None
-        return ptp_dict
-
-    def get_ptc_rel(self, cursor):
-        """ Creates a dictionary for all provider-to-customer relationships.
-       
+        # One deduplicated row per prefix is selected server side
+        with self.metrics.stage("fetch"):
+            cursor.execute(queries.mrt_anns(self.mrt_table, prefixes is not None), {"prefixes": prefixes})
+        return self.convert_rows(cursor, path_store.AnnSet(table = self.prefix_table))
+
+    def mrt_entry(self, ann):
+        """Converts a (prefix, origin, as_path) row to an (as_path, origin) pair."""
+        return (list(ann[2]), ann[1])
+ 
+    def get_fp_anns(self, cursor, prefixes = None):
+        """Creates a dictionary from the the set of prefix/origins as key-value pairs.
+        Parameters:
+        prefixes  Optional list of prefixes to restrict the query to
+
         Returns:
-        ptc_set  A dictionary of {provider ASN: customer ASN} pairs.
+        ext_set  An AnnSet of every extrapolated prefix-origin pair with its inference length.
         """
-        sql_select = ("SELECT * FROM customer_providers")
-        cursor.execute(sql_select)
-        relationships = cursor.fetchall()
-        ptc_dict = {}
-        for rel in relationships:
-            key = str(rel[0]) + str(rel[1])
-            ptc_dict[key] = None
-        return ptc_dict
-
-    def traceback(self, ext_dict, AS, prefix, origin, result_list):
-        """Generates a AS path as a list from the passed dictionary object.
-        Parameters:
-        ext_dict  Dictionary of current ASN, received from ASN pairs
-        AS  32-bit integer ASN of the current AS on path
-        origin  32-bit integer ASN of target prefix origin
+        # One deduplicated row per prefix is selected server side
+        with self.metrics.stage("fetch"):
+            cursor.execute(queries.ext_anns(self.ext_table, prefixes is not None), {"prefixes": prefixes})
+        return self.convert_rows(cursor, path_store.AnnSet(inference = True, table = self.prefix_table))
+
+    def ext_entry(self, ann):
+        """Converts a (prefix, origin, as_path, inference length) row to an (as_path, origin, inference length) triple."""
+        # This does not handle loops 
+        return (list(ann[2]), ann[1], ann[3])
+
+    def get_tb_anns(self, conn):
+        """ Creates an index for all announcements keyed to prefix/AS/origin.
        
         Returns:
-        result_list  A list of 32-bit int ASNs along the extrapolated AS path.  
+        index  A TracebackIndex of (prefix, AS, origin): recv from AS pairs
         """
-        cur_key = str(AS) + str(prefix) + str(origin)
-        if cur_key in ext_dict:
-            # Origin/received from AS pair
-            recv = ext_dict[cur_key]
-            
-            # End of path
-            if recv == origin:
-                result_list.append(int(origin))
-                return result_list
+        print(datetime.now().strftime("%c") + ": Creating traceback index...")
+        with self.metrics.stage("fetch") as st:
+            if self.tb_budget:
+                index = trace_index.DiskTracebackIndex.build(conn, queries.tb_anns(self.ext_table),
+                                                             budget = self.tb_budget)
             else:
-                result_list.append(int(recv))
-                return self.traceback(ext_dict, recv, prefix, origin, result_list)    
-        else:
-            # Some ASN on path is missing the prefix/origin
-            self.verifiable -= 1
-            print(datetime.now().strftime("%c") + ": Traceback Error: " + cur_key + " not in results.")
-            return None
+                index = trace_index.TracebackIndex.load(conn, queries.tb_anns(self.ext_table))
+            st.add(len(index))
+        print(datetime.now().strftime("%c") + ": Indexed " + str(len(index)) + " announcements.")
+        return index
     
-    def k_compare(self, mrt_path, prop_path):
-        """Simple K compare method, counting correct path hops up to the first mistake.
+    def load_traced(self, conn, mrt_set):
+        """Rebuilds the extrapolated data set from received from pointers.
         Parameters:
-        prop_path  Propagated path given by Extrapolation results
-        mrt_path  Correct path given by MRT announcement
-       
+        conn  A psycopg2 connection
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+
         Returns:
-        result_list  A list of correct and incorrect hops.  
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}, as_path
+                 is None if the traceback failed. Inference length is unknown and set to 0.
         """
-        # If propagted path is empty
-        if not prop_path:
-            self.l[0] += 1
-        
-        # Reverse index to start at end of lists
-        for i, (ext, mrt) in enumerate(zip(mrt_path, prop_path)):
-            if ext == mrt:
-                self.k[i] += 1
+        return self.traced(self.get_tb_anns(conn), mrt_set)
+
+    def traced(self, index, mrt_set):
+        """Traces the path of every MRT prefix through an index, see load_traced.
+
+        The index is closed once every path is traced.
+        """
+        with self.metrics.stage("normalize", len(mrt_set)):
+            if isinstance(mrt_set, path_store.AnnSet):
+                table, mrt_ids = mrt_set.table, mrt_set.prefix_ids()
             else:
-                self.l[i] += 1
-                break
+                table, mrt_ids = self.prefix_table, self.prefix_table.intern_many(list(mrt_set))
+            # Join the index prefixes to the MRT prefixes by id
+            known = table.lookup(index.prefixes)
+            index_pos = np.full(len(table), -1, dtype=np.int64)
+            index_pos[known[known >= 0]] = np.flatnonzero(known >= 0)
+            pids = index_pos[mrt_ids]
+            ids = mrt_ids[pids >= 0]
+            pids = pids[pids >= 0]
+            keys = ids if isinstance(mrt_set, path_store.AnnSet) else table.texts(ids)
+            mrt_origins = path_store.columns(mrt_set, keys).origins
+            asns = np.full(len(ids), self.ctrl_AS, dtype=np.int64)
+            # Prefer the MRT origin when the AS has several
+            has_mrt = (index.lookup_many(pids, asns, mrt_origins) >= 0) | (mrt_origins == self.ctrl_AS)
+            origins = np.where(has_mrt, mrt_origins, index.origin_many(pids, asns))
+            found = np.flatnonzero(origins >= 0)
+            paths = index.trace_many(pids[found], asns[found], origins[found])
+            index.close()
+            ext_set = path_store.AnnSet(inference = True, table = table)
+            failed = 0
+            for i, path in zip(found.tolist(), paths):
+                # Some ASN on path is missing the prefix/origin or loops
+                if path is None:
+                    failed += 1
+                ext_set.add(int(ids[i]), path, int(origins[i]), 0)
+        print(datetime.now().strftime("%c") + ": Traceback failed for " + str(failed) + " prefixes.")
+        return ext_set
 
-    def k_compare(self, mrt_path, prop_path, inf_l, ptp_dict, ptc_dict):
+    def k_compare(self, mrt_path, prop_path, inf_l, rels):
         """Simple K compare method, with failure classification.
         Parameters:
         prop_path  Propagated path given by Extrapolation results
         mrt_path  Correct path given by MRT announcement
+        inf_l  Inference length of the propagated path
+        rels  RelationshipIndex of CAIDA relationships
        
         Returns:
         result_list  A list of correct and incorrect hops.  
@@ -282,215 +290,594 @@ class Verifier:
         
         # Reverse index to start at end of lists
         for i, (ext, mrt) in enumerate(zip(mrt_path, prop_path)):
+            # Hops past the counters are not counted, as in batch_compare.k_counts
+            counted = i < len(self.k)
             if ext == mrt:
-                self.k[i] += 1
+                if counted:
+                    self.k[i] += 1
             else:
-                self.l[i] += 1
-                # Inference check
-                if len(prop_path)-i <= inf_l:
-                    self.prop_f[i] += 1
-                else:
-                    self.seed_f[i] += 1
+                if counted:
+                    self.l[i] += 1
+                    # Inference check
+                    if len(prop_path)-i <= inf_l:
+                        self.prop_f[i] += 1
+                    else:
+                        self.seed_f[i] += 1
                 # Absent relationship check
-                absent = True
-                low = min(ext, mrt)
-                high = max(ext, mrt)
-                ptp_key = str(low) + str(high)
-                ptc_key1 = str(ext) + str(mrt)
-                ptc_key2 = str(mrt) + str(ext)
-                if ptp_key in ptp_dict:
-                    absent = False
-                elif ptc_key1 in ptc_dict:
-                    absent = False
-                elif ptc_key2 in ptc_dict:
-                    absent = False
-                if absent == True:
+                if not rels.has_rel(ext, mrt):
                     self.missing_f += 1
                 break
 
-    def call_counter(func):
-        def wrapper(*args, **kwargs):
-            wrapper.calls += 1
-            return func(*args, **kwargs)
-        wrapper.calls = 0
-        wrapper.__name__ = func.__name__
-        return wrapper
-
-    def memoize(func):
-        mem = {}
-        def memoizer(*args, **kwargs):
-            key = str(args) + str(kwargs)
-            if key not in mem:
-                mem[key] = func(*args, **kwargs)
-            return mem[key]
-        return memoizer
-    
-    @memoize    
-    def levenshtein_opt(mrt_path, prop_path):
+    @staticmethod
+    def levenshtein_opt(mrt_path, prop_path, bound=None):
         """Levenshtein compare method, calculating edit distance between two paths.
         Parameters:
         mrt_path  Correct path given by MRT announcement
         prop_path  Propagated path given by Extrapolation results
+        bound  Optional upper bound, work stops once the distance exceeds it
        
         Returns:
         result  The edit distance between two paths. 
         """
-        prop_l = len(prop_path)
-        mrt_l = len(mrt_path)
-        # Check for empty strings
-        if not mrt_path:
-            return prop_l
-        if not prop_path:
-            return mrt_l
-        # If last element matchs
-        if mrt_path[-1] == prop_path[-1]:
-            cost = 0
-        else: # Operation required
-            cost = 1
-        
-        # If MRT is longer, need to add
-        if mrt_l > prop_l:
-            res = min([Verifier.levenshtein_opt(mrt_path[:-1], prop_path) + 1,
-                        Verifier.levenshtein_opt(mrt_path[:-1], prop_path[:-1]) + cost])
-        # If Prop is longer, need to subtract
-        elif prop_l > mrt_l:
-            res = min([Verifier.levenshtein_opt(mrt_path, prop_path[:-1]) + 1, 
-                   Verifier.levenshtein_opt(mrt_path[:-1], prop_path[:-1]) + cost])
-        # If equal length, only perform substitution
-        else:
-            res = min([Verifier.levenshtein_opt(mrt_path[:-1], prop_path[:-1]) + cost])
-
-        return res
+        return edit_distance.cached_distance(mrt_path, prop_path, bound)
 
     def run(self):
         # Connect to db
-        conn = self.connect_to_db();
-        
-        # Build the MRT control data set
+        with self.connection() as conn:
+            if self.store_dir and not self.tb:
+                rels = relationships.shared_index(conn)
+                self.verify_incremental(conn, rels, self.store_dir)
+                return
+            if self.stream and not self.tb:
+                rels = relationships.shared_index(conn)
+                self.verify_stream(conn, rels)
+                return
+            if self.server and not self.tb:
+                self.verify_server(conn)
+                return
+            if self.concurrent_load:
+                mrt_set, ext_set, rels = self.load_concurrent(conn)
+            else:
+                mrt_set, ext_set, rels = self.load(conn)
+        self.verify(mrt_set, ext_set, rels)
+
+    def load(self, conn):
+        """Loads the data sets needed for verification.
+        Parameters:
+        conn  A psycopg2 connection
+
+        Returns:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+        """
+        mrt_set = self.load_mrt(conn)
+        if self.tb:
+            ext_set = self.load_traced(conn, mrt_set)
+        else:
+            ext_set = self.load_ext(conn)
+        # Relationships are loaded once and shared by every Verifier
+        rels = relationships.shared_index(conn)
+
+        # Cleanup
+        gc.collect()
+        return mrt_set, ext_set, rels
+
+    def load_concurrent(self, conn):
+        """Loads the same data sets as load, fetching every table at the same time.
+
+        The control set is fetched on conn while the extrapolated set and the
+        relationships are fetched in threads over pooled connections of their
+        own, so decoding one table overlaps the transfer of the others.
+
+        Parameters:
+        conn  A psycopg2 connection
+
+        Returns:
+        mrt_set, ext_set, rels  See load.
+        """
+        with ThreadPoolExecutor(max_workers = 2) as pool:
+            if self.tb:
+                ext = pool.submit(self.pooled, self.get_tb_anns)
+            else:
+                ext = pool.submit(self.pooled, self.load_ext)
+            rels = pool.submit(self.pooled, relationships.shared_index)
+            mrt_set = self.load_mrt(conn)
+            ext_set = ext.result()
+            rels = rels.result()
+        if self.tb:
+            ext_set = self.traced(ext_set, mrt_set)
+
+        # Cleanup
+        gc.collect()
+        return mrt_set, ext_set, rels
+
+    def pooled(self, func):
+        """Calls func with a pooled connection of its own, for loader threads."""
+        with self.connection() as conn:
+            return func(conn)
+
+    def load_mrt(self, conn, prefixes = None):
+        """Loads the MRT control data set.
+        Parameters:
+        conn  A psycopg2 connection
+        prefixes  Optional list of prefixes to load, all if None
+
+        Returns:
+        mrt_set  An AnnSet read as {prefix: (as_path, origin)}
+        """
         print(datetime.now().strftime("%c") + ": Getting MRT announcements...")
-        
-        # Create the cursor
+        if self.binary:
+            sql = bind_prefixes(conn, queries.mrt_anns(self.mrt_table, prefixes is not None), prefixes)
+            return self.load_binary(conn, sql, False)
         cur = conn.cursor("ver_cursor")
-	# Dict = {prefix: (as_path, origin)}
-        mrt_set = self.get_mrt_anns(cur, self.ctrl_AS)
+        mrt_set = self.get_mrt_anns(cur, self.ctrl_AS, prefixes)
         cur.close()
-        
-        # Build the Ext data set for comparison
+        return mrt_set
+
+    def load_ext(self, conn, prefixes = None):
+        """Loads the extrapolated data set for comparison.
+        Parameters:
+        conn  A psycopg2 connection
+        prefixes  Optional list of prefixes to load, all if None
+
+        Returns:
+        ext_set  An AnnSet read as {prefix: (as_path, origin, inference length)}
+        """
         print(datetime.now().strftime("%c") + ": Getting extrapolated announcements...")
-        # Dict = {current ASN + prefix: (path, origin, inference length)}
-        cur = conn.cursor("ver_cursor")
-        ext_set = self.get_fp_anns(cur)
-        cur.close()
-        
-        cur = conn.cursor("ver_cursor")
-        ptp_set = self.get_ptp_rel(cur)
-        cur.close()
-        
+        if self.binary:
+            sql = bind_prefixes(conn, queries.ext_anns(self.ext_table, prefixes is not None), prefixes)
+            return self.load_binary(conn, sql, True)
         cur = conn.cursor("ver_cursor")
-        ptc_set = self.get_ptc_rel(cur)
+        ext_set = self.get_fp_anns(cur, prefixes)
         cur.close()
+        return ext_set
 
-        # Cleanup
-        cursor = None
-        gc.collect()
+    def load_binary(self, conn, sql, inference):
+        """Loads a query result with binary COPY.
+        Parameters:
+        conn  A psycopg2 connection
+        sql  Query of (prefix, origin, as_path[, inference length]) rows
+        inference  True for the extrapolated data set
 
+        Returns:
+        ann_dict  Dictionary as returned by load_mrt or load_ext
+        """
+        with self.metrics.stage("fetch"):
+            buf = copy_loader.copy_binary(conn, sql)
+        with self.metrics.stage("normalize") as st:
+            anns = copy_loader.Announcements(buf, inference)
+            st.add(len(anns))
+            return path_store.AnnSet.from_announcements(anns, self.prefix_table)
+
+    def verify(self, mrt_set, ext_set, rels):
+        """Generates the statistics for loaded data sets.
+        Parameters:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+        """
         # Set total vs. verifiable prefix count
         self.prefixes = len(mrt_set)
         self.verifiable = len(mrt_set)
 
         # For each prefix in the ASes MRT announcements
         print(datetime.now().strftime("%c") + ": Performing verification for " + str(self.prefixes) + " prefixes")
-        for prefix in mrt_set:
-            # MRT Path data
-            mrt_pair = mrt_set[prefix]
-            mrt_path = mrt_pair[0]
-            mrt_l = len(mrt_path)
-            mrt_origin = mrt_pair[1]
-
-            # Update MRT length stats
-            self.cur_count += 1
-            if mrt_l > self.mrt_max_len:
-                self.mrt_max_len = mrt_l
-            #TODO write avg func
-            self.mrt_avg_len = self.mrt_avg_len + (mrt_l - self.mrt_avg_len) / self.cur_count
-
-            # If AS has no extrapolated announcement for current prefix
-            if prefix not in ext_set:
-                # Classify the failure
-                self.pref_f += 1
-                self.pref_f_set.append((prefix,mrt_origin))
-                # Verifiable failer
-                self.ver_count += 1
-                # Immediate failure for K compare
-                self.l[0] += 1
-                # Levenshtein distance is length of real path
-                cur_distance= len(mrt_path)
-                self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
-                self.levenshtein_d.append(cur_distance)
-                continue;
-            
-            # Extrapolated path data
-            ext_triple = ext_set[prefix]
-            ext_path = ext_triple[0]
-            ext_l = len(ext_path)
-            ext_origin = ext_triple[1]
-            ext_inference_l = ext_triple[2]
-
-            # If AS has no extrapolated announcement for current origin
-            if mrt_origin != ext_origin:
-                # Classify the failure
-                self.orig_f += 1
-                # Verifiable failer
-                self.ver_count += 1
-                # Immediate failure for K compare
-                self.l[0] += 1
-                # Levenshtein distance is length of real path
-                cur_distance= len(mrt_path)
-                self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
-                self.levenshtein_d.append(cur_distance)
-                continue;
-
-            # If extrapolated path is complete
-            if (ext_path != None):
-                # Update extrapolated length stats
-                self.ver_count += 1
-                if ext_l > self.ext_max_len:
-                    self.ext_max_len = ext_l
-                self.ext_avg_len = self.ext_avg_len + (ext_l - self.ext_avg_len) / self.cur_count
-
-                # K Compare paths
-                mrt_path.reverse()
-                ext_path.reverse()
-                self.k_compare(mrt_path, ext_path, ext_inference_l, ptp_set, ptc_set)
-
-                # Levenshtein compare
-                cur_distance = Verifier.levenshtein_opt(mrt_path, ext_path)
-                self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
-                self.levenshtein_d.append(cur_distance)
-                
-                # Classify Failure
-                if cur_distance != 0:
-                    self.compare_f += 1
+        with self.metrics.stage("compare", self.prefixes):
+            if self.batch:
+                self.compare_batch(mrt_set, ext_set, rels)
             else:
-                # Classify Failure
-                self.traceback_f += 1
+                self.compare(mrt_set, ext_set, rels)
+        # Failure diagnostics beyond the comparison are timed on their own
+        with self.metrics.stage("diagnose", self.prefixes):
+            self.classify_missing(mrt_set, ext_set)
+            self.check_paths(mrt_set, ext_set, rels)
+
+    def skip_diagnostics(self):
+        """Marks the diagnostics of classify_missing and check_paths as not computed.
+
+        Streaming, incremental and server side runs do not hold every path, so
+        their results carry results.NOT_COMPUTED instead of zero counts.
+        """
+        for name in results.DIAGNOSTICS:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                setattr(self, name, [results.NOT_COMPUTED] * len(value))
+            else:
+                setattr(self, name, results.NOT_COMPUTED)
+
+    def diagnosed(self):
+        """Returns False if the diagnostics were skipped, see skip_diagnostics."""
+        return self.mrt_valley_f != results.NOT_COMPUTED
+
+    def classify_missing(self, mrt_set, ext_set):
+        """Splits the missing prefix failures by what the extrapolated set holds around them.
+
+        Each MRT prefix without an extrapolated announcement is looked up in a
+        trie of the extrapolated prefixes, and counted in pref_cover_f as covered
+        by a less specific, split into more specifics or absent. In traceback
+        mode the extrapolated set only holds MRT prefixes.
+
+        Parameters:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        """
+        table = self.prefix_table
+        if (isinstance(mrt_set, path_store.AnnSet) and isinstance(ext_set, path_store.AnnSet) and
+                mrt_set.table is ext_set.table):
+            table = mrt_set.table
+            mrt_ids = mrt_set.prefix_ids()
+            missing = mrt_ids[ext_set.rows(mrt_ids) < 0]
+            ext_ids = ext_set.prefix_ids()
+        else:
+            missing = table.intern_many([prefix for prefix in mrt_set if prefix not in ext_set])
+            ext_ids = table.intern_many(list(ext_set))
+        counts = prefix_trie.classify_ids(table, missing, ext_ids)
+        for i in range(len(self.pref_cover_f)):
+            self.pref_cover_f[i] += int(counts[i])
+
+    def check_paths(self, mrt_set, ext_set, rels):
+        """Checks every hop of every MRT and extrapolated path against the relationships.
+
+        Hops without a relationship are counted by their index from the origin
+        in mrt_rel_f and ext_rel_f, and paths that are not valley free in
+        mrt_valley_f and ext_valley_f. Each distinct path is checked once.
+
+        Parameters:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+        """
+        if (isinstance(mrt_set, path_store.AnnSet) and isinstance(ext_set, path_store.AnnSet) and
+                mrt_set.table is ext_set.table):
+            prefixes = mrt_set.prefix_ids()
+        else:
+            prefixes = list(mrt_set)
+        graph = rels.graph()
+        for anns, hop_f, valley_f in ((mrt_set, self.mrt_rel_f, "mrt_valley_f"),
+                                      (ext_set, self.ext_rel_f, "ext_valley_f")):
+            cols = path_store.columns(anns, prefixes)
+            path_ids, counts = np.unique(cols.path_ids[cols.path_ids >= 0], return_counts=True)
+            if not len(path_ids):
+                continue
+            _, missing, valley = graph.check_paths(*cols.store.pack(path_ids, reverse=True))
+            # Each path counts once per prefix it is the path of
+            per_hop = counts @ missing[:, :len(hop_f)]
+            for i in range(len(per_hop)):
+                hop_f[i] += int(per_hop[i])
+            setattr(self, valley_f, getattr(self, valley_f) + int(counts[valley].sum()))
+
+    def verify_stream(self, conn, rels, itersize = stream.ITERSIZE):
+        """Generates the statistics by merge joining both tables in prefix order.
+
+        Only the current prefix of each table is held in memory.
+
+        Parameters:
+        conn  A psycopg2 connection
+        rels  RelationshipIndex of CAIDA relationships
+        itersize  Rows fetched per round trip
+        """
+        print(datetime.now().strftime("%c") + ": Streaming verification of " + self.ext_table)
+        self.skip_diagnostics()
+        mrt_rows = stream.first_per_prefix(stream.iter_rows(
+            conn, "mrt_cursor", queries.mrt_anns(self.mrt_table), itersize))
+        ext_rows = stream.first_per_prefix(stream.iter_rows(
+            conn, "ext_cursor", queries.ext_anns(self.ext_table), itersize))
+        # Fetching is interleaved with comparison, so the whole join is timed as the compare stage
+        with self.metrics.stage("compare") as st:
+            for prefix, mrt_ann, ext_ann in stream.merge_join(mrt_rows, ext_rows):
+                self.prefixes += 1
+                self.verifiable += 1
+                ext_triple = None if ext_ann is None else self.ext_entry(ext_ann)
+                self.compare_prefix(prefix, self.mrt_entry(mrt_ann), ext_triple, rels)
+            st.add(self.prefixes)
+        print(datetime.now().strftime("%c") + ": Verified " + str(self.prefixes) + " prefixes")
+
+    def verify_incremental(self, conn, rels, store_dir = incremental.STORE_DIR):
+        """Generates the statistics, recomparing only prefixes whose rows changed.
+
+        Outcomes of the previous run are kept in store_dir with a hash of the
+        rows they came from. Counters are rebuilt from every outcome in prefix
+        order, so they match a full batch run.
+
+        Parameters:
+        conn  A psycopg2 connection
+        rels  RelationshipIndex of CAIDA relationships
+        store_dir  Directory of the stored outcomes
+        """
+        self.skip_diagnostics()
+        store = incremental.OutcomeStore.load(path.join(store_dir, self.ext_table + ".npz"), rels.digest())
+        with self.metrics.stage("fetch") as st:
+            prefixes, mrt_hash, ext_hash = incremental.fetch_hashes(conn, self.mrt_table, self.ext_table)
+            st.add(len(prefixes))
+        changed = store.changed(prefixes, mrt_hash, ext_hash)
+        todo = prefixes[changed].tolist()
+        print(datetime.now().strftime("%c") + ": Recomparing " + str(len(todo)) + " of " +
+              str(len(prefixes)) + " prefixes")
+        outcomes = incremental.empty_outcomes(0)
+        if todo:
+            # With nothing kept, such as on a first run, the tables are loaded whole
+            only = None if changed.all() else todo
+            mrt_set = self.load_mrt(conn, only)
+            ext_set = self.load_ext(conn, only)
+            with self.metrics.stage("compare", len(todo)):
+                outcomes = self.prefix_outcomes(todo, mrt_set, ext_set, rels)
+        outcomes = store.update(prefixes, mrt_hash, ext_hash, changed, outcomes)
+        store.save()
+
+        self.prefixes = len(prefixes)
+        self.verifiable = len(prefixes)
+        self.add_outcomes(outcomes)
+
+    def verify_server(self, conn):
+        """Generates the statistics from outcomes computed by the database.
+
+        Only counts of identical outcomes and the paths of prefixes that differ
+        are fetched, see queries.server_outcomes. Edit distances of those are
+        computed here. Relationships are checked against the database tables.
+
+        Parameters:
+        conn  A psycopg2 connection
+        """
+        print(datetime.now().strftime("%c") + ": Server side verification of " + self.ext_table)
+        self.skip_diagnostics()
+        with self.metrics.stage("fetch") as st:
+            cur = conn.cursor()
+            cur.execute(queries.server_outcomes(self.mrt_table, self.ext_table))
+            rows = cur.fetchall()
+            cur.close()
+            st.add(len(rows))
+        with self.metrics.stage("compare") as st:
+            outcomes = summary_outcomes(rows)
+            st.add(len(outcomes["cls"]))
+            self.prefixes = len(outcomes["cls"])
+            self.verifiable = len(outcomes["cls"])
+            self.add_outcomes(outcomes)
+        print(datetime.now().strftime("%c") + ": Verified " + str(self.prefixes) + " prefixes from " +
+              str(len(rows)) + " rows")
+
+    def compare(self, mrt_set, ext_set, rels):
+        """Compares the MRT and extrapolated paths one prefix at a time.
+        Parameters:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+        """
+        for prefix in mrt_set:
+            self.compare_prefix(prefix, mrt_set[prefix], ext_set.get(prefix), rels)
+
+    def compare_prefix(self, prefix, mrt_pair, ext_triple, rels):
+        """Compares the MRT and extrapolated paths of a single prefix.
+        Parameters:
+        prefix  The prefix being compared
+        mrt_pair  Tuple of (as_path, origin) from the control set
+        ext_triple  Tuple of (as_path, origin, inference length), or None if not extrapolated
+        rels  RelationshipIndex of CAIDA relationships
+        """
+        # MRT Path data
+        mrt_path = mrt_pair[0]
+        mrt_l = len(mrt_path)
+        mrt_origin = mrt_pair[1]
+
+        # Update MRT length stats
+        self.cur_count += 1
+        if mrt_l > self.mrt_max_len:
+            self.mrt_max_len = mrt_l
+        #TODO write avg func
+        self.mrt_avg_len = self.mrt_avg_len + (mrt_l - self.mrt_avg_len) / self.cur_count
+
+        # If AS has no extrapolated announcement for current prefix
+        if ext_triple is None:
+            # Classify the failure
+            self.pref_f += 1
+            # Verifiable failer
+            self.ver_count += 1
+            # Immediate failure for K compare
+            self.l[0] += 1
+            # Levenshtein distance is length of real path
+            cur_distance= len(mrt_path)
+            self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
+            self.levenshtein_d.add(cur_distance)
+            return
         
-    def output(self):
-        """Outputs stats for this AS to a .csv file."""
-        # TODO Make multiprocess safe
-        if (self.oo == 0):
-            fn = "results/full_verified.csv"
-        elif (self.oo == 1):
-            fn = "results/origin_verified.csv"
+        # Extrapolated path data
+        ext_path = ext_triple[0]
+        ext_origin = ext_triple[1]
+        ext_inference_l = ext_triple[2]
+
+        # If AS has no extrapolated announcement for current origin
+        if mrt_origin != ext_origin:
+            # Classify the failure
+            self.orig_f += 1
+            # Verifiable failer
+            self.ver_count += 1
+            # Immediate failure for K compare
+            self.l[0] += 1
+            # Levenshtein distance is length of real path
+            cur_distance= len(mrt_path)
+            self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
+            self.levenshtein_d.add(cur_distance)
+            return
+
+        # If extrapolated path is complete
+        if (ext_path != None):
+            # Update extrapolated length stats
+            ext_l = len(ext_path)
+            self.ver_count += 1
+            if ext_l > self.ext_max_len:
+                self.ext_max_len = ext_l
+            self.ext_avg_len = self.ext_avg_len + (ext_l - self.ext_avg_len) / self.cur_count
+
+            # K Compare paths
+            mrt_path = mrt_path[::-1]
+            ext_path = ext_path[::-1]
+            self.k_compare(mrt_path, ext_path, ext_inference_l, rels)
+
+            # Levenshtein compare
+            cur_distance = Verifier.levenshtein_opt(mrt_path, ext_path)
+            self.levenshtein_avg = self.levenshtein_avg + (cur_distance - self.levenshtein_avg) / self.ver_count
+            self.levenshtein_d.add(cur_distance)
+            
+            # Classify Failure
+            if cur_distance != 0:
+                self.compare_f += 1
+        else:
+            # Classify Failure
+            self.traceback_f += 1
+            self.verifiable -= 1
+
+    def compare_batch(self, mrt_set, ext_set, rels):
+        """Vectorized equivalent of compare, processing every prefix at once.
+        Parameters:
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+        """
+        if not mrt_set:
+            return
+        if (isinstance(mrt_set, path_store.AnnSet) and isinstance(ext_set, path_store.AnnSet) and
+                mrt_set.table is ext_set.table):
+            # Sets sharing a PrefixTable are joined by id
+            prefixes = mrt_set.prefix_ids()
         else:
-            fn = "results/no_prop_verified.csv"
+            prefixes = list(mrt_set)
+        self.add_outcomes(self.prefix_outcomes(prefixes, mrt_set, ext_set, rels))
+
+    def prefix_outcomes(self, prefixes, mrt_set, ext_set, rels):
+        """Compares every prefix without touching the counters.
+        Parameters:
+        prefixes  List of prefixes to compare, all in mrt_set, or an array of
+                  their ids when both sets share a PrefixTable
+        mrt_set  Dictionary of {prefix: (as_path, origin)}
+        ext_set  Dictionary of {prefix: (as_path, origin, inference length)}
+        rels  RelationshipIndex of CAIDA relationships
+
+        Returns:
+        outcomes  Dictionary of per prefix arrays, see incremental.OUTCOME_FIELDS.
+        """
+        n = len(prefixes)
+        mrt = path_store.columns(mrt_set, prefixes)
+        ext = path_store.columns(ext_set, prefixes)
+        outcomes = incremental.empty_outcomes(n)
+        outcomes["mrt_l"] = mrt.store.lengths(mrt.path_ids)
+
+        # Classify missing prefix, origin and traceback failures
+        missing = ~ext.found
+        orig = ext.found & (ext.origins != mrt.origins)
+        tb_fail = ext.found & (ext.path_ids < 0) & ~orig
+        outcomes["cls"][missing] = incremental.MISSING
+        outcomes["cls"][orig] = incremental.ORIGIN
+        outcomes["cls"][tb_fail] = incremental.TRACEBACK
+        comp = np.flatnonzero(~(missing | orig | tb_fail))
+        outcomes["distance"] = outcomes["mrt_l"].copy()
+        if not len(comp):
+            return outcomes
+
+        # Each distinct pair of MRT and extrapolated paths is compared once
+        width = max(len(ext.store), 1)
+        pairs, inverse = np.unique(mrt.path_ids[comp] * width + ext.path_ids[comp], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        mrt_m, mrt_l = mrt.store.pack(pairs // width, reverse=True)
+        ext_m, ext_l = ext.store.pack(pairs % width, reverse=True)
+
+        # K Compare paths
+        first, has_diff = batch_compare.first_diff(mrt_m, mrt_l, ext_m, ext_l)
+        # Absent relationship check
+        missing_rel = np.zeros(len(pairs), dtype=bool)
+        rows = np.flatnonzero(has_diff)
+        hops = first[rows]
+        missing_rel[rows] = ~rels.rel_mask(mrt_m[rows, hops], ext_m[rows, hops])
+        # Levenshtein distance is length of real path unless compared
+        pair_d = np.abs(mrt_l - ext_l)
+        pair_d[has_diff] = batch_compare.distances(mrt_m[has_diff], mrt_l[has_diff],
+                                                   ext_m[has_diff], ext_l[has_diff])
+
+        outcomes["ext_l"][comp] = ext_l[inverse]
+        outcomes["first"][comp] = first[inverse]
+        outcomes["has_diff"][comp] = has_diff[inverse]
+        # The inference check depends on the prefix, not only on its paths
+        outcomes["prop"][comp] = has_diff[inverse] & (ext_l[inverse] - first[inverse] <= ext.inference_l[comp])
+        outcomes["missing_rel"][comp] = missing_rel[inverse]
+        outcomes["distance"][comp] = pair_d[inverse]
+        return outcomes
+
+    def add_outcomes(self, outcomes):
+        """Adds per prefix outcomes to the counters, in order.
+        Parameters:
+        outcomes  Dictionary of per prefix arrays, as returned by prefix_outcomes
+        """
+        cls = outcomes["cls"]
+        n = len(cls)
+        if n == 0:
+            return
+        mrt_len = outcomes["mrt_l"]
+        counts = np.arange(self.cur_count + 1, self.cur_count + n + 1)
+
+        # Update MRT length stats
+        self.mrt_max_len = max(self.mrt_max_len, int(mrt_len.max()))
+        self.mrt_avg_len = batch_compare.running_mean(self.mrt_avg_len, mrt_len.tolist(), counts.tolist())
+
+        missing = cls == incremental.MISSING
+        orig = cls == incremental.ORIGIN
+        tb_fail = cls == incremental.TRACEBACK
+        comp = np.flatnonzero(cls == incremental.COMPARED)
+        self.pref_f += int(np.count_nonzero(missing))
+        self.orig_f += int(np.count_nonzero(orig))
+        # Immediate failure for K compare
+        self.l[0] += int(np.count_nonzero(missing | orig))
+        # Failed tracebacks have no extrapolated path and are not verifiable
+        self.traceback_f += int(np.count_nonzero(tb_fail))
+        self.verifiable -= int(np.count_nonzero(tb_fail))
+
+        # Update extrapolated length stats
+        ext_l = outcomes["ext_l"][comp]
+        if len(comp):
+            self.ext_max_len = max(self.ext_max_len, int(ext_l.max()))
+        self.ext_avg_len = batch_compare.running_mean(self.ext_avg_len, ext_l.tolist(), counts[comp].tolist())
+
+        # K Compare counters
+        k, l, seed_f, prop_f = batch_compare.k_counts(
+            outcomes["first"][comp], outcomes["has_diff"][comp], outcomes["prop"][comp], ext_l, len(self.k))
+        for i in range(len(self.k)):
+            self.k[i] += int(k[i])
+            self.l[i] += int(l[i])
+            self.seed_f[i] += int(seed_f[i])
+            self.prop_f[i] += int(prop_f[i])
+        self.missing_f += int(np.count_nonzero(outcomes["missing_rel"]))
+
+        # Levenshtein distances of every verifiable prefix
+        distance = outcomes["distance"][~tb_fail].tolist()
+        self.levenshtein_avg = batch_compare.running_mean(
+            self.levenshtein_avg, distance, range(self.ver_count + 1, self.ver_count + len(distance) + 1))
+        self.levenshtein_d.add_many(distance)
+
+        # Classify Failure
+        self.compare_f += int(np.count_nonzero(outcomes["distance"][comp]))
+        self.ver_count += len(distance)
+        self.cur_count += n
+
+    def output(self, shard_dir = None):
+        """Outputs stats for this AS to a .csv file.
+        Parameters:
+        shard_dir  If set, write to this AS's own shard files instead of appending
+                   to the shared results, so concurrent runs never interleave.
+                   See results.merge_shards.
+        """
+        with self.metrics.stage("output"):
+            self.write_output(shard_dir)
+        self.metrics.write()
+
+    def write_output(self, shard_dir = None):
+        """Writes the stats of this AS, see output."""
+        name = results.MODE_FILES[self.oo]
+        if shard_dir is None:
+            fn = path.join(results.RESULTS_DIR, name + ".csv")
+        else:
+            fn = results.shard_name(shard_dir, self.ctrl_AS, name) + ".csv"
 
         print(datetime.now().strftime("%c") + ": Writing output to " + fn)
         
-        if (path.exists(fn)):
-            f = open(fn, "a+")
-        else:
-            f = open(fn, "w+")
+        f = io.StringIO()
         
         if (self.oo == 0):
             f.write("%s\n" % self.ctrl_AS)
@@ -524,10 +911,10 @@ class Verifier:
         f.write("%d\n" % self.traceback_f)
         f.write("%d\n" % self.compare_f)
 
-        # Levenshtein Values
+        # Levenshtein Values, then a histogram of distances
         f.write("%f\n" % self.levenshtein_avg)
         str_l = []
-        for x in self.levenshtein_d:
+        for x in self.levenshtein_d.trimmed():
             str_l.append(str(x))
         f.write(','.join(str_l))
         f.write("\n")
@@ -547,8 +934,50 @@ class Verifier:
         f.write(','.join(str_l)) 
         f.write("\n")
 
-        f.close()
+        # Columnar copy for fast loading, see statistics.Trial_Set.load
+        if shard_dir is None:
+            results.append_text(fn, f.getvalue())
+            results.append(path.splitext(fn)[0] + ".npz", results.from_verifier(self))
+        else:
+            results.write_shard(path.splitext(fn)[0], f.getvalue(), results.from_verifier(self))
     
+    def merge(self, other):
+        """Adds the stats of another Verifier of the same mode, such as a shard of the prefixes."""
+        self.prefixes += other.prefixes
+        self.verifiable += other.verifiable
+        self.mrt_avg_len = sketch.merge_mean(self.mrt_avg_len, self.cur_count,
+                                             other.mrt_avg_len, other.cur_count)
+        # ext_avg_len steps by the prefix count, so this is only approximate
+        self.ext_avg_len = sketch.merge_mean(self.ext_avg_len, self.cur_count,
+                                             other.ext_avg_len, other.cur_count)
+        self.cur_count += other.cur_count
+        self.mrt_max_len = max(self.mrt_max_len, other.mrt_max_len)
+        self.ext_max_len = max(self.ext_max_len, other.ext_max_len)
+        self.k = sketch.merge_counts(self.k, other.k)
+        self.l = sketch.merge_counts(self.l, other.l)
+        self.correct_hops += other.correct_hops
+        self.incorrect_hops += other.incorrect_hops
+        self.levenshtein_avg = sketch.merge_mean(self.levenshtein_avg, self.ver_count,
+                                                 other.levenshtein_avg, other.ver_count)
+        self.ver_count += other.ver_count
+        self.levenshtein_d.merge(other.levenshtein_d)
+        self.pref_f += other.pref_f
+        self.orig_f += other.orig_f
+        self.traceback_f += other.traceback_f
+        self.compare_f += other.compare_f
+        self.missing_f += other.missing_f
+        self.seed_f = sketch.merge_counts(self.seed_f, other.seed_f)
+        self.prop_f = sketch.merge_counts(self.prop_f, other.prop_f)
+        if self.diagnosed() and other.diagnosed():
+            self.pref_cover_f = sketch.merge_counts(self.pref_cover_f, other.pref_cover_f)
+            self.mrt_rel_f = sketch.merge_counts(self.mrt_rel_f, other.mrt_rel_f)
+            self.ext_rel_f = sketch.merge_counts(self.ext_rel_f, other.ext_rel_f)
+            self.mrt_valley_f += other.mrt_valley_f
+            self.ext_valley_f += other.ext_valley_f
+        else:
+            self.skip_diagnostics()
+        return self
+
     def output_cli(self):
         """Outputs stats for this AS to the CLI."""
         print("%s" % self.ctrl_AS)
@@ -575,6 +1004,110 @@ class Verifier:
         print("%f" % self.levenshtein_avg)
 
 
+
+def bind_prefixes(conn, sql, prefixes):
+    """Fills in the prefix filter of a query, see queries.PREFIX_FILTER."""
+    if prefixes is None:
+        return sql
+    cur = conn.cursor()
+    sql = cur.mogrify(sql, {"prefixes": list(prefixes)}).decode()
+    cur.close()
+    return sql
+
+
+def summary_outcomes(rows):
+    """Expands the rows of queries.server_outcomes into per prefix outcomes.
+
+    Outcomes are put back in control prefix order, so the running means of
+    add_outcomes match the other engines.
+
+    Returns:
+    outcomes  Dictionary of per prefix arrays, see incremental.OUTCOME_FIELDS.
+    """
+    # The first columns are in the order of incremental.OUTCOME_FIELDS
+    counts = np.array([row[8] for row in rows], dtype=np.int64)
+    outcomes = {}
+    for col, (name, dtype) in enumerate(incremental.OUTCOME_FIELDS):
+        values = np.array([0 if row[col] is None else row[col] for row in rows], dtype=dtype)
+        outcomes[name] = np.repeat(values, counts)
+    positions = np.fromiter(chain.from_iterable(row[9] for row in rows), dtype=np.int64, count=int(counts.sum()))
+
+    # Prefixes that differ are returned one per row with both paths
+    diff = np.flatnonzero(np.repeat(np.array([row[10] is not None for row in rows], dtype=bool), counts))
+    if len(diff):
+        diff_rows = [row for row in rows if row[10] is not None]
+        mrt_m, mrt_l = batch_compare.pack_paths([list(row[10]) for row in diff_rows], reverse=True)
+        ext_m, ext_l = batch_compare.pack_paths([list(row[11]) for row in diff_rows], reverse=True)
+        outcomes["distance"][diff] = batch_compare.distances(mrt_m, mrt_l, ext_m, ext_l)
+    order = np.argsort(positions, kind="stable")
+    return {name: values[order] for name, values in outcomes.items()}
+
+
+class MultiVerifier:
+    """This class performs verification of every mode for a single AS.
+
+    The MRT control set is loaded once and compared against the full, origin
+    only and MRT only extrapolation tables in sequence.
+    """
+
+    def __init__(self, asn, trial, modes = (0, 1, 2), trace_back = False, batch = False, stream = False,
+                 binary = False, tb_budget = None, store_dir = None, server = False, concurrent_load = False):
+        """Parameters:
+        asn  A string or int representation of 32 bit ASN.
+        trial  Trial name used in the table names.
+        modes  The origin_only values to verify.
+        concurrent_load  If True, fetch the first extrapolated set alongside the control
+                         set and relationships, see Verifier.load_concurrent.
+
+        The other parameters are passed to every Verifier.
+        """
+        self.ctrl_AS = int(asn)
+        self.verifiers = [Verifier(asn, mode, trial, trace_back, batch, stream, binary, tb_budget, store_dir,
+                                   server, concurrent_load) for mode in modes]
+        # The control set is loaded once, so every mode interns into its prefix table
+        for v in self.verifiers[1:]:
+            v.prefix_table = self.verifiers[0].prefix_table
+
+    def run(self, db_slots = None):
+        """Runs every mode.
+        Parameters:
+        db_slots  Optional semaphore held while connected to the database
+        """
+        if db_slots is None:
+            db_slots = nullcontext()
+        first = self.verifiers[0]
+        if (first.stream or first.store_dir or first.server) and not first.tb:
+            # Streaming, incremental and server side runs read the control set alongside each extrapolation table
+            for v in self.verifiers:
+                with db_slots:
+                    v.run()
+            return
+
+        ext_set = None
+        with db_slots, first.connection() as conn:
+            if first.concurrent_load:
+                mrt_set, ext_set, rels = first.load_concurrent(conn)
+            else:
+                mrt_set = first.load_mrt(conn)
+                rels = relationships.shared_index(conn)
+
+        for v in self.verifiers:
+            if ext_set is None:
+                with db_slots, v.connection() as conn:
+                    if v.tb:
+                        ext_set = v.load_traced(conn, mrt_set)
+                    else:
+                        ext_set = v.load_ext(conn)
+            v.verify(mrt_set, ext_set, rels)
+            ext_set = None
+            gc.collect()
+
+    def output(self, shard_dir = None):
+        """Outputs stats for every mode to their .csv files, see Verifier.output."""
+        for v in self.verifiers:
+            v.output(shard_dir)
+
+
 def main():
     """Generates stats for a set of ASes using multi-processing.
     